@@ -0,0 +1,133 @@
+"""Upload and ingestion-job endpoints.
+
+Every upload becomes a job (see ``api.services.ingest_jobs``). By default
+the request waits for the job and answers as before; with ``background``
+set it returns ``202`` and the job id at once, and the job is followed on
+``GET /api/ingest/jobs/{id}`` and cancelled with ``DELETE``.
+
+The server provides ``app.state.db``, ``app.state.ingest_jobs`` (the
+``IngestJobManager``), ``app.state.index_keys(table)`` and an async
+``app.state.ingest_finished(job)`` hook that brings its caches up to date.
+"""
+import asyncio
+import shutil
+
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+from api.services.dataset_registry import check_name
+from api.services.document_processor import UPLOAD_MODES
+from api.services.ingest_jobs import ACTIVE_STATES, FINISHED_STATES, JobCapacityError
+
+router = APIRouter()
+
+
+def spool_upload(file: UploadFile, path: str) -> int:
+    """Copy the upload to ``path`` for the pool worker; returns its size in bytes."""
+    file.file.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file.file, out, 1024 * 1024)
+        return out.tell()
+
+
+def upload_response(job: dict) -> dict:
+    """The synchronous upload response, from a finished job."""
+    if job["state"] == "cancelled":
+        raise HTTPException(status_code=409, detail="Upload cancelled")
+    if job["state"] != "succeeded":
+        status = 400 if job.get("error_kind") == "invalid" else 500
+        raise HTTPException(status_code=status, detail=f"Upload failed: {job.get('error')}")
+    outcome = job["result"]
+    merged = outcome["ingestion"]["mode"] != "replace"
+    return {
+        "success": True,
+        "message": (f"Successfully merged {job['filename']} into {outcome['table_name']}" if merged
+                    else f"Successfully uploaded {job['filename']}"),
+        "table_name": outcome["table_name"],
+        "rows_processed": outcome["ingestion"]["rows"],
+        "columns": outcome["columns"],
+        "schema_version": outcome["generation"],
+        "job_id": job["id"],
+        "ingestion": outcome["ingestion"]
+    }
+
+
+@router.post("/api/upload")
+async def upload_csv_file(request: Request, file: UploadFile = File(...), mode: str = Form("replace"),
+                          key: str = Form(None), table: str = Form(None), dataset: str = Form(None),
+                          background: bool = Form(False)):
+    """Load a CSV file into a named dataset and make it the default.
+
+    ``mode`` is ``replace`` (default), ``append`` or ``upsert``; ``key`` names the
+    column used to skip (append) or overwrite (upsert) existing rows, and
+    ``dataset`` (or ``table``) the dataset to load when it differs from the file name.
+    With ``background``, answers 202 with a job id instead of waiting for the load.
+    """
+    state = request.app.state
+    manager = state.ingest_jobs
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Only CSV files are allowed")
+    if mode not in UPLOAD_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(UPLOAD_MODES)}")
+
+    try:
+        # Create table name from filename
+        table_name = check_name(dataset or table or
+                                file.filename.replace('.csv', '').replace(' ', '_').replace('-', '_').lower())
+        job = manager.new_job(table_name, file.filename, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Upload failed: {str(e)}")
+    except JobCapacityError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    spool_path = manager.spool_path(job)
+    try:
+        job.total_bytes = await asyncio.to_thread(spool_upload, file, spool_path)
+        await state.db.write(manager.store.insert, job)
+    except Exception as e:
+        manager.discard(spool_path)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    running = manager.submit(manager.task(job, spool_path, key, state.index_keys(table_name)),
+                             state.ingest_finished)
+
+    if background:
+        return JSONResponse(status_code=202, content={
+            "success": True,
+            "message": f"Ingesting {file.filename} into {table_name}",
+            "job_id": job.id,
+            "status_url": f"/api/ingest/jobs/{job.id}",
+            "job": job.to_dict()
+        })
+    return upload_response(await asyncio.shield(running))
+
+
+@router.get("/api/ingest/jobs")
+async def list_ingest_jobs(request: Request, state: str = None, limit: int = 50):
+    if state is not None and state not in ACTIVE_STATES + FINISHED_STATES:
+        raise HTTPException(status_code=400, detail=f"state must be one of: {', '.join(ACTIVE_STATES + FINISHED_STATES)}")
+    manager = request.app.state.ingest_jobs
+    jobs = await request.app.state.db.read(manager.store.list, state, max(1, min(limit, 500)))
+    return {"success": True, "jobs": [job.to_dict() for job in jobs]}
+
+
+@router.get("/api/ingest/jobs/{job_id}")
+async def get_ingest_job(request: Request, job_id: str):
+    manager = request.app.state.ingest_jobs
+    job = await request.app.state.db.read(manager.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown ingestion job '{job_id}'")
+    return {"success": True, "job": job.to_dict()}
+
+
+@router.delete("/api/ingest/jobs/{job_id}")
+async def cancel_ingest_job(request: Request, job_id: str):
+    """Ask a queued or running job to stop; it rolls back to the dataset as it was."""
+    state = request.app.state
+    store = state.ingest_jobs.store
+    if not await state.db.write(store.request_cancel, job_id):
+        job = await state.db.read(store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown ingestion job '{job_id}'")
+        raise HTTPException(status_code=409, detail=f"Job already {job.state}")
+    job = await state.db.read(store.get, job_id)
+    return {"success": True, "message": f"Cancellation requested for job {job_id}", "job": job.to_dict()}
@@ -0,0 +1,76 @@
+"""Answering many natural-language questions in one request.
+
+Dashboards ask 20-40 questions at once. A batch resolves the table schema
+once and answers each question from the translation cache, the rule
+engine or learned patterns where it can. The remaining questions go to the
+LLM concurrently, at most ``max_concurrent_llm_calls`` at a time. All
+generated SQL is then validated on one read connection. Items found in the
+result cache or answered by the columnar engine come from the data version
+the batch started with; the remaining statements run on one read
+connection inside a single read transaction, so those share one snapshot.
+A failed item is reported in its own slot and does not fail the batch.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+
+@dataclass
+class BatchConfig:
+    max_queries: int = 50
+    max_concurrent_llm_calls: int = 8
+
+    @classmethod
+    def from_config(cls, config: dict) -> "BatchConfig":
+        section = config.get("batch_query", {})
+        return cls(
+            max_queries=max(1, int(section.get("max_queries", 50))),
+            max_concurrent_llm_calls=max(1, int(section.get("max_concurrent_llm_calls", 8))),
+        )
+
+
+@dataclass
+class BatchItem:
+    """One question of a batch and everything learned while answering it."""
+    index: int
+    query: str
+    id: Optional[str] = None
+    cache_key: Optional[str] = None
+    sql: Optional[str] = None
+    sql_source: Optional[str] = None
+    confidence: float = 0.0
+    match: object = None  # PatternMatch from the rule engine
+    reused: object = None  # learned pattern reused for a paraphrase
+    prompt: Optional[str] = None
+    prompt_tokens: Optional[dict] = None
+    fallback_reason: Optional[str] = None
+    repairs: List[str] = field(default_factory=list)
+    result: object = None  # GuardedResult
+    cached: bool = False
+    error: Optional[str] = None
+    guard: Optional[dict] = None
+
+    @classmethod
+    def parse(cls, index: int, entry) -> "BatchItem":
+        """Accept ``"question"`` or ``{"query": "question", "id": "tile-3"}``."""
+        if isinstance(entry, str):
+            return cls(index, entry.strip())
+        if isinstance(entry, dict):
+            ident = entry.get("id")
+            return cls(index, str(entry.get("query") or "").strip(), None if ident is None else str(ident))
+        raise ValueError(f"Item {index} must be a string or an object with a 'query'")
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.result is not None
+
+
+async def gather_limited(calls: List[Callable[[], Awaitable]], limit: int) -> list:
+    """Await ``call()`` for every call, at most ``limit`` at a time, keeping order."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(call):
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(run(call) for call in calls))
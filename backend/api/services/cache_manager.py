@@ -0,0 +1,171 @@
+"""Caches for NL->SQL translations and query results.
+
+``LRUCache`` is a bounded, optionally time-limited mapping with hit, miss
+and eviction counters. ``SingleFlight`` collapses identical concurrent
+calls into one in-flight coroutine, so a burst of the same question costs
+a single LLM round trip. ``QueryCacheManager`` ties both together with the
+key conventions used by the API:
+
+* translations are keyed by the normalized question plus the table's
+  schema fingerprint, so a schema change never reuses stale SQL;
+* results are keyed by the SQL text plus the catalog data version, so any
+  write invalidates them implicitly.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+_MISSING = object()
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return _WS_RE.sub(" ", question.strip().lower()).rstrip(" ?.!;")
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL."""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, name: str = "cache"):
+        self.name = name
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SingleFlight:
+    """De-duplicate concurrent coroutine calls that share a key."""
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _t, k=key: self._calls.pop(k, None))
+        else:
+            self.shared += 1
+        # Shield so one cancelled caller does not cancel the call for the others.
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "started": self.started, "shared": self.shared}
+
+
+class QueryCacheManager:
+    """Translation cache, optional result cache and LLM call de-duplication."""
+
+    def __init__(
+        self,
+        translation_size: int = 10000,
+        translation_ttl: Optional[float] = 3600.0,
+        result_cache_enabled: bool = True,
+        result_size: int = 256,
+        result_ttl: Optional[float] = 300.0,
+        result_max_rows: int = 1000,
+    ):
+        self.translations = LRUCache(translation_size, translation_ttl, name="translations")
+        self.results = LRUCache(result_size, result_ttl, name="results") if result_cache_enabled else None
+        self.result_max_rows = result_max_rows
+        self.flights = SingleFlight()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "QueryCacheManager":
+        patterns = config.get("pattern_cache", {})
+        results = config.get("result_cache", {})
+        return cls(
+            translation_size=patterns.get("max_cache_size", 10000),
+            translation_ttl=patterns.get("translation_ttl_seconds", 3600.0),
+            result_cache_enabled=results.get("enabled", True),
+            result_size=results.get("max_entries", 256),
+            result_ttl=results.get("ttl_seconds", 300.0),
+            result_max_rows=results.get("max_rows", 1000),
+        )
+
+    @staticmethod
+    def translation_key(question: str, schema_fingerprint: str) -> tuple:
+        return (normalize_question(question), schema_fingerprint)
+
+    @staticmethod
+    def result_key(sql: str, data_version: int, params=()) -> tuple:
+        return (_WS_RE.sub(" ", sql.strip()), tuple(params), data_version)
+
+    def get_result(self, sql: str, data_version: int, params=()):
+        if self.results is None:
+            return None
+        return self.results.get(self.result_key(sql, data_version, params))
+
+    def put_result(self, sql: str, data_version: int, value, row_count: int, params=()) -> None:
+        if self.results is not None and row_count <= self.result_max_rows:
+            self.results.set(self.result_key(sql, data_version, params), value)
+
+    def stats(self) -> dict:
+        return {
+            "translations": self.translations.stats(),
+            "results": self.results.stats() if self.results is not None else None,
+            "single_flight": self.flights.stats(),
+        }
@@ -0,0 +1,836 @@
+"""In-memory columnar execution for simple aggregate queries.
+
+Most questions end up as ``COUNT`` / ``SUM`` / ``AVG`` / ``MIN`` / ``MAX``
+over one table, optionally filtered and grouped. SQLite evaluates those
+row by row; here the columns of a table are kept as NumPy arrays (text as
+sorted dictionary codes) and the same SQL is answered with vectorized
+masks, ``bincount`` and ``ufunc.at``.
+
+Only a small, exactly-specified subset of SQL is accepted::
+
+    SELECT <group columns and aggregates> FROM <table>
+    [WHERE <comparisons, BETWEEN, IN, IS NULL combined with AND/OR/NOT>]
+    [GROUP BY <columns>] [ORDER BY <output columns>] [LIMIT n [OFFSET m]]
+
+Anything else (joins, expressions, ``HAVING``, ``LIKE``, mixed-type
+comparisons, non-aggregate selects) raises ``Unsupported`` and the caller
+runs the statement on SQLite instead. Only the columns a statement
+references are loaded, on first use, and dropped when the table's catalog
+entry changes. All loaded columns share a byte budget (``max_bytes``); the
+least recently used are evicted to make room, and a statement whose
+columns cannot fit, or that needs a free-text column with more than
+``max_text_distinct`` values, is left to SQLite.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.services.document_processor import layout_of, quote_identifier
+
+AGGREGATES = ("COUNT", "SUM", "TOTAL", "AVG", "MIN", "MAX")
+_COMPARATORS = ("=", "==", "!=", "<>", "<", "<=", ">", ">=")
+_KEYWORDS = {
+    "select", "from", "where", "group", "by", "order", "limit", "offset", "and", "or", "not", "as",
+    "between", "in", "is", "null", "asc", "desc", "distinct", "having", "join", "union", "like",
+}
+_TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op><=|>=|<>|!=|==|[=<>(),*;.-])
+    )""",
+    re.VERBOSE,
+)
+
+
+class Unsupported(Exception):
+    """The statement is outside the subset the columnar engine evaluates."""
+
+
+@dataclass
+class _Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+    @property
+    def lower(self) -> str:
+        return self.text.lower()
+
+
+def _tokenize(sql: str) -> List[_Token]:
+    tokens, pos = [], 0
+    sql = sql.rstrip()
+    while pos < len(sql):
+        m = _TOKEN_RE.match(sql, pos)
+        if m is None or m.end() == pos:
+            raise Unsupported(f"Cannot tokenize near {sql[pos:pos + 20]!r}")
+        kind = m.lastgroup
+        text = m.group(kind)
+        tokens.append(_Token(kind, text, m.start(kind), m.end()))
+        pos = m.end()
+    if tokens and tokens[-1].text == ";":
+        tokens.pop()
+    return tokens
+
+
+def _identifier(token: _Token) -> str:
+    if token.kind == "quoted":
+        inner = token.text[1:-1]
+        return inner.replace('""', '"') if token.text[0] == '"' else inner
+    if token.kind == "word" and token.lower not in _KEYWORDS:
+        return token.text
+    raise Unsupported(f"Expected an identifier, got {token.text!r}")
+
+
+# -- statement model ---------------------------------------------------------
+
+@dataclass
+class Aggregate:
+    fn: str
+    column: Optional[str]  # None for COUNT(*)
+    distinct: bool = False
+
+
+@dataclass
+class OutputColumn:
+    name: str
+    column: Optional[str] = None  # a group column
+    aggregate: Optional[Aggregate] = None
+    key: str = ""  # canonical form, to match ORDER BY expressions
+
+
+@dataclass
+class Condition:
+    op: str  # "cmp", "between", "in", "null", "and", "or", "not"
+    column: Optional[str] = None
+    operator: Optional[str] = None
+    values: tuple = ()
+    negated: bool = False
+    children: List["Condition"] = field(default_factory=list)
+
+
+@dataclass
+class Statement:
+    outputs: List[OutputColumn]
+    where: Optional[Condition] = None
+    group_by: List[str] = field(default_factory=list)
+    order_by: List[Tuple[int, bool]] = field(default_factory=list)  # (output index, descending)
+    limit: Optional[int] = None
+    offset: int = 0
+
+    @property
+    def columns(self) -> set:
+        """Table columns the statement reads."""
+        used = set(self.group_by)
+        for out in self.outputs:
+            if out.aggregate and out.aggregate.column:
+                used.add(out.aggregate.column)
+
+        def walk(cond):
+            if cond is None:
+                return
+            if cond.column:
+                used.add(cond.column)
+            for child in cond.children:
+                walk(child)
+
+        walk(self.where)
+        return used
+
+
+class _Parser:
+    def __init__(self, sql: str, table: str, columns: List[str]):
+        self.sql = sql
+        self.tokens = _tokenize(sql)
+        self.pos = 0
+        self.table = table
+        self.columns = {c.lower(): c for c in columns}
+
+    # token helpers
+    def peek(self, offset: int = 0) -> Optional[_Token]:
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def accept(self, *words: str) -> Optional[_Token]:
+        token = self.peek()
+        if token is not None and (token.lower in words or token.text in words) and token.kind != "quoted":
+            self.pos += 1
+            return token
+        return None
+
+    def expect(self, *words: str) -> _Token:
+        token = self.accept(*words)
+        if token is None:
+            found = self.peek().text if self.peek() else "end of statement"
+            raise Unsupported(f"Expected {' or '.join(words)}, got {found!r}")
+        return token
+
+    def next(self) -> _Token:
+        token = self.peek()
+        if token is None:
+            raise Unsupported("Unexpected end of statement")
+        self.pos += 1
+        return token
+
+    def column(self) -> str:
+        token = self.next()
+        name = _identifier(token)
+        if self.accept("."):
+            if name.lower() != self.table.lower():
+                raise Unsupported(f"Unknown table qualifier {name!r}")
+            name = _identifier(self.next())
+        if name.lower() not in self.columns:
+            raise Unsupported(f"Unknown column {name!r}")
+        return self.columns[name.lower()]
+
+    def literal(self):
+        negative = self.accept("-") is not None
+        token = self.next()
+        if token.kind == "number":
+            value = float(token.text) if re.search(r"[.eE]", token.text) else int(token.text)
+            return -value if negative else value
+        if token.kind == "string" and not negative:
+            return token.text[1:-1].replace("''", "'")
+        if token.kind == "word" and token.lower == "null":
+            raise Unsupported("Comparison with NULL")
+        raise Unsupported(f"Expected a literal, got {token.text!r}")
+
+    # grammar
+    def statement(self) -> Statement:
+        self.expect("select")
+        if self.accept("distinct", "all"):
+            raise Unsupported("SELECT DISTINCT")
+        outputs = [self.output()]
+        while self.accept(","):
+            outputs.append(self.output())
+        self.expect("from")
+        if _identifier(self.next()).lower() != self.table.lower():
+            raise Unsupported("Statement reads another table")
+        token = self.peek()
+        if token is not None and token.kind in ("word", "quoted") and token.lower not in _KEYWORDS:
+            raise Unsupported("Table aliases")
+        stmt = Statement(outputs)
+        if self.accept("where"):
+            stmt.where = self.disjunction()
+        if self.accept("group"):
+            self.expect("by")
+            stmt.group_by.append(self.group_item(outputs))
+            while self.accept(","):
+                stmt.group_by.append(self.group_item(outputs))
+        if self.accept("order"):
+            self.expect("by")
+            stmt.order_by.append(self.order_item(outputs))
+            while self.accept(","):
+                stmt.order_by.append(self.order_item(outputs))
+        if self.accept("limit"):
+            stmt.limit = self.integer()
+            if self.accept("offset"):
+                stmt.offset = self.integer()
+            elif self.accept(","):
+                stmt.offset, stmt.limit = stmt.limit, self.integer()
+        if self.peek() is not None:
+            raise Unsupported(f"Unsupported clause near {self.peek().text!r}")
+        self.validate(stmt)
+        return stmt
+
+    def integer(self) -> int:
+        token = self.next()
+        if token.kind != "number" or not token.text.isdigit():
+            raise Unsupported("LIMIT/OFFSET must be integer literals")
+        return int(token.text)
+
+    def output(self) -> OutputColumn:
+        start = self.peek().start if self.peek() else 0
+        token = self.peek()
+        nxt = self.peek(1)
+        if token is not None and token.kind == "word" and token.text.upper() in AGGREGATES and nxt and nxt.text == "(":
+            aggregate = self.aggregate()
+            out = OutputColumn(name=self.sql[start:self.tokens[self.pos - 1].end], aggregate=aggregate,
+                               key=f"{aggregate.fn}:{aggregate.distinct}:{(aggregate.column or '*').lower()}")
+        else:
+            column = self.column()
+            out = OutputColumn(name=column, column=column, key=f"col:{column.lower()}")
+        if self.accept("as"):
+            out.name = _identifier(self.next())
+        elif self.peek() is not None and self.peek().kind in ("word", "quoted") and self.peek().lower not in _KEYWORDS:
+            out.name = _identifier(self.next())
+        return out
+
+    def aggregate(self) -> Aggregate:
+        fn = self.next().text.upper()
+        self.expect("(")
+        if fn == "COUNT" and self.accept("*"):
+            self.expect(")")
+            return Aggregate(fn, None)
+        distinct = self.accept("distinct") is not None
+        if distinct and fn != "COUNT":
+            raise Unsupported(f"{fn}(DISTINCT ...)")
+        column = self.column()
+        self.expect(")")
+        return Aggregate(fn, column, distinct)
+
+    def group_item(self, outputs: List[OutputColumn]) -> str:
+        token = self.peek()
+        if token is not None and token.kind == "number":
+            index = self.integer() - 1
+            if not 0 <= index < len(outputs) or outputs[index].column is None:
+                raise Unsupported("GROUP BY position must name a column")
+            return outputs[index].column
+        return self.column()
+
+    def order_item(self, outputs: List[OutputColumn]) -> Tuple[int, bool]:
+        token = self.peek()
+        index = None
+        if token is not None and token.kind == "number":
+            index = self.integer() - 1
+        elif token is not None and token.kind == "word" and token.text.upper() in AGGREGATES \
+                and self.peek(1) is not None and self.peek(1).text == "(":
+            aggregate = self.aggregate()
+            key = f"{aggregate.fn}:{aggregate.distinct}:{(aggregate.column or '*').lower()}"
+            index = next((i for i, o in enumerate(outputs) if o.key == key), None)
+        else:
+            # Output aliases take precedence over table columns, as in SQLite.
+            name = _identifier(self.next())
+            index = next((i for i, o in enumerate(outputs) if o.name.lower() == name.lower()), None)
+            if index is None and name.lower() in self.columns:
+                index = next((i for i, o in enumerate(outputs) if o.key == f"col:{name.lower()}"), None)
+        if index is None or not 0 <= index < len(outputs):
+            raise Unsupported("ORDER BY must name an output column")
+        descending = self.accept("desc") is not None
+        if not descending:
+            self.accept("asc")
+        if self.accept("nulls"):
+            raise Unsupported("NULLS FIRST/LAST")
+        return index, descending
+
+    def disjunction(self) -> Condition:
+        parts = [self.conjunction()]
+        while self.accept("or"):
+            parts.append(self.conjunction())
+        return parts[0] if len(parts) == 1 else Condition("or", children=parts)
+
+    def conjunction(self) -> Condition:
+        parts = [self.negation()]
+        while self.accept("and"):
+            parts.append(self.negation())
+        return parts[0] if len(parts) == 1 else Condition("and", children=parts)
+
+    def negation(self) -> Condition:
+        if self.accept("not"):
+            return Condition("not", children=[self.negation()])
+        if self.accept("("):
+            cond = self.disjunction()
+            self.expect(")")
+            return cond
+        return self.predicate()
+
+    def predicate(self) -> Condition:
+        column = self.column()
+        if self.accept("is"):
+            negated = self.accept("not") is not None
+            self.expect("null")
+            return Condition("null", column, negated=negated)
+        negated = self.accept("not") is not None
+        if self.accept("between"):
+            low = self.literal()
+            self.expect("and")
+            return Condition("between", column, values=(low, self.literal()), negated=negated)
+        if self.accept("in"):
+            self.expect("(")
+            values = [self.literal()]
+            while self.accept(","):
+                values.append(self.literal())
+            self.expect(")")
+            return Condition("in", column, values=tuple(values), negated=negated)
+        if negated:
+            raise Unsupported("NOT must precede BETWEEN or IN")
+        operator = self.next()
+        if operator.text not in _COMPARATORS:
+            raise Unsupported(f"Operator {operator.text!r}")
+        return Condition("cmp", column, operator=operator.text, values=(self.literal(),))
+
+    @staticmethod
+    def validate(stmt: Statement) -> None:
+        if not any(o.aggregate for o in stmt.outputs):
+            raise Unsupported("No aggregate in the select list")
+        grouped = {c.lower() for c in stmt.group_by}
+        for out in stmt.outputs:
+            if out.column is not None and out.column.lower() not in grouped:
+                raise Unsupported("Bare column outside GROUP BY")
+
+
+def parse(sql: str, table: str, columns: List[str]) -> Statement:
+    """Parse ``sql`` against ``table``; raise ``Unsupported`` outside the subset."""
+    return _Parser(sql, table, columns).statement()
+
+
+# -- column store ----------------------------------------------------------------
+
+@dataclass
+class ColumnData:
+    kind: str  # "integer", "real" or "text"
+    values: np.ndarray  # int64 / float64, or int32 codes into ``categories`` (-1 for NULL)
+    valid: np.ndarray
+    categories: Optional[np.ndarray] = None  # sorted, so code order is SQLite's BINARY order
+
+    @property
+    def nbytes(self) -> int:
+        extra = sum(len(str(v)) for v in self.categories) if self.categories is not None else 0
+        return self.values.nbytes + self.valid.nbytes + extra
+
+
+@dataclass
+class ColumnarTable:
+    name: str
+    version: int
+    row_count: int
+    columns: Dict[str, Optional[ColumnData]]  # None: mixed types, not loadable
+    load_seconds: float = 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self.columns.values() if c is not None)
+
+
+def _estimated_bytes(col, rows: int) -> int:
+    """Rough size of ``col`` once loaded: 8-byte values (4-byte codes plus categories for text) and a mask."""
+    if col.is_numeric:
+        return 9 * rows
+    return 5 * rows + 48 * (col.distinct_count or rows)
+
+
+def _load_column(conn, storage: str, column: str, dictionary: Optional[str]) -> Optional[ColumnData]:
+    q = quote_identifier(column)
+    table = quote_identifier(storage)
+    if dictionary is not None:
+        codes = np.array(conn.execute(f"SELECT {q} FROM {table}").fetchall(), dtype=np.int64).ravel()
+        entries = conn.execute(f"SELECT id, value FROM {quote_identifier(dictionary)} WHERE value IS NOT NULL").fetchall()
+        entries.sort(key=lambda e: e[1])
+        remap = np.full(max((e[0] for e in entries), default=0) + 1, -1, dtype=np.int32)
+        for new, (old, _) in enumerate(entries):
+            remap[old] = new
+        values = remap[codes] if len(codes) else codes.astype(np.int32)
+        categories = np.array([e[1] for e in entries], dtype=object)
+        return ColumnData("text", values, values >= 0, categories)
+
+    kinds = {row[0] for row in conn.execute(f"SELECT DISTINCT typeof({q}) FROM {table}")} - {"null"}
+    if len(kinds) > 1 or kinds - {"integer", "real", "text"}:
+        return None
+    kind = kinds.pop() if kinds else "real"
+    if kind == "integer":
+        rows = np.array(conn.execute(f"SELECT IFNULL({q}, 0), {q} IS NOT NULL FROM {table}").fetchall(),
+                        dtype=np.int64).reshape(-1, 2)
+        return ColumnData("integer", rows[:, 0].copy(), rows[:, 1].astype(bool))
+    if kind == "real":
+        values = np.array(conn.execute(f"SELECT {q} FROM {table}").fetchall(), dtype=np.float64).ravel()
+        return ColumnData("real", values, ~np.isnan(values))
+    raw = np.array([row[0] for row in conn.execute(f"SELECT {q} FROM {table}")], dtype=object)
+    valid = np.not_equal(raw, None)
+    codes = np.full(len(raw), -1, dtype=np.int32)
+    categories, inverse = np.unique(raw[valid].astype(str), return_inverse=True)
+    codes[valid] = inverse
+    return ColumnData("text", codes, valid, categories.astype(object))
+
+
+# -- evaluation -----------------------------------------------------------------
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _compare(data: ColumnData, operator: str, value) -> np.ndarray:
+    """Rows where ``column <operator> value`` holds (ignoring NULLs)."""
+    if data.kind == "text":
+        if not isinstance(value, str):
+            raise Unsupported("Numeric literal compared with a text column")
+        left = np.searchsorted(data.categories, value, side="left")
+        right = np.searchsorted(data.categories, value, side="right")
+        codes = data.values
+        if operator in ("=", "=="):
+            return (codes == left) if right > left else np.zeros(len(codes), dtype=bool)
+        if operator in ("!=", "<>"):
+            return (codes != left) if right > left else np.ones(len(codes), dtype=bool)
+        if operator == "<":
+            return codes < left
+        if operator == "<=":
+            return codes < right
+        if operator == ">":
+            return codes >= right
+        return codes >= left
+    if not _is_number(value):
+        raise Unsupported("Text literal compared with a numeric column")
+    values = data.values
+    if operator in ("=", "=="):
+        return values == value
+    if operator in ("!=", "<>"):
+        return values != value
+    if operator == "<":
+        return values < value
+    if operator == "<=":
+        return values <= value
+    if operator == ">":
+        return values > value
+    return values >= value
+
+
+def _evaluate(cond: Condition, table: ColumnarTable) -> Tuple[np.ndarray, np.ndarray]:
+    """Three-valued logic: return (definitely true, definitely false) masks."""
+    if cond.op in ("and", "or", "not"):
+        parts = [_evaluate(child, table) for child in cond.children]
+        if cond.op == "not":
+            true, false = parts[0]
+            return false, true
+        trues, falses = zip(*parts)
+        if cond.op == "and":
+            return np.logical_and.reduce(trues), np.logical_or.reduce(falses)
+        return np.logical_or.reduce(trues), np.logical_and.reduce(falses)
+
+    data = table.columns[cond.column]
+    if cond.op == "null":
+        is_null = ~data.valid
+        true = ~is_null if cond.negated else is_null
+        return true, ~true
+    if cond.op == "cmp":
+        hit = _compare(data, cond.operator, cond.values[0])
+    elif cond.op == "between":
+        hit = _compare(data, ">=", cond.values[0]) & _compare(data, "<=", cond.values[1])
+    else:
+        hit = np.logical_or.reduce([_compare(data, "=", v) for v in cond.values])
+    if cond.negated:
+        hit = ~hit
+    return data.valid & hit, data.valid & ~hit
+
+
+def _python(value, kind: str, categories=None):
+    if kind == "text":
+        return categories[value]
+    return int(value) if kind == "integer" else float(value)
+
+
+def _dense_ids(keys: np.ndarray, cardinality: int) -> Tuple[np.ndarray, np.ndarray]:
+    """``np.unique(keys, return_inverse=True)`` for small non-negative keys, without sorting."""
+    if cardinality <= max(1 << 20, 4 * len(keys)):
+        present = np.flatnonzero(np.bincount(keys, minlength=cardinality))
+        remap = np.empty(cardinality, dtype=np.int64)
+        remap[present] = np.arange(len(present))
+        return present, remap[keys]
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    return uniques, inverse.ravel()
+
+
+def _codes(data: ColumnData, mask: np.ndarray) -> Tuple[np.ndarray, int, list]:
+    """Order-preserving integer codes for the masked rows, NULL as 0; plus decoded values."""
+    valid = data.valid[mask]
+    if data.kind == "text":
+        categories = data.categories
+        return data.values[mask].astype(np.int64) + 1, len(categories) + 1, [None] + list(categories)
+    uniques, inverse = np.unique(data.values[mask][valid], return_inverse=True)
+    codes = np.zeros(len(valid), dtype=np.int64)
+    codes[valid] = inverse.ravel() + 1
+    return codes, len(uniques) + 1, [None] + [_python(u, data.kind) for u in uniques]
+
+
+def _group_ids(stmt: Statement, table: ColumnarTable, mask: np.ndarray):
+    """Number the groups in SQLite's GROUP BY order; return (ids, group count, key values)."""
+    n = int(mask.sum())
+    if not stmt.group_by:
+        return np.zeros(n, dtype=np.int64), 1, []
+    combined = np.zeros(n, dtype=np.int64)
+    radices, decoders = [], []
+    cardinality = 1
+    for column in stmt.group_by:
+        codes, size, decoded = _codes(table.columns[column], mask)
+        if cardinality * size >= 1 << 62:
+            raise Unsupported("Too many group combinations")
+        combined = combined * size + codes
+        cardinality *= size
+        radices.append(size)
+        decoders.append(decoded)
+    present, ids = _dense_ids(combined, cardinality)
+    keys = []
+    for key in present.tolist():
+        row = []
+        for size, decoded in zip(reversed(radices), reversed(decoders)):
+            key, code = divmod(key, size)
+            row.append(decoded[code])
+        keys.append(row[::-1])
+    return ids, len(present), keys
+
+
+def _aggregate(agg: Aggregate, table: ColumnarTable, mask: np.ndarray, ids: np.ndarray, groups: int) -> list:
+    if agg.column is None:
+        return [int(c) for c in np.bincount(ids, minlength=groups)]
+    data = table.columns[agg.column]
+    valid = data.valid[mask]
+    ids_v = ids[valid]
+    values = data.values[mask][valid]
+    counts = np.bincount(ids_v, minlength=groups)
+    if agg.fn == "COUNT":
+        if not agg.distinct:
+            return [int(c) for c in counts]
+        if data.kind == "text":
+            codes, size = values.astype(np.int64), len(data.categories)
+        else:
+            uniques, inverse = np.unique(values, return_inverse=True)
+            codes, size = inverse.ravel().astype(np.int64), len(uniques)
+        pairs, _ = _dense_ids(ids_v * size + codes, groups * max(size, 1))
+        return [int(c) for c in np.bincount(pairs // max(size, 1), minlength=groups)]
+    if agg.fn in ("SUM", "TOTAL", "AVG"):
+        if data.kind == "text":
+            raise Unsupported(f"{agg.fn} over a text column")
+        if agg.fn == "SUM" and data.kind == "integer":
+            sums = np.zeros(groups, dtype=np.int64)
+            np.add.at(sums, ids_v, values)
+            return [int(s) if c else None for s, c in zip(sums, counts)]
+        # bincount adds in row order, like SQLite's running double sum.
+        sums = np.bincount(ids_v, weights=values.astype(np.float64), minlength=groups)
+        if agg.fn == "TOTAL":
+            return [float(s) for s in sums]
+        if agg.fn == "AVG":
+            return [float(s / c) if c else None for s, c in zip(sums, counts)]
+        return [float(s) if c else None for s, c in zip(sums, counts)]
+    # MIN / MAX
+    if data.kind == "real":
+        extreme = np.full(groups, np.inf if agg.fn == "MIN" else -np.inf)
+    else:
+        info = np.iinfo(values.dtype)
+        extreme = np.full(groups, info.max if agg.fn == "MIN" else info.min, dtype=values.dtype)
+    (np.minimum if agg.fn == "MIN" else np.maximum).at(extreme, ids_v, values)
+    return [_python(v, data.kind, data.categories) if c else None for v, c in zip(extreme, counts)]
+
+
+def _sort_key(value):
+    # SQLite orders NULL before any value; DESC reverses both.
+    return (value is not None, value if value is not None else 0)
+
+
+def execute(stmt: Statement, table: ColumnarTable) -> Tuple[List[str], List[tuple]]:
+    """Evaluate a parsed statement against the loaded columns."""
+    for column in stmt.columns:
+        if table.columns.get(column) is None:
+            raise Unsupported(f"Column {column!r} holds mixed types")
+    if stmt.where is None:
+        mask = np.ones(table.row_count, dtype=bool)
+    else:
+        mask = _evaluate(stmt.where, table)[0]
+    ids, groups, keys = _group_ids(stmt, table, mask)
+    if stmt.group_by and not len(ids):
+        return [o.name for o in stmt.outputs], []
+    results = []
+    for out in stmt.outputs:
+        if out.aggregate is not None:
+            results.append(_aggregate(out.aggregate, table, mask, ids, groups))
+        else:
+            position = [c.lower() for c in stmt.group_by].index(out.column.lower())
+            results.append([key[position] for key in keys])
+    rows = list(zip(*results))
+    for index, descending in reversed(stmt.order_by):
+        rows.sort(key=lambda row: _sort_key(row[index]), reverse=descending)
+    end = stmt.offset + stmt.limit if stmt.limit is not None else None
+    return [o.name for o in stmt.outputs], rows[stmt.offset:end]
+
+
+class ColumnarEngine:
+    """Per-table NumPy column cache plus the vectorized evaluator."""
+
+    def __init__(self, enabled: bool = True, min_rows: int = 10_000, max_rows: int = 5_000_000,
+                 max_bytes: int = 256 * 1024 * 1024, max_text_distinct: int = 100_000):
+        self.enabled = enabled
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_text_distinct = max_text_distinct
+        self._tables: Dict[str, ColumnarTable] = {}
+        # (table, column) -> bytes, least recently used first
+        self._sizes: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, threading.Lock] = {}
+        self.invalidations = 0
+        self.bytes = 0
+        self.answered = 0
+        self.fallbacks = 0
+        self.over_budget = 0
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ColumnarEngine":
+        section = config.get("columnar_engine", {})
+        return cls(
+            enabled=section.get("enabled", True),
+            min_rows=section.get("min_rows", 10_000),
+            max_rows=section.get("max_rows", 5_000_000),
+            max_bytes=section.get("max_bytes", 256 * 1024 * 1024),
+            max_text_distinct=section.get("max_text_distinct", 100_000),
+        )
+
+    def accepts(self, schema) -> bool:
+        return self.enabled and schema is not None and self.min_rows <= schema.row_count <= self.max_rows
+
+    def compile(self, sql: str, schema) -> Optional[Statement]:
+        """Parse ``sql`` for ``schema``, or None (and count a fallback) if unsupported."""
+        try:
+            return parse(sql, schema.name, schema.column_names)
+        except Unsupported:
+            self.fallbacks += 1
+            return None
+
+    def cached(self, schema) -> Optional[ColumnarTable]:
+        table = self._tables.get(schema.name)
+        return table if table is not None and table.version == schema.version else None
+
+    def _view(self, table: ColumnarTable, columns) -> ColumnarTable:
+        # The view keeps its arrays alive even if they are evicted while it runs.
+        for name in columns:
+            self._sizes.move_to_end((table.name, name))
+        return ColumnarTable(table.name, table.version, table.row_count,
+                             {name: table.columns[name] for name in columns})
+
+    def view(self, schema, columns) -> Optional[ColumnarTable]:
+        """The loaded ``columns`` of ``schema``'s table, or None if any still needs loading."""
+        with self._lock:
+            table = self.cached(schema)
+            if table is None or any(name not in table.columns for name in columns):
+                return None
+            return self._view(table, columns)
+
+    def _fits(self, schema, columns) -> bool:
+        info = {col.name: col for col in schema.columns}
+        estimate = 0
+        for name in columns:
+            col = info.get(name)
+            if col is None:
+                continue
+            if not col.is_numeric and col.values is None and (col.distinct_count or 0) > self.max_text_distinct:
+                return False
+            estimate += _estimated_bytes(col, schema.row_count)
+        return estimate <= self.max_bytes
+
+    def _drop_column(self, table: str, column: str) -> None:
+        self.bytes -= self._sizes.pop((table, column), 0)
+        cached = self._tables.get(table)
+        if cached is not None:
+            cached.columns.pop(column, None)
+
+    def _drop_table(self, table: str) -> None:
+        for key in [k for k in self._sizes if k[0] == table]:
+            self._drop_column(*key)
+        self._tables.pop(table, None)
+
+    def _evict(self, keep) -> None:
+        for key in list(self._sizes):
+            if self.bytes <= self.max_bytes:
+                break
+            if key not in keep:
+                self._drop_column(*key)
+                self.evictions += 1
+
+    def _loader(self, table: str) -> threading.Lock:
+        with self._lock:
+            return self._loaders.setdefault(table, threading.Lock())
+
+    def load(self, conn, schema, columns=None) -> Optional[ColumnarTable]:
+        """Load ``columns`` (default: all) of ``schema``'s table into arrays, in one read snapshot.
+
+        Returns a table holding just those columns, or None (counted as a
+        fallback) when they would not fit in ``max_bytes``. SQLite is read
+        without holding the engine lock, so ``view`` and ``invalidate`` stay
+        quick; concurrent loads of one table run one after the other and the
+        later ones reuse what the first loaded.
+        """
+        columns = list(columns) if columns is not None else list(schema.column_names)
+        with self._loader(schema.name):
+            with self._lock:
+                table = self.cached(schema)
+                if table is None:
+                    self._drop_table(schema.name)
+                have = {name: table.columns[name] for name in columns if table is not None and name in table.columns}
+                if table is not None and len(have) == len(columns):
+                    return self._view(table, columns)
+                if not self._fits(schema, columns):
+                    self.over_budget += 1
+                    self.fallbacks += 1
+                    return None
+                invalidations = self.invalidations
+
+            started = time.perf_counter()
+            layout = layout_of(conn, schema.name)
+            if layout is None:
+                raise LookupError(f"Table '{schema.name}' does not exist")
+            began = not conn.in_transaction
+            if began:
+                conn.execute("BEGIN")
+            try:
+                row_count = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(layout.storage)}").fetchone()[0]
+                if table is None or table.row_count != row_count:
+                    have = {}  # columns already loaded came from other data; start over
+                loaded = {name: _load_column(conn, layout.storage, name, layout.dictionaries.get(name))
+                          for name in columns if name not in have}
+            finally:
+                if began:
+                    conn.execute("COMMIT")
+            elapsed = time.perf_counter() - started
+
+            with self._lock:
+                self.loads += 1
+                # Keep nothing that was invalidated while it was being read
+                if self.invalidations == invalidations:
+                    if table is None or table.row_count != row_count:
+                        self._drop_table(schema.name)
+                        table = self._tables[schema.name] = ColumnarTable(schema.name, schema.version, row_count, {})
+                    for name, data in loaded.items():
+                        table.columns[name] = data
+                        self.bytes -= self._sizes.pop((schema.name, name), 0)
+                        self._sizes[(schema.name, name)] = data.nbytes if data is not None else 0
+                        self.bytes += self._sizes[(schema.name, name)]
+                    table.load_seconds += elapsed
+                    for name in have:
+                        if (schema.name, name) in self._sizes:
+                            self._sizes.move_to_end((schema.name, name))
+                    self._evict(keep={(schema.name, name) for name in columns})
+            # Built from the arrays themselves, so it is complete even if some were evicted since
+            arrays = {**have, **loaded}
+            view = ColumnarTable(schema.name, schema.version, row_count, {name: arrays[name] for name in columns})
+            view.load_seconds = elapsed
+            return view
+
+    def run(self, stmt: Statement, table: ColumnarTable) -> Optional[Tuple[List[str], List[tuple]]]:
+        try:
+            result = execute(stmt, table)
+        except Unsupported:
+            self.fallbacks += 1
+            return None
+        self.answered += 1
+        return result
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        with self._lock:
+            self.invalidations += 1
+            for name in ([table] if table is not None else list(self._tables)):
+                self._drop_table(name)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "answered": self.answered,
+            "fallbacks": self.fallbacks,
+            "over_budget": self.over_budget,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "tables": {
+                t.name: {"rows": t.row_count, "columns": len(t.columns), "bytes": t.nbytes,
+                         "load_seconds": round(t.load_seconds, 4)}
+                for t in list(self._tables.values())
+            },
+        }
@@ -0,0 +1,217 @@
+"""Shared SQLite access layer.
+
+Keeps a pool of reusable read connections in WAL mode plus a single
+dedicated writer connection, and runs every database call on a worker
+thread pool so request handlers never block the event loop. Calls run in
+a copy of the caller's context, so timings recorded on a worker thread land
+on the request that made the call.
+"""
+import asyncio
+import contextvars
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def connect(path: str, busy_timeout: float = 30.0, readonly: bool = False) -> sqlite3.Connection:
+    """Open ``path`` in WAL mode, as every connection to the database file should be."""
+    conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class Database:
+    """Pooled, thread-offloaded access to one SQLite file."""
+
+    def __init__(self, path: str, read_pool_size: int = 4, busy_timeout: float = 30.0):
+        self.path = path
+        self.read_pool_size = max(1, read_pool_size)
+        self.busy_timeout = busy_timeout
+        # One extra worker so an upload never starves readers of threads.
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.read_pool_size + 1, thread_name_prefix="db"
+        )
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "reads": 0,
+            "writes": 0,
+            "errors": 0,
+            "read_wait_total": 0.0,
+            "read_wait_max": 0.0,
+            "write_wait_total": 0.0,
+            "write_wait_max": 0.0,
+            "waiting": 0,
+        }
+
+    # -- connections -----------------------------------------------------
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        return connect(self.path, self.busy_timeout, readonly)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._create_lock:
+            if self._created < self.read_pool_size:
+                self._created += 1
+                try:
+                    return self._connect(readonly=True)
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    def _release_reader(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = self._connect(readonly=False)
+        return self._writer
+
+    # -- execution -------------------------------------------------------
+
+    def _record(self, kind: str, wait: float, failed: bool) -> None:
+        with self._stats_lock:
+            self._stats[kind + "s"] += 1
+            self._stats[kind + "_wait_total"] += wait
+            self._stats[kind + "_wait_max"] = max(self._stats[kind + "_wait_max"], wait)
+            if failed:
+                self._stats["errors"] += 1
+
+    def _adjust_waiting(self, delta: int) -> None:
+        with self._stats_lock:
+            self._stats["waiting"] += delta
+
+    def _run_read(self, submitted: float, fn, args):
+        conn = self._acquire_reader()
+        wait = time.perf_counter() - submitted
+        self._adjust_waiting(-1)
+        failed = True
+        try:
+            result = fn(conn, *args)
+            failed = False
+            return result
+        finally:
+            self._release_reader(conn)
+            self._record("read", wait, failed)
+
+    def _run_write(self, submitted: float, fn, args):
+        with self._writer_lock:
+            wait = time.perf_counter() - submitted
+            self._adjust_waiting(-1)
+            conn = self._writer_conn()
+            failed = True
+            try:
+                result = fn(conn, *args)
+                if conn.in_transaction:
+                    conn.commit()
+                failed = False
+                return result
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                self._record("write", wait, failed)
+
+    def _submit(self, fn, *args):
+        # run_in_executor, unlike asyncio.to_thread, does not carry context variables over
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self._executor, context.run, fn, *args)
+
+    async def read(self, fn, *args):
+        """Run ``fn(conn, *args)`` on a pooled read-only connection."""
+        self._adjust_waiting(1)
+        return await self._submit(self._run_read, time.perf_counter(), fn, args)
+
+    async def write(self, fn, *args):
+        """Run ``fn(conn, *args)`` on the single writer connection."""
+        self._adjust_waiting(1)
+        return await self._submit(self._run_write, time.perf_counter(), fn, args)
+
+    async def fetch(self, sql: str, params=()):
+        """Execute a read query and return ``(column_names, rows)``."""
+
+        def run(conn):
+            cursor = conn.execute(sql, params)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            return columns, cursor.fetchall()
+
+        return await self.read(run)
+
+    async def stream(self, sql: str, params=(), batch_size: int = 1000, prepare=None, cleanup=None):
+        """Yield ``(column_names, rows)`` batches while holding one read connection.
+
+        ``prepare(conn, sql, params)`` may return a rewritten statement and
+        ``cleanup(conn)`` runs before the connection returns to the pool.
+        """
+        self._adjust_waiting(1)
+        submitted = time.perf_counter()
+        conn = await self._submit(self._acquire_reader)
+        self._adjust_waiting(-1)
+        wait = time.perf_counter() - submitted
+        failed = True
+        try:
+            if prepare is not None:
+                sql = await self._submit(prepare, conn, sql, params)
+            cursor = await self._submit(conn.execute, sql, params)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            while True:
+                rows = await self._submit(cursor.fetchmany, batch_size)
+                yield columns, rows
+                if len(rows) < batch_size:
+                    break
+            failed = False
+        finally:
+            if cleanup is not None:
+                cleanup(conn)
+            self._release_reader(conn)
+            self._record("read", wait, failed)
+
+    # -- lifecycle / introspection ---------------------------------------
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        return {
+            "path": self.path,
+            "read_pool_size": self.read_pool_size,
+            "read_connections_open": self._created,
+            "read_connections_idle": self._idle.qsize(),
+            "read_connections_in_use": self._created - self._idle.qsize(),
+            "requests_waiting": s["waiting"],
+            "reads": s["reads"],
+            "writes": s["writes"],
+            "errors": s["errors"],
+            "avg_read_wait_ms": round(1000 * s["read_wait_total"] / s["reads"], 3) if s["reads"] else 0.0,
+            "max_read_wait_ms": round(1000 * s["read_wait_max"], 3),
+            "avg_write_wait_ms": round(1000 * s["write_wait_total"] / s["writes"], 3) if s["writes"] else 0.0,
+            "max_write_wait_ms": round(1000 * s["write_wait_max"], 3),
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
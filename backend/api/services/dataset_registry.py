@@ -0,0 +1,203 @@
+"""Persistent registry of named datasets, shared by every worker process.
+
+Each uvicorn worker keeps its own schema catalog, result cache and columnar
+stores, so the state that must agree across workers lives in two metadata
+tables of the database file itself:
+
+* ``_nlq_datasets``: one row per dataset with its row and column counts,
+  source file, a complete schema snapshot and the generation that last
+  wrote it;
+* ``_nlq_state``: the default dataset (the most recent upload) and the
+  ``generation`` counter that every upload, merge or removal increments.
+
+Writers call ``publish`` / ``remove`` on their own connection inside the
+transaction that changes the data, so a dataset and its registry row change
+together. Before serving a request a worker calls ``changes``, one
+primary-key read while nothing moved; when the generation has advanced it
+gets back the datasets that changed, with their new schema snapshots, and
+drops whatever it cached for them.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from api.services.document_processor import quote_identifier
+from api.services.schema_discovery import TableSchema
+
+DATASETS_TABLE = "_nlq_datasets"
+STATE_TABLE = "_nlq_state"
+RESERVED_PREFIX = "_nlq_"
+
+
+@dataclass
+class DatasetInfo:
+    name: str
+    version: int
+    row_count: int = 0
+    column_count: int = 0
+    source_file: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "row_count": self.row_count,
+            "column_count": self.column_count,
+            "source_file": self.source_file,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+def check_name(name: str) -> str:
+    """Reject dataset names that would collide with the registry's own tables."""
+    if not name or name.lower().startswith(RESERVED_PREFIX):
+        raise ValueError(f"Invalid dataset name '{name}'")
+    return name
+
+
+class DatasetRegistry:
+    """This worker's view of the shared registry.
+
+    ``generation`` and ``default`` reflect the last ``changes`` call (or the
+    last write made by this worker); the metadata tables are the source of
+    truth.
+    """
+
+    def __init__(self):
+        self.generation = -1
+        self.default: Optional[str] = None
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.syncs = 0
+        self.reloads = 0
+
+    def install(self, conn) -> None:
+        """Create the metadata tables if this database has none yet."""
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(DATASETS_TABLE)} ("
+            "name TEXT PRIMARY KEY, version INTEGER NOT NULL, row_count INTEGER NOT NULL DEFAULT 0, "
+            "column_count INTEGER NOT NULL DEFAULT 0, source_file TEXT, schema_json TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {quote_identifier(STATE_TABLE)} (key TEXT PRIMARY KEY, value)")
+        conn.execute(f"INSERT OR IGNORE INTO {quote_identifier(STATE_TABLE)} VALUES ('generation', 0)")
+        conn.commit()
+
+    # -- writer side -----------------------------------------------------
+
+    def _advance(self, conn) -> int:
+        conn.execute(f"UPDATE {quote_identifier(STATE_TABLE)} SET value = value + 1 WHERE key = 'generation'")
+        return conn.execute(f"SELECT value FROM {quote_identifier(STATE_TABLE)} WHERE key = 'generation'").fetchone()[0]
+
+    def _set_default(self, conn, name: Optional[str]) -> None:
+        conn.execute(f"INSERT OR REPLACE INTO {quote_identifier(STATE_TABLE)} VALUES ('default', ?)", (name,))
+
+    def publish(self, conn, schema: TableSchema, source_file: Optional[str] = None) -> int:
+        """Record ``schema`` as the current state of its dataset and make it the default.
+
+        Runs in the caller's transaction and does not commit; returns the new
+        generation. Workers, including the caller's, see it through ``changes``
+        once the caller has committed.
+        """
+        generation = self._advance(conn)
+        now = time.time()
+        conn.execute(
+            f"INSERT INTO {quote_identifier(DATASETS_TABLE)} VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET version = excluded.version, row_count = excluded.row_count, "
+            "column_count = excluded.column_count, source_file = COALESCE(excluded.source_file, source_file), "
+            "schema_json = excluded.schema_json, updated_at = excluded.updated_at",
+            (schema.name, generation, schema.row_count, len(schema.columns), source_file, schema.to_json(), now, now),
+        )
+        self._set_default(conn, schema.name)
+        return generation
+
+    def remove(self, conn, name: str) -> Optional[int]:
+        """Forget ``name``; the most recently updated dataset left becomes the default.
+
+        Returns the new generation, or None when ``name`` was not registered.
+        Runs in the caller's transaction and does not commit.
+        """
+        deleted = conn.execute(f"DELETE FROM {quote_identifier(DATASETS_TABLE)} WHERE name = ?", (name,)).rowcount
+        if not deleted:
+            return None
+        generation = self._advance(conn)
+        default = conn.execute(f"SELECT value FROM {quote_identifier(STATE_TABLE)} WHERE key = 'default'").fetchone()
+        if default is None or default[0] == name:
+            latest = conn.execute(
+                f"SELECT name FROM {quote_identifier(DATASETS_TABLE)} ORDER BY updated_at DESC LIMIT 1"
+            ).fetchone()
+            self._set_default(conn, latest[0] if latest else None)
+        return generation
+
+    # -- reader side -----------------------------------------------------
+
+    def _generation(self, conn) -> int:
+        row = conn.execute(f"SELECT value FROM {quote_identifier(STATE_TABLE)} WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def changes(self, conn) -> List[Tuple[str, Optional[TableSchema], int]]:
+        """Catch up with the shared registry.
+
+        Returns ``(name, schema, version)`` for every dataset written or
+        removed since the last call, where ``schema`` is None for a removed
+        dataset and ``version`` is the generation the entry reflects.
+        Concurrent calls can finish out of order, so callers skip entries
+        older than the version they already applied for that dataset.
+        """
+        self.syncs += 1
+        if self._generation(conn) == self.generation:
+            return []
+        # One snapshot, so the generation, default and rows agree
+        conn.execute("BEGIN")
+        try:
+            return self._reload(conn)
+        finally:
+            conn.rollback()
+
+    def _reload(self, conn) -> List[Tuple[str, Optional[TableSchema], int]]:
+        generation = self._generation(conn)
+        default = conn.execute(f"SELECT value FROM {quote_identifier(STATE_TABLE)} WHERE key = 'default'").fetchone()
+        versions = dict(conn.execute(f"SELECT name, version FROM {quote_identifier(DATASETS_TABLE)}").fetchall())
+        with self._lock:
+            changed = [name for name, version in versions.items() if self._versions.get(name) != version]
+            removed = [name for name in self._versions if name not in versions]
+        out: List[Tuple[str, Optional[TableSchema], int]] = [(name, None, generation) for name in removed]
+        for name in changed:
+            out.append((name, self.snapshot(conn, name), versions[name]))
+        with self._lock:
+            if generation > self.generation:
+                self.generation = generation
+                self.default = default[0] if default else None
+                self._versions = versions
+                self.reloads += 1
+        return out
+
+    def snapshot(self, conn, name: str) -> Optional[TableSchema]:
+        """The schema last published for ``name``, or None."""
+        row = conn.execute(
+            f"SELECT schema_json FROM {quote_identifier(DATASETS_TABLE)} WHERE name = ?", (name,)
+        ).fetchone()
+        return TableSchema.from_json(row[0]) if row and row[0] else None
+
+    def datasets(self, conn) -> List[DatasetInfo]:
+        rows = conn.execute(
+            f"SELECT name, version, row_count, column_count, source_file, created_at, updated_at "
+            f"FROM {quote_identifier(DATASETS_TABLE)} ORDER BY name"
+        ).fetchall()
+        return [DatasetInfo(*row) for row in rows]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._versions
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "default": self.default,
+            "datasets": len(self._versions),
+            "syncs": self.syncs,
+            "reloads": self.reloads,
+        }
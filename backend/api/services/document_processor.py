@@ -0,0 +1,573 @@
+"""Streaming CSV ingestion into SQLite.
+
+Uploads are parsed in fixed-size chunks and written with batched inserts,
+so peak memory is bounded by the chunk size rather than by the size of the
+uploaded file.
+
+A re-upload never touches the live table while it loads: rows go into a
+private staging table, which gets its indexes and statistics there, and
+is then renamed over the live name inside one short transaction. Readers
+keep answering from the old version until that commit.
+
+Columns are typed from the data (see ``type_inference``) and tables are
+created STRICT. When a replace upload has low-cardinality text columns,
+the rows are stored as integer codes in ``<table>__data`` with one
+``<table>__dict__<column>`` lookup table per encoded column, and
+``<table>`` becomes a view joining them back, so generated SQL still sees
+the original column names and values.
+"""
+import io
+import re
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from api.services.type_inference import (
+    NULL_CODE,
+    IngestOptions,
+    TypeMismatch,
+    convert_chunk,
+    estimate_payload,
+    plan_columns,
+)
+
+DEFAULT_CHUNK_ROWS = 50_000
+STAGING_PREFIX = "_staging_"
+RETIRED_PREFIX = "_retired_"
+UPLOAD_MODES = ("replace", "append", "upsert")
+DATA_SUFFIX = "__data"
+DICTIONARY_INFIX = "__dict__"
+
+# Applied for the duration of a load and restored afterwards.
+BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": "-65536",  # 64 MiB page cache
+    "temp_store": "MEMORY",
+}
+
+_STRICT_ERROR_RE = re.compile(r"cannot store (\w+) value in (\w+) column [^.]+\.(.+)$")
+
+
+def quote_identifier(name) -> str:
+    """Quote a column or table name for SQLite."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def dictionary_table(table_name: str, column: str) -> str:
+    return f"{table_name}{DICTIONARY_INFIX}{column}"
+
+
+@dataclass
+class TableLayout:
+    """The physical tables behind one queryable table name."""
+    name: str
+    dictionaries: Dict[str, str] = field(default_factory=dict)  # column -> lookup table
+
+    @property
+    def encoded(self) -> bool:
+        return bool(self.dictionaries)
+
+    @property
+    def storage(self) -> str:
+        return f"{self.name}{DATA_SUFFIX}" if self.encoded else self.name
+
+    @property
+    def tables(self) -> List[str]:
+        return [self.storage] + list(self.dictionaries.values())
+
+    def renamed(self, name: str) -> "TableLayout":
+        return TableLayout(name, {column: dictionary_table(name, column) for column in self.dictionaries})
+
+    def view_sql(self, columns: List[str], temp: bool = False) -> str:
+        """``CREATE VIEW`` decoding the storage table back to the original values."""
+        data = quote_identifier(self.storage)
+        select, joins = [], []
+        for i, column in enumerate(columns):
+            col = quote_identifier(column)
+            if column in self.dictionaries:
+                alias = f"d{i}"
+                select.append(f"{alias}.value AS {col}")
+                joins.append(f"JOIN {quote_identifier(self.dictionaries[column])} AS {alias} ON {alias}.id = {data}.{col}")
+            else:
+                select.append(f"{data}.{col}")
+        return (
+            f"CREATE {'TEMP ' if temp else ''}VIEW {quote_identifier(self.name)} AS "
+            f"SELECT {', '.join(select)} FROM {data} {' '.join(joins)}"
+        )
+
+
+def layout_of(conn, name: str) -> Optional[TableLayout]:
+    """Discover the layout behind ``name``, or None if no such table exists."""
+    row = conn.execute(
+        "SELECT type FROM sqlite_master WHERE name = ? UNION ALL SELECT type FROM sqlite_temp_master WHERE name = ?",
+        (name, name),
+    ).fetchone()
+    if row is None:
+        return None
+    if row[0] == "table":
+        return TableLayout(name)
+    if row[0] != "view" or not _table_exists(conn, name + DATA_SUFFIX):
+        return None
+    prefix = name + DICTIONARY_INFIX
+    tables = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ? ORDER BY name",
+        (len(prefix), prefix),
+    )]
+    return TableLayout(name, {table[len(prefix):]: table for table in tables})
+
+
+def table_exists(conn, name: str) -> bool:
+    """True if ``name`` is a queryable upload (a plain table or an encoded view)."""
+    return layout_of(conn, name) is not None
+
+
+@dataclass
+class IngestResult:
+    table_name: str
+    rows: int = 0
+    chunks: int = 0
+    columns: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+    swap_seconds: Optional[float] = None
+    mode: str = "replace"
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    # Non-null counts of the live rows an upsert overwrote, for stats maintenance.
+    replaced_non_null: Dict[str, int] = field(default_factory=dict)
+    layout: Optional[TableLayout] = None
+    types: Dict[str, str] = field(default_factory=dict)
+    # Estimated record payload as all-TEXT columns vs. as stored, plus measured pages.
+    text_bytes: int = 0
+    typed_bytes: int = 0
+    column_bytes: Dict[str, List[int]] = field(default_factory=dict)  # column -> [text, typed]
+    disk_bytes: Optional[int] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else float(self.rows)
+
+    def to_dict(self) -> dict:
+        savings = 1 - self.typed_bytes / self.text_bytes if self.text_bytes else 0.0
+        # Typing can also grow a column ("12.5%" as an 8-byte REAL); it is done
+        # so the values compare as numbers, so such columns are listed apart
+        saved = {c: text - typed for c, (text, typed) in self.column_bytes.items() if typed < text}
+        grown = sorted(c for c, (text, typed) in self.column_bytes.items() if typed > text)
+        return {
+            "rows": self.rows,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(self.elapsed, 4),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "swap_ms": round(1000 * self.swap_seconds, 3) if self.swap_seconds is not None else None,
+            "mode": self.mode,
+            "inserted": self.inserted if self.mode != "replace" else self.rows,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "types": self.types,
+            "storage": {
+                "text_payload_bytes": self.text_bytes,
+                "typed_payload_bytes": self.typed_bytes,
+                "savings_pct": round(100 * savings, 1),
+                "saved_bytes_by_column": dict(sorted(saved.items(), key=lambda kv: -kv[1])),
+                "larger_when_typed": grown,
+                "bytes_on_disk": self.disk_bytes,
+                "dictionary_columns": list(self.layout.dictionaries) if self.layout else [],
+            },
+        }
+
+
+def _generation_name(prefix: str, table_name: str) -> str:
+    # Unique per load so index names derived from it never collide with the live table's.
+    return f"{prefix}{table_name}_{uuid.uuid4().hex[:8]}"
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def drop_table(conn, name: str) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(name)}")
+    if conn.in_transaction:
+        conn.commit()
+
+
+def drop_generation(conn, name: str) -> None:
+    """Drop ``name`` and every storage or lookup table loaded under it."""
+    conn.execute(f"DROP VIEW IF EXISTS temp.{quote_identifier(name)}")
+    prefix = name + "__"
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND (name = ? OR substr(name, 1, ?) = ?)",
+        (name, len(prefix), prefix),
+    )]
+    for table in tables:
+        drop_table(conn, table)
+
+
+def drop_leftover_tables(conn) -> List[str]:
+    """Drop staging and retired tables left behind by an interrupted upload."""
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND (name LIKE ? OR name LIKE ?)",
+        (STAGING_PREFIX + "%", RETIRED_PREFIX + "%"),
+    )]
+    for name in names:
+        drop_table(conn, name)
+    return names
+
+
+def bytes_on_disk(conn, tables: List[str]) -> Optional[int]:
+    """Pages used by ``tables`` and their indexes, or None without ``dbstat``."""
+    total = 0
+    try:
+        for table in tables:
+            objects = [table] + [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,)
+            )]
+            for name in objects:
+                total += conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    return total
+
+
+def swap_tables(conn, staging: TableLayout, table_name: str,
+                before_commit: Optional[Callable] = None) -> List[str]:
+    """Atomically rename the ``staging`` layout to ``table_name``.
+
+    The live tables are renamed aside rather than dropped, so the transaction
+    only rewrites the schema and never waits on freeing the old pages; the
+    caller drops the returned retired tables afterwards. Planner statistics
+    in ``sqlite_stat1`` follow the rename, and the decoding view is recreated
+    over the new tables when the upload is dictionary-encoded.
+    ``before_commit(conn, layout)`` runs inside the swap transaction with the
+    final layout, for metadata that must change together with the data.
+    """
+    retired = []
+    final = staging.renamed(table_name)
+    saved_isolation = conn.isolation_level
+    conn.isolation_level = None
+    # Keep views and triggers bound to the name, not to the table being retired.
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        has_stats = _table_exists(conn, "sqlite_stat1")
+        live = layout_of(conn, table_name)
+        if live is not None:
+            if live.encoded:
+                conn.execute(f"DROP VIEW {quote_identifier(table_name)}")
+            generation = uuid.uuid4().hex[:8]
+            for table in live.tables:
+                name = f"{RETIRED_PREFIX}{generation}_{table}"
+                conn.execute(f"ALTER TABLE {quote_identifier(table)} RENAME TO {quote_identifier(name)}")
+                if has_stats:
+                    conn.execute("DELETE FROM sqlite_stat1 WHERE tbl = ?", (table,))
+                retired.append(name)
+        if staging.encoded:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{quote_identifier(staging.name)}")
+        for source, target in zip(staging.tables, final.tables):
+            conn.execute(f"ALTER TABLE {quote_identifier(source)} RENAME TO {quote_identifier(target)}")
+            if has_stats:
+                # Automatic (UNIQUE) indexes are renamed along with their table.
+                conn.execute(
+                    "UPDATE sqlite_stat1 SET tbl = ?1, idx = replace(idx, 'sqlite_autoindex_' || ?2, "
+                    "'sqlite_autoindex_' || ?1) WHERE tbl = ?2",
+                    (target, source),
+                )
+        if final.encoded:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(final.storage)})")]
+            conn.execute(final.view_sql(columns))
+        if before_commit is not None:
+            before_commit(conn, final)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+        conn.isolation_level = saved_isolation
+    return retired
+
+
+def _chunk_rows(chunk: pd.DataFrame):
+    """Yield plain Python tuples for ``executemany`` (NaN becomes NULL)."""
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def _strict_mismatch(error: sqlite3.IntegrityError) -> Optional[TypeMismatch]:
+    """Translate a STRICT table type error into the column to demote."""
+    match = _STRICT_ERROR_RE.search(str(error))
+    if match is None:
+        return None
+    stored, declared, column = match.groups()
+    return TypeMismatch(column, "real" if (stored, declared) == ("REAL", "INTEGER") else "text")
+
+
+def _column_def(plan, strict: bool) -> str:
+    if plan.dictionary is not None:
+        # Rows that omit an encoded column must still join to the NULL entry.
+        return f"{quote_identifier(plan.name)} INTEGER NOT NULL DEFAULT {NULL_CODE}"
+    sqlite_type = plan.sqlite_type if strict or plan.sqlite_type != "ANY" else ""
+    return f"{quote_identifier(plan.name)} {sqlite_type}".rstrip()
+
+
+class StreamingCSVLoader:
+    """Load a CSV file object into a SQLite table chunk by chunk."""
+
+    def __init__(self, chunk_rows: int = DEFAULT_CHUNK_ROWS, encoding: str = "utf-8",
+                 options: Optional[IngestOptions] = None):
+        self.chunk_rows = chunk_rows
+        self.encoding = encoding
+        self.options = options or IngestOptions()
+
+    def load(self, conn, source, table_name: str, encode: bool = False,
+             progress: Optional[Callable] = None) -> IngestResult:
+        """Create ``table_name`` from the rows read from ``source``.
+
+        ``source`` is any binary file object (e.g. the spooled temp file behind
+        an ``UploadFile``). Each chunk is committed on its own so the WAL can be
+        checkpointed during long loads; load into a staging table (see
+        ``replace``) when readers must never see a partial table.
+
+        Column types are planned from the first chunk. If a later chunk does
+        not fit, the offending column is widened and the load restarts from
+        the beginning of ``source``. With ``encode``, low-cardinality text is
+        stored as codes; the caller creates the decoding view.
+
+        ``progress(conn, result)`` runs inside each chunk's transaction after
+        its rows are written; raising from it rolls the chunk back and stops
+        the load.
+        """
+        origin = source.tell()
+        overrides: Dict[str, str] = {}
+        while True:
+            try:
+                return self._load(conn, source, table_name, encode, overrides, progress)
+            except TypeMismatch as mismatch:
+                if overrides.get(mismatch.column) == mismatch.fallback or not source.seekable():
+                    raise ValueError(str(mismatch)) from mismatch
+                overrides[mismatch.column] = mismatch.fallback
+                source.seek(origin)
+
+    def _load(self, conn, source, table_name: str, encode: bool, overrides: Dict[str, str],
+              progress: Optional[Callable] = None) -> IngestResult:
+        result = IngestResult(table_name=table_name)
+        started = time.perf_counter()
+        # Decode through a wrapper we detach afterwards, so pandas never closes ``source``
+        # and a widened retry can seek back to the start.
+        text = io.TextIOWrapper(source, encoding=self.encoding, newline="")
+        reader = pd.read_csv(text, chunksize=self.chunk_rows)
+        strict = " STRICT" if self.options.strict_tables else ""
+
+        saved_isolation = conn.isolation_level
+        saved_pragmas = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in BULK_LOAD_PRAGMAS}
+        conn.isolation_level = None
+        for name, value in BULK_LOAD_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+        try:
+            conn.execute("BEGIN")
+            plans = None
+            for chunk in reader:
+                if plans is None:
+                    plans = plan_columns(chunk, self.options, overrides, encode)
+                    result.columns = [plan.name for plan in plans]
+                    result.types = {plan.name: plan.describe() for plan in plans}
+                    layout = result.layout = TableLayout(table_name, {
+                        plan.name: dictionary_table(table_name, plan.name) for plan in plans if plan.dictionary is not None
+                    })
+                    for table in layout.tables:
+                        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+                    column_defs = ", ".join(_column_def(plan, strict) for plan in plans)
+                    table = quote_identifier(layout.storage)
+                    conn.execute(f"CREATE TABLE {table} ({column_defs}){strict}")
+                    for dictionary in layout.dictionaries.values():
+                        conn.execute(
+                            f"CREATE TABLE {quote_identifier(dictionary)} "
+                            f"(id INTEGER PRIMARY KEY, value TEXT UNIQUE){strict}"
+                        )
+                        conn.execute(f"INSERT INTO {quote_identifier(dictionary)} VALUES (?, NULL)", (NULL_CODE,))
+                    placeholders = ", ".join("?" for _ in result.columns)
+                    insert_sql = f"INSERT INTO {table} VALUES ({placeholders})"
+                converted, new_codes = convert_chunk(chunk, plans)
+                payload = estimate_payload(chunk, converted, plans)
+                for column, codes in new_codes.items():
+                    conn.executemany(f"INSERT INTO {quote_identifier(layout.dictionaries[column])} VALUES (?, ?)", codes)
+                try:
+                    conn.executemany(insert_sql, _chunk_rows(converted))
+                except sqlite3.IntegrityError as e:
+                    raise _strict_mismatch(e) or e
+                for column, (text_bytes, typed_bytes) in payload.items():
+                    totals = result.column_bytes.setdefault(column, [0, 0])
+                    totals[0] += text_bytes
+                    totals[1] += typed_bytes
+                    result.text_bytes += text_bytes
+                    result.typed_bytes += typed_bytes
+                result.rows += len(chunk)
+                result.chunks += 1
+                if progress is not None:
+                    progress(conn, result)
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+            if plans is None:
+                raise ValueError("CSV file contains no columns")
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            reader.close()
+            text.detach()
+            for name, value in saved_pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            conn.isolation_level = saved_isolation
+
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def replace(self, conn, source, table_name: str, prepare: Optional[Callable] = None,
+                publish: Optional[Callable] = None, progress: Optional[Callable] = None) -> IngestResult:
+        """Load ``source`` into staging tables and swap them in for ``table_name``.
+
+        ``prepare(conn, layout)`` runs after the rows are loaded and before
+        the swap, to build indexes and collect statistics on the staging
+        layout; ``layout.name`` is queryable like the final table (through a
+        temporary view when encoded). ``publish(conn, layout)`` runs inside
+        the swap transaction with the final layout. On any failure the
+        staging tables are dropped and the live table is left as it was.
+        """
+        staging = TableLayout(_generation_name(STAGING_PREFIX, table_name))
+        try:
+            result = self.load(conn, source, staging.name, encode=True, progress=progress)
+            staging = result.layout
+            if staging.encoded:
+                conn.execute(staging.view_sql(result.columns, temp=True))
+            if prepare is not None:
+                prepare(conn, staging)
+            for table in staging.tables:
+                conn.execute(f"ANALYZE {quote_identifier(table)}")
+            conn.commit()
+            result.disk_bytes = bytes_on_disk(conn, staging.tables)
+            swap_started = time.perf_counter()
+            retired = swap_tables(conn, staging, table_name, publish)
+            result.swap_seconds = time.perf_counter() - swap_started
+        except Exception:
+            drop_generation(conn, staging.name)
+            raise
+        for table in retired:
+            drop_table(conn, table)
+        result.table_name = table_name
+        result.layout = staging.renamed(table_name)
+        return result
+
+    def append(self, conn, source, table_name: str, key: Optional[str] = None, upsert: bool = False,
+               prepare: Optional[Callable] = None, publish: Optional[Callable] = None,
+               progress: Optional[Callable] = None) -> IngestResult:
+        """Merge the rows read from ``source`` into the existing ``table_name``.
+
+        The delta is loaded into a staging table first, so every step below
+        costs time proportional to the delta rather than to the live table:
+
+        * with ``key``, a unique index on that column backs deduplication;
+          repeated keys inside the delta keep their last row, and keys that
+          already exist are skipped (append) or overwritten (``upsert``);
+        * ``prepare(conn, staging)`` sees exactly the rows that will be
+          written, for incremental statistics;
+        * the merge is one ``INSERT ... SELECT`` transaction, which also
+          covers ``publish(conn, result)``.
+
+        Columns missing from the delta are stored as NULL; columns unknown to
+        the live table are rejected. For a dictionary-encoded table, new
+        values are added to the lookup tables and the rows are written as
+        codes into its storage table.
+        """
+        if upsert and not key:
+            raise ValueError("Upsert mode requires a key column")
+        layout = layout_of(conn, table_name)
+        if layout is None:
+            raise LookupError(f"Table '{table_name}' does not exist")
+        live = quote_identifier(table_name)
+        storage = quote_identifier(layout.storage)
+        live_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({live})")]
+
+        staging = _generation_name(STAGING_PREFIX, table_name)
+        try:
+            result = self.load(conn, source, staging, progress=progress)
+            result.table_name = table_name
+            result.mode = "upsert" if upsert else "append"
+            unknown = [c for c in result.columns if c not in live_columns]
+            if unknown:
+                raise ValueError(f"Columns not in table '{table_name}': {', '.join(unknown)}")
+            stage = quote_identifier(staging)
+            columns = ", ".join(quote_identifier(c) for c in result.columns)
+            conflict = ""
+
+            if key:
+                if key not in result.columns:
+                    raise ValueError(f"Key column '{key}' is not in the uploaded file")
+                k = quote_identifier(key)
+                try:
+                    conn.execute(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(f'uk_{table_name}_{key}')} ON {storage} ({k})"
+                    )
+                except sqlite3.IntegrityError as e:
+                    raise ValueError(f"Column '{key}' has duplicate values and cannot be used as a key") from e
+                result.skipped += conn.execute(
+                    f"DELETE FROM {stage} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {stage} GROUP BY {k})"
+                ).rowcount
+                existing = f"EXISTS (SELECT 1 FROM {live} AS t WHERE t.{k} = {stage}.{k})"
+                if upsert:
+                    result.updated = conn.execute(f"SELECT COUNT(*) FROM {stage} WHERE {existing}").fetchone()[0]
+                    if result.updated:
+                        counts = conn.execute(
+                            f"SELECT {', '.join(f'COUNT({quote_identifier(c)})' for c in result.columns)} "
+                            f"FROM {live} WHERE {k} IN (SELECT {k} FROM {stage})"
+                        ).fetchone()
+                        result.replaced_non_null = dict(zip(result.columns, counts))
+                    assignments = ", ".join(
+                        f"{quote_identifier(c)} = excluded.{quote_identifier(c)}" for c in result.columns if c != key
+                    )
+                    conflict = f" ON CONFLICT ({k}) DO " + (f"UPDATE SET {assignments}" if assignments else "NOTHING")
+                else:
+                    result.skipped += conn.execute(f"DELETE FROM {stage} WHERE {existing}").rowcount
+            conn.commit()
+
+            if prepare is not None:
+                prepare(conn, staging)
+            result.inserted = conn.execute(f"SELECT COUNT(*) FROM {stage}").fetchone()[0] - result.updated
+            values = []
+            for column in result.columns:
+                col = quote_identifier(column)
+                if column in layout.dictionaries:
+                    dictionary = quote_identifier(layout.dictionaries[column])
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO {dictionary} (value) SELECT DISTINCT {col} FROM {stage} WHERE {col} IS NOT NULL"
+                    )
+                    values.append(f"COALESCE((SELECT id FROM {dictionary} WHERE value = {stage}.{col}), {NULL_CODE})")
+                else:
+                    values.append(f"{stage}.{col}")
+            try:
+                conn.execute(
+                    f"INSERT INTO {storage} ({columns}) SELECT {', '.join(values)} FROM {stage} WHERE true{conflict}"
+                )
+            except sqlite3.IntegrityError as e:
+                mismatch = _strict_mismatch(e)
+                if mismatch is not None:
+                    raise ValueError(f"Column '{mismatch.column}' does not match the type stored in '{table_name}'") from e
+                raise ValueError(f"Rows conflict with existing data ({e}); upload with a key column") from e
+            if publish is not None:
+                try:
+                    publish(conn, result)
+                except Exception:
+                    conn.rollback()
+                    raise
+            conn.commit()
+        finally:
+            drop_table(conn, staging)
+        return result
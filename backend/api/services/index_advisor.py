@@ -0,0 +1,499 @@
+"""Workload-driven index advisor for uploaded tables.
+
+Every executed statement is scanned for filter predicates (``col = ?``,
+``col IN (...)``, ranges, ``LOWER(col) = ?``) and ``GROUP BY`` columns.
+Candidates that keep recurring are turned into single-column, composite or
+expression indexes by a periodic maintenance pass, within a storage budget
+and at most ``max_builds_per_pass`` at a time; the least used automatic
+indexes are dropped to make room. For each index built, the query that
+triggered it is timed on a reader before and after so the speedup can be
+reported; only the ``CREATE`` / ``DROP INDEX`` statements take the writer.
+
+Every worker process records its own workload, but only one at a time runs
+maintenance: the holder of a lease row in ``_nlq_state``, renewed on every
+pass and taken over once it expires. Each pass first reconciles the
+bookkeeping with the automatic indexes actually in ``sqlite_master``, so the
+storage budget and per-table cap count indexes whichever process built them,
+and those indexes can be evicted like any other.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from api.services.dataset_registry import STATE_TABLE
+from api.services.document_processor import quote_identifier
+
+INDEX_PREFIX = "auto_idx_"
+LEASE_KEY = "index_maintenance"
+_INDEX_COLUMNS_RE = re.compile(r'\bON\s+(?:"(?:[^"]|"")*"|\S+)\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+_INDEX_ITEM_RE = re.compile(r'(?:(LOWER|UPPER)\s*\(\s*)?"((?:[^"]|"")*)"', re.IGNORECASE)
+_CLAUSE_END_RE = re.compile(r"\b(group\s+by|order\s+by|limit|having|window|union)\b", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bwhere\b", re.IGNORECASE)
+_GROUP_BY_RE = re.compile(r"\bgroup\s+by\b(.*?)(?=\b(?:having|order\s+by|limit|window|union)\b|$)",
+                          re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class IndexCandidate:
+    table: str
+    key: Tuple[str, ...]  # column names, or "lower(col)" for expression keys
+    reason: str
+    occurrences: int = 0
+    last_sql: str = ""
+    last_seen: float = 0.0
+
+
+@dataclass
+class IndexRecord:
+    name: str
+    table: str
+    key: Tuple[str, ...]
+    reason: str
+    created_at: float = field(default_factory=time.time)
+    size_bytes: Optional[int] = None
+    triggered_by: str = ""
+    before_ms: Optional[float] = None
+    after_ms: Optional[float] = None
+    uses: int = 0
+
+    @property
+    def speedup(self) -> Optional[float]:
+        if self.before_ms and self.after_ms:
+            return round(self.before_ms / max(self.after_ms, 0.001), 2)
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "table": self.table,
+            "key": list(self.key),
+            "reason": self.reason,
+            "created_at": self.created_at,
+            "size_bytes": self.size_bytes,
+            "triggered_by": self.triggered_by,
+            "before_ms": self.before_ms,
+            "after_ms": self.after_ms,
+            "speedup": self.speedup,
+            "uses": self.uses,
+        }
+
+
+def _column_pattern(columns: List[str]) -> str:
+    names = sorted(columns, key=len, reverse=True)
+    alternatives = "|".join(re.escape(n) for n in names)
+    return r'(?:[`"\[]({0})[`"\]]|(?<![\w%])({0})(?![\w%]))'.format(alternatives)
+
+
+def _canonical(columns: List[str], name: str) -> str:
+    lowered = name.lower()
+    for col in columns:
+        if col.lower() == lowered:
+            return col
+    return name
+
+
+def extract_candidates(sql: str, columns: List[str], distinct_counts: Optional[Dict[str, int]] = None):
+    """Return ``[(key, reason)]`` index candidates suggested by ``sql``."""
+    if not columns:
+        return []
+    distinct_counts = distinct_counts or {}
+    col = _column_pattern(columns)
+    flags = re.IGNORECASE
+    candidates = []
+
+    where = _WHERE_RE.search(sql)
+    if where:
+        body = sql[where.end():]
+        end = _CLAUSE_END_RE.search(body)
+        body = body[:end.start()] if end else body
+
+        for m in re.finditer(r"\b(lower|upper)\s*\(\s*" + col + r"\s*\)\s*(=|==|in\b|like\b)", body, flags):
+            name = _canonical(columns, m.group(2) or m.group(3))
+            candidates.append(((f"{m.group(1).lower()}({name})",), "expression filter"))
+
+        equality, ranges = [], []
+        for m in re.finditer(col + r"\s*(=|==|\bin\s*\(|\bis\s+(?!null))", body, flags):
+            name = _canonical(columns, m.group(1) or m.group(2))
+            if name not in equality:
+                equality.append(name)
+        for m in re.finditer(col + r"\s*(<=|>=|<(?!>)|>|\bbetween\b)", body, flags):
+            name = _canonical(columns, m.group(1) or m.group(2))
+            if name not in ranges and name not in equality:
+                ranges.append(name)
+
+        for name in equality:
+            candidates.append(((name,), "equality filter"))
+        for name in ranges:
+            candidates.append(((name,), "range filter"))
+        if len(equality) > 1 or (equality and ranges):
+            # Most selective equality columns first, then at most one range column.
+            ordered = sorted(equality, key=lambda c: -(distinct_counts.get(c) or 0))
+            candidates.append((tuple(ordered + ranges[:1]), "composite filter"))
+
+    group = _GROUP_BY_RE.search(sql)
+    if group:
+        names = []
+        for item in group.group(1).split(","):
+            m = re.fullmatch(r"\s*" + col + r"\s*", item, flags)
+            if m:
+                names.append(_canonical(columns, m.group(1) or m.group(2)))
+        if names:
+            candidates.append((tuple(names), "group by"))
+    return candidates
+
+
+def index_name(table: str, key: Tuple[str, ...]) -> str:
+    digest = hashlib.sha1(("|".join(key)).encode("utf-8")).hexdigest()[:10]
+    safe_table = re.sub(r"\W", "_", table)
+    return f"{INDEX_PREFIX}{safe_table}_{digest}"
+
+
+def _key_columns(key: Tuple[str, ...]) -> List[str]:
+    return [re.sub(r"^(lower|upper)\((.+)\)$", r"\2", item) for item in key]
+
+
+def _indexable(key: Tuple[str, ...], encoded) -> bool:
+    """Expression keys cannot use a dictionary-encoded column: it stores codes."""
+    return not any(item != column and column in encoded for item, column in zip(key, _key_columns(key)))
+
+
+def index_columns_sql(key: Tuple[str, ...]) -> str:
+    parts = []
+    for item in key:
+        m = re.fullmatch(r"(lower|upper)\((.+)\)", item)
+        parts.append(f"{m.group(1).upper()}({quote_identifier(m.group(2))})" if m else quote_identifier(item))
+    return ", ".join(parts)
+
+
+def parse_index_key(sql: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Recover the key of an automatic index from its ``CREATE INDEX`` text."""
+    m = _INDEX_COLUMNS_RE.search(sql or "")
+    if not m:
+        return None
+    key = []
+    for item in _INDEX_ITEM_RE.finditer(m.group(1)):
+        column = item.group(2).replace('""', '"')
+        key.append(f"{item.group(1).lower()}({column})" if item.group(1) else column)
+    return tuple(key) or None
+
+
+def build_indexes(conn, staging: str, keys: List[Tuple[str, ...]], encoded=()) -> Dict[Tuple[str, ...], str]:
+    """Create the indexes for ``keys`` that ``staging`` can hold; returns key -> index name.
+
+    Standalone so ingestion jobs can run it on their own connection with keys
+    taken from the advisor beforehand.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(staging)})")}
+    built = {}
+    for key in keys:
+        key = tuple(key)
+        if any(c not in columns for c in _key_columns(key)) or not _indexable(key, encoded):
+            continue
+        name = index_name(staging, key)
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} "
+            f"ON {quote_identifier(staging)} ({index_columns_sql(key)})"
+        )
+        built[key] = name
+    conn.commit()
+    return built
+
+
+def _time_query(conn, sql: str, timeout: float) -> Optional[float]:
+    """Run ``sql`` to completion and return milliseconds, or None if it exceeds ``timeout``."""
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 1000)
+    started = time.perf_counter()
+    try:
+        for _ in conn.execute(sql):
+            pass
+    except Exception:
+        return None
+    finally:
+        conn.set_progress_handler(None, 1000)
+    return round(1000 * (time.perf_counter() - started), 3)
+
+
+def _index_size(conn, name: str, estimate: int) -> int:
+    try:
+        row = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()
+        if row and row[0]:
+            return int(row[0])
+    except Exception:
+        pass  # dbstat is an optional SQLite build feature
+    return estimate
+
+
+class IndexAdvisor:
+    """Record workload predicates and maintain automatic indexes."""
+
+    def __init__(self, enabled: bool = True, storage_budget_mb: float = 256, min_occurrences: int = 3,
+                 min_table_rows: int = 10000, max_indexes_per_table: int = 8, timing_timeout: float = 5.0,
+                 interval_seconds: float = 30, max_builds_per_pass: int = 2):
+        self.enabled = enabled
+        self.storage_budget = int(storage_budget_mb * 1024 * 1024)
+        self.min_occurrences = min_occurrences
+        self.min_table_rows = min_table_rows
+        self.max_indexes_per_table = max_indexes_per_table
+        self.timing_timeout = timing_timeout
+        self.interval_seconds = interval_seconds
+        self.max_builds_per_pass = max(1, int(max_builds_per_pass))
+        self.owner = f"{os.getpid()}:{id(self):x}"
+        self.holds_lease = False
+        self._candidates: Dict[Tuple[str, Tuple[str, ...]], IndexCandidate] = {}
+        self._indexes: Dict[str, IndexRecord] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "IndexAdvisor":
+        section = config.get("index_advisor", {})
+        keys = ("enabled", "storage_budget_mb", "min_occurrences", "min_table_rows",
+                "max_indexes_per_table", "timing_timeout", "interval_seconds", "max_builds_per_pass")
+        return cls(**{k: section[k] for k in keys if k in section})
+
+    # -- workload --------------------------------------------------------
+
+    def observe(self, sql: str, schema) -> None:
+        """Record the predicates of a successfully executed statement against ``schema``."""
+        if not self.enabled or schema is None:
+            return
+        distinct = {c.name: c.distinct_count for c in schema.columns}
+        now = time.time()
+        with self._lock:
+            for key, reason in extract_candidates(sql, schema.column_names, distinct):
+                entry = self._candidates.get((schema.name, key))
+                if entry is None:
+                    entry = self._candidates[(schema.name, key)] = IndexCandidate(schema.name, key, reason)
+                entry.occurrences += 1
+                entry.last_sql = sql
+                entry.last_seen = now
+                record = self._find(schema.name, key)
+                if record is not None:
+                    record.uses += 1
+
+    def forget_table(self, table: str) -> None:
+        """Drop bookkeeping for indexes that vanished with a replaced table.
+
+        Workload counts are kept so the next maintenance pass rebuilds the
+        indexes that are still useful on the new data.
+        """
+        with self._lock:
+            for name in [n for n, r in self._indexes.items() if r.table == table]:
+                del self._indexes[name]
+
+    def keys_for(self, table: str) -> List[Tuple[str, ...]]:
+        with self._lock:
+            return [r.key for r in self._indexes.values() if r.table == table]
+
+    def _records(self, table: Optional[str] = None) -> List[IndexRecord]:
+        """A snapshot of the records (of ``table``), safe to scan while others change them."""
+        with self._lock:
+            return [r for r in self._indexes.values() if table is None or r.table == table]
+
+    def _find(self, table: str, key: Tuple[str, ...]) -> Optional[IndexRecord]:
+        # Records are matched by table and key: a swapped-in table carries the
+        # index names of the staging table it was built as. Callers hold the lock.
+        for record in self._indexes.values():
+            if record.table == table and record.key == key:
+                return record
+        return None
+
+    def rebind(self, conn, table: str, built: Dict[Tuple[str, ...], str]) -> None:
+        """Point ``table``'s records at the indexes ``build_indexes`` created, after the swap."""
+        with self._lock:
+            for name in [n for n, r in self._indexes.items() if r.table == table]:
+                record = self._indexes.pop(name)
+                if record.key in built:
+                    record.name = built[record.key]
+                    record.size_bytes = _index_size(conn, record.name, record.size_bytes or 0)
+                    self._indexes[record.name] = record
+
+    # -- maintenance (runs on the writer connection) ----------------------
+
+    def acquire_lease(self, conn, ttl: Optional[float] = None) -> bool:
+        """Take or renew the maintenance lease; False while another process holds it."""
+        now = time.time()
+        ttl = ttl if ttl is not None else 3 * self.interval_seconds
+        cursor = conn.execute(
+            f"INSERT INTO {quote_identifier(STATE_TABLE)} (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value "
+            "WHERE json_extract(value, '$.owner') = ? OR json_extract(value, '$.expires') < ?",
+            (LEASE_KEY, json.dumps({"owner": self.owner, "expires": now + ttl}), self.owner, now),
+        )
+        conn.commit()
+        self.holds_lease = cursor.rowcount == 1
+        return self.holds_lease
+
+    def sync(self, conn, catalog) -> None:
+        """Reconcile the records with the automatic indexes present in the database.
+
+        Indexes another process built are adopted (with no rationale, and the
+        workload count this process saw for their key); records whose index
+        was dropped elsewhere are forgotten.
+        """
+        datasets = {schema.storage: schema.name for schema in catalog.tables()}
+        present = {}
+        for name, storage, sql in conn.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE ?",
+            (INDEX_PREFIX + "%",),
+        ):
+            present[name] = (datasets.get(storage), parse_index_key(sql))
+        with self._lock:
+            for name in [n for n in self._indexes if n not in present]:
+                del self._indexes[name]
+            adopt = [(name, table, key) for name, (table, key) in present.items()
+                     if name not in self._indexes and table is not None and key is not None]
+        for name, table, key in adopt:
+            size = _index_size(conn, name, 0)
+            with self._lock:
+                candidate = self._candidates.get((table, key))
+                self._indexes[name] = IndexRecord(
+                    name=name, table=table, key=key, reason="created by another server process",
+                    size_bytes=size, uses=candidate.occurrences if candidate else 0,
+                )
+
+    def begin_pass(self, conn, catalog) -> List[IndexCandidate]:
+        """Sync the records and return the candidates to build this pass.
+
+        Runs on the writer connection (the lease is a write) and returns
+        nothing unless this process holds the lease; at most
+        ``max_builds_per_pass`` candidates, hottest first.
+        """
+        if not self.enabled:
+            return []
+        self.sync(conn, catalog)
+        if not self.acquire_lease(conn):
+            return []
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        with self._lock:
+            hot = sorted(
+                (c for c in self._candidates.values() if c.occurrences >= self.min_occurrences),
+                key=lambda c: -c.occurrences,
+            )
+            known = {(r.table, r.key) for r in self._indexes.values()}
+        picked = []
+        for candidate in hot:
+            if len(picked) >= self.max_builds_per_pass:
+                break
+            schema = catalog.get(candidate.table)
+            if (index_name(candidate.table, candidate.key) in existing or (candidate.table, candidate.key) in known
+                    or schema is None or schema.row_count < self.min_table_rows):
+                continue
+            if any(schema.column(c) is None for c in _key_columns(candidate.key)):
+                continue  # column no longer exists after a re-upload
+            if not _indexable(candidate.key, schema.encoded):
+                continue
+            picked.append(candidate)
+        return picked
+
+    def build(self, conn, candidate: IndexCandidate, catalog) -> List[dict]:
+        """Make room for ``candidate`` within the budget and create its index; returns the actions.
+
+        Only the ``DROP INDEX`` / ``CREATE INDEX`` statements run here, on the
+        writer connection; timing is left to ``time_query`` on a reader.
+        """
+        schema = catalog.get(candidate.table)
+        if schema is None:
+            return []
+        actions = []
+        name = index_name(candidate.table, candidate.key)
+        per_table = self._records(candidate.table)
+        estimate = schema.row_count * (16 + 12 * len(candidate.key))
+        while (len(per_table) >= self.max_indexes_per_table
+               or self.used_bytes() + estimate > self.storage_budget):
+            victim = self._least_used(exclude_above=candidate.occurrences)
+            if victim is None:
+                break
+            conn.execute(f"DROP INDEX IF EXISTS {quote_identifier(victim.name)}")
+            with self._lock:
+                self._indexes.pop(victim.name, None)
+            actions.append({"action": "drop", "index": victim.name, "reason": "storage budget / least used"})
+            per_table = self._records(candidate.table)
+        if len(per_table) >= self.max_indexes_per_table or self.used_bytes() + estimate > self.storage_budget:
+            conn.commit()
+            return actions
+
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} "
+            f"ON {quote_identifier(schema.storage)} ({index_columns_sql(candidate.key)})"
+        )
+        conn.commit()
+        record = IndexRecord(
+            name=name, table=candidate.table, key=candidate.key, reason=candidate.reason,
+            size_bytes=_index_size(conn, name, estimate), triggered_by=candidate.last_sql,
+            uses=candidate.occurrences,
+        )
+        with self._lock:
+            self._indexes[name] = record
+        actions.append({"action": "create", **record.to_dict()})
+        return actions
+
+    def time_query(self, conn, sql: str) -> Optional[float]:
+        """Milliseconds ``sql`` takes on ``conn`` (a reader), or None past ``timing_timeout``."""
+        return _time_query(conn, sql, self.timing_timeout)
+
+    def record_timing(self, name: str, before_ms: Optional[float], after_ms: Optional[float]) -> dict:
+        """Attach the before/after timings to a built index; returns its ``create`` action."""
+        with self._lock:
+            record = self._indexes.get(name)
+            if record is not None:
+                record.before_ms, record.after_ms = before_ms, after_ms
+        return {"action": "create", "name": name, **(record.to_dict() if record is not None else {})}
+
+    def maintain(self, conn, catalog) -> List[dict]:
+        """Run a whole pass on one connection; return the actions taken.
+
+        The server runs the same steps itself, so that only ``begin_pass``
+        and ``build`` take the writer.
+        """
+        actions = []
+        for candidate in self.begin_pass(conn, catalog):
+            before = self.time_query(conn, candidate.last_sql)
+            for action in self.build(conn, candidate, catalog):
+                if action["action"] == "create":
+                    action = self.record_timing(action["name"], before, self.time_query(conn, candidate.last_sql))
+                actions.append(action)
+        return actions
+
+    def _least_used(self, exclude_above: int) -> Optional[IndexRecord]:
+        with self._lock:
+            victims = [r for r in self._indexes.values() if r.uses < exclude_above]
+        return min(victims, key=lambda r: r.uses) if victims else None
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(r.size_bytes or 0 for r in self._indexes.values())
+
+    # -- reporting -------------------------------------------------------
+
+    def report(self, conn=None) -> dict:
+        """Automatic indexes with their rationale, plus pending candidates."""
+        with self._lock:
+            indexes = [r.to_dict() for r in self._indexes.values()]
+            known = set(self._indexes)
+            candidates = [
+                {"table": c.table, "key": list(c.key), "reason": c.reason, "occurrences": c.occurrences}
+                for c in sorted(self._candidates.values(), key=lambda c: -c.occurrences)
+                if self._find(c.table, c.key) is None
+            ]
+        if conn is not None:
+            # Indexes built by an earlier process have no recorded rationale.
+            for name, table in conn.execute(
+                "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name LIKE ?",
+                (INDEX_PREFIX + "%",),
+            ):
+                if name not in known:
+                    indexes.append({"name": name, "table": table, "reason": "created by a previous server run"})
+        return {
+            "enabled": self.enabled,
+            "maintenance_lease": self.holds_lease,
+            "storage_budget_bytes": self.storage_budget,
+            "storage_used_bytes": self.used_bytes(),
+            "indexes": indexes,
+            "candidates": candidates,
+        }
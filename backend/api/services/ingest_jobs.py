@@ -0,0 +1,534 @@
+"""Background ingestion jobs.
+
+An upload is copied to a spool file and handed to a bounded pool of worker
+processes (threads when processes are unavailable), so parsing, type
+inference, loading and index building run off the event loop and off the
+query connections. Each job opens its own connection to the database file.
+SQLite still admits one writer at a time, but the loader only holds the
+write lock while it inserts a converted chunk, so concurrent jobs parse and
+convert in parallel and interleave their inserts.
+
+Job state lives in the ``_nlq_jobs`` table of the database itself: every
+worker process can report on any job, and the job updates its row count,
+bytes read and stage inside the transaction of each chunk it writes.
+Cancellation is a flag on that row, checked at every chunk and stage; a
+cancelled or failed job drops its staging tables and leaves the live
+dataset untouched.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from api.services.database import connect
+from api.services.dataset_registry import DatasetRegistry
+from api.services.document_processor import DEFAULT_CHUNK_ROWS, StreamingCSVLoader, quote_identifier, table_exists
+from api.services.index_advisor import build_indexes
+from api.services.schema_discovery import analyze_table, merge_delta
+from api.services.type_inference import IngestOptions
+
+logger = logging.getLogger("nlp_query_engine")
+
+JOBS_TABLE = "_nlq_jobs"
+ACTIVE_STATES = ("queued", "running")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+_COLUMNS = ("id", "dataset", "filename", "mode", "state", "stage", "rows", "bytes_read", "total_bytes",
+            "error", "error_kind", "result_json", "cancel_requested", "owner_pid",
+            "created_at", "started_at", "finished_at")
+
+
+class IngestCancelled(Exception):
+    """The job's cancel flag was set while it ran."""
+
+
+@dataclass
+class JobConfig:
+    executor: str = "process"  # or "thread"
+    max_workers: int = 2
+    max_queued: int = 16
+    keep_finished: int = 200
+    busy_timeout_seconds: float = 300.0
+    spool_dir: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "JobConfig":
+        section = config.get("ingest_jobs", {})
+        return cls(**{k: v for k, v in section.items() if k in cls.__dataclass_fields__})
+
+
+@dataclass
+class IngestJob:
+    id: str
+    dataset: str
+    filename: str
+    mode: str = "replace"
+    state: str = "queued"
+    stage: str = "queued"
+    rows: int = 0
+    bytes_read: int = 0
+    total_bytes: Optional[int] = None
+    error: Optional[str] = None
+    error_kind: Optional[str] = None  # "invalid" (bad input) or "internal"
+    result: Optional[dict] = None
+    cancel_requested: bool = False
+    owner_pid: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row) -> "IngestJob":
+        values = dict(zip(_COLUMNS, row))
+        result_json = values.pop("result_json")
+        values["result"] = json.loads(result_json) if result_json else None
+        values["cancel_requested"] = bool(values["cancel_requested"])
+        return cls(**values)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> dict:
+        elapsed = self.elapsed
+        if self.state == "succeeded":
+            progress = 100.0
+        elif self.total_bytes:
+            progress = min(100.0, 100 * self.bytes_read / self.total_bytes)
+        else:
+            progress = 0.0
+        return {
+            "id": self.id,
+            "dataset": self.dataset,
+            "filename": self.filename,
+            "mode": self.mode,
+            "state": self.state,
+            "stage": self.stage,
+            "rows_processed": self.rows,
+            "bytes_read": self.bytes_read,
+            "total_bytes": self.total_bytes,
+            "progress_pct": round(progress, 1),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+            "cancel_requested": self.cancel_requested,
+            "error": self.error,
+            "error_kind": self.error_kind,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """Reads and writes of the jobs table; every method takes the connection to use."""
+
+    def __init__(self, keep_finished: int = 200):
+        self.keep_finished = max(0, keep_finished)
+
+    def install(self, conn) -> None:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(JOBS_TABLE)} ("
+            "id TEXT PRIMARY KEY, dataset TEXT NOT NULL, filename TEXT, mode TEXT NOT NULL, "
+            "state TEXT NOT NULL, stage TEXT, rows INTEGER NOT NULL DEFAULT 0, "
+            "bytes_read INTEGER NOT NULL DEFAULT 0, total_bytes INTEGER, error TEXT, error_kind TEXT, "
+            "result_json TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, owner_pid INTEGER, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        conn.commit()
+
+    def insert(self, conn, job: IngestJob) -> None:
+        conn.execute(
+            f"INSERT INTO {quote_identifier(JOBS_TABLE)} ({', '.join(_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+            (job.id, job.dataset, job.filename, job.mode, job.state, job.stage, job.rows, job.bytes_read,
+             job.total_bytes, job.error, job.error_kind, json.dumps(job.result) if job.result else None,
+             int(job.cancel_requested), job.owner_pid, job.created_at, job.started_at, job.finished_at),
+        )
+        conn.commit()
+
+    def get(self, conn, job_id: str) -> Optional[IngestJob]:
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM {quote_identifier(JOBS_TABLE)} WHERE id = ?", (job_id,)
+        ).fetchone()
+        return IngestJob.from_row(row) if row else None
+
+    def list(self, conn, state: Optional[str] = None, limit: int = 50) -> List[IngestJob]:
+        where, params = ("WHERE state = ?", (state,)) if state else ("", ())
+        rows = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM {quote_identifier(JOBS_TABLE)} {where} "
+            "ORDER BY created_at DESC LIMIT ?", params + (limit,)
+        ).fetchall()
+        return [IngestJob.from_row(row) for row in rows]
+
+    def active(self, conn) -> int:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {quote_identifier(JOBS_TABLE)} WHERE state IN (?, ?)", ACTIVE_STATES
+        ).fetchone()[0]
+
+    def claim(self, conn, job_id: str) -> bool:
+        """Move a queued job to running; False when it was cancelled before it started."""
+        now = time.time()
+        claimed = conn.execute(
+            f"UPDATE {quote_identifier(JOBS_TABLE)} SET state = 'running', stage = 'starting', started_at = ? "
+            "WHERE id = ? AND state = 'queued'", (now, job_id)
+        ).rowcount
+        conn.commit()
+        return bool(claimed)
+
+    def request_cancel(self, conn, job_id: str) -> bool:
+        """Flag an active job for cancellation; a job still queued is cancelled at once."""
+        flagged = conn.execute(
+            f"UPDATE {quote_identifier(JOBS_TABLE)} SET cancel_requested = 1, "
+            "state = CASE WHEN state = 'queued' THEN 'cancelled' ELSE state END, "
+            "finished_at = CASE WHEN state = 'queued' THEN ? ELSE finished_at END "
+            "WHERE id = ? AND state IN (?, ?)", (time.time(), job_id) + ACTIVE_STATES
+        ).rowcount
+        conn.commit()
+        return bool(flagged)
+
+    def progress(self, conn, job_id: str, rows: int, bytes_read: int) -> bool:
+        """Record progress in the caller's transaction; returns the cancel flag."""
+        conn.execute(
+            f"UPDATE {quote_identifier(JOBS_TABLE)} SET rows = ?, bytes_read = ? WHERE id = ?",
+            (rows, bytes_read, job_id),
+        )
+        return self._cancel_requested(conn, job_id)
+
+    def set_stage(self, conn, job_id: str, stage: str) -> bool:
+        """Record the stage (committing unless the caller has a transaction open); returns the cancel flag."""
+        commit = not conn.in_transaction
+        conn.execute(f"UPDATE {quote_identifier(JOBS_TABLE)} SET stage = ? WHERE id = ?", (stage, job_id))
+        cancelled = self._cancel_requested(conn, job_id)
+        if commit:
+            conn.commit()
+        return cancelled
+
+    def _cancel_requested(self, conn, job_id: str) -> bool:
+        row = conn.execute(
+            f"SELECT cancel_requested FROM {quote_identifier(JOBS_TABLE)} WHERE id = ?", (job_id,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, conn, job_id: str, state: str, error: Optional[str] = None,
+               error_kind: Optional[str] = None, result: Optional[dict] = None) -> None:
+        conn.execute(
+            f"UPDATE {quote_identifier(JOBS_TABLE)} SET state = ?, stage = ?, error = ?, error_kind = ?, "
+            "result_json = ?, finished_at = ? WHERE id = ?",
+            (state, state, error, error_kind, json.dumps(result) if result else None, time.time(), job_id),
+        )
+        conn.execute(
+            f"DELETE FROM {quote_identifier(JOBS_TABLE)} WHERE state IN (?, ?, ?) AND id NOT IN "
+            f"(SELECT id FROM {quote_identifier(JOBS_TABLE)} WHERE state IN (?, ?, ?) "
+            "ORDER BY finished_at DESC LIMIT ?)", FINISHED_STATES + FINISHED_STATES + (self.keep_finished,)
+        )
+        conn.commit()
+
+    def fail_orphans(self, conn) -> List[str]:
+        """Fail active jobs whose server process is gone (a crash or restart mid-upload)."""
+        rows = conn.execute(
+            f"SELECT id, owner_pid FROM {quote_identifier(JOBS_TABLE)} WHERE state IN (?, ?)", ACTIVE_STATES
+        ).fetchall()
+        orphans = [job_id for job_id, pid in rows if not _pid_alive(pid)]
+        for job_id in orphans:
+            self.finish(conn, job_id, "failed", "Interrupted: the server process running the upload exited",
+                        "internal")
+        return orphans
+
+
+@dataclass
+class IngestTask:
+    """Everything a pool worker needs to run one job; must stay picklable."""
+    job_id: str
+    db_path: str
+    spool_path: str
+    dataset: str
+    filename: str
+    mode: str = "replace"
+    key: Optional[str] = None
+    chunk_rows: int = DEFAULT_CHUNK_ROWS
+    encoding: str = "utf-8"
+    options: IngestOptions = field(default_factory=IngestOptions)
+    index_keys: List[Tuple[str, ...]] = field(default_factory=list)
+    busy_timeout: float = 300.0
+
+
+class JobTracker:
+    """Reports a running job's progress to its row and raises once it is cancelled."""
+
+    def __init__(self, store: JobStore, job_id: str, source=None):
+        self.store = store
+        self.job_id = job_id
+        self.source = source
+
+    def stage(self, conn, name: str) -> None:
+        if self.store.set_stage(conn, self.job_id, name):
+            raise IngestCancelled(self.job_id)
+
+    def progress(self, conn, result) -> None:
+        """``StreamingCSVLoader`` progress hook, called inside each chunk's transaction."""
+        bytes_read = self.source.tell() if self.source is not None else 0
+        if self.store.progress(conn, self.job_id, result.rows, bytes_read):
+            raise IngestCancelled(self.job_id)
+
+
+def ingest_file(conn, task: IngestTask, tracker: JobTracker, source) -> dict:
+    """Load ``source`` into ``task.dataset`` the way ``task.mode`` asks and publish it.
+
+    Appends and upserts into a missing dataset load it like a replace.
+    """
+    loader = StreamingCSVLoader(task.chunk_rows, task.encoding, task.options)
+    registry = DatasetRegistry()
+    staged = {"indexes": {}}
+    tracker.stage(conn, "loading")
+
+    if task.mode != "replace" and table_exists(conn, task.dataset):
+        def prepare(conn, staging):
+            tracker.stage(conn, "analyzing")
+            staged["delta"] = analyze_table(conn, staging)
+            tracker.stage(conn, "merging")
+
+        def publish(conn, result):
+            # Read in the merge transaction, so a concurrent merge into the same
+            # dataset is folded in rather than overwritten
+            base = registry.snapshot(conn, task.dataset)
+            if base is None:
+                schema = analyze_table(conn, task.dataset)
+            else:
+                schema = merge_delta(base, staged["delta"], result.inserted, result.updated,
+                                     result.replaced_non_null, unique=(task.key,) if task.key else ())
+            staged["columns"] = schema.column_names
+            staged["generation"] = registry.publish(conn, schema, task.filename)
+
+        result = loader.append(conn, source, task.dataset, key=task.key, upsert=(task.mode == "upsert"),
+                               prepare=prepare, publish=publish, progress=tracker.progress)
+    else:
+        def prepare(conn, staging):
+            tracker.stage(conn, "indexing")
+            staged["indexes"] = build_indexes(conn, staging.storage, task.index_keys, list(staging.dictionaries))
+            tracker.stage(conn, "analyzing")
+            staged["schema"] = analyze_table(conn, staging.name)
+
+        def publish(conn, layout):
+            # Registered in the swap transaction, so every worker sees the new
+            # table and its schema together
+            tracker.stage(conn, "swapping")
+            schema = staged["schema"]
+            schema.name = task.dataset
+            schema.storage_table = layout.storage if layout.encoded else None
+            staged["columns"] = schema.column_names
+            staged["generation"] = registry.publish(conn, schema, task.filename)
+
+        result = loader.replace(conn, source, task.dataset, prepare, publish, progress=tracker.progress)
+
+    return {
+        "table_name": task.dataset,
+        "columns": staged["columns"],
+        "generation": staged["generation"],
+        "indexes": [[list(key), name] for key, name in staged["indexes"].items()],
+        "ingestion": result.to_dict(),
+    }
+
+
+def run_job(task: IngestTask) -> dict:
+    """Pool entry point: run one job on a fresh connection and record how it ended.
+
+    Always returns the final job as a dict; the spool file is removed.
+    """
+    store = JobStore()
+    conn = connect(task.db_path, task.busy_timeout)
+    try:
+        if not store.claim(conn, task.job_id):
+            return store.get(conn, task.job_id).to_dict()
+        try:
+            with open(task.spool_path, "rb") as source:
+                outcome = ingest_file(conn, task, JobTracker(store, task.job_id, source), source)
+        except IngestCancelled:
+            _rollback(conn)
+            store.finish(conn, task.job_id, "cancelled")
+        except (ValueError, LookupError) as e:
+            _rollback(conn)
+            store.finish(conn, task.job_id, "failed", str(e), "invalid")
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", task.job_id)
+            _rollback(conn)
+            store.finish(conn, task.job_id, "failed", str(e), "internal")
+        else:
+            outcome["ingestion"]["peak_rss_mb"] = _peak_rss_mb()
+            store.finish(conn, task.job_id, "succeeded", result=outcome)
+        return store.get(conn, task.job_id).to_dict()
+    finally:
+        conn.close()
+        try:
+            os.remove(task.spool_path)
+        except OSError:
+            pass
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the process running the job, or None without /proc.
+
+    A pool worker reports the peak over every job it has run so far; with the
+    thread executor this is the server process itself.
+    """
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _rollback(conn) -> None:
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def fail_job(db_path: str, job_id: str, error: str) -> None:
+    """Record a job the pool lost (e.g. its worker process died)."""
+    conn = connect(db_path)
+    try:
+        store = JobStore()
+        job = store.get(conn, job_id)
+        if job is not None and not job.finished:
+            store.finish(conn, job_id, "failed", error, "internal")
+    finally:
+        conn.close()
+
+
+class JobCapacityError(Exception):
+    """Too many jobs are queued or running in this server process."""
+
+
+class IngestJobManager:
+    """This server process's pool of ingestion workers and the jobs it submitted."""
+
+    def __init__(self, db_path: str, config: Optional[JobConfig] = None,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, options: Optional[IngestOptions] = None):
+        self.db_path = os.path.abspath(db_path)
+        self.config = config or JobConfig()
+        self.chunk_rows = chunk_rows
+        self.options = options or IngestOptions()
+        self.store = JobStore(self.config.keep_finished)
+        self.spool_dir = self.config.spool_dir or tempfile.gettempdir()
+        self.kind = self.config.executor
+        self._executor = None
+        self._running = set()
+        self.counts = {state: 0 for state in ("submitted",) + FINISHED_STATES}
+
+    @classmethod
+    def from_config(cls, config: dict, db_path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                    options: Optional[IngestOptions] = None) -> "IngestJobManager":
+        return cls(db_path, JobConfig.from_config(config), chunk_rows, options)
+
+    def _pool(self):
+        if self._executor is None:
+            workers = max(1, int(self.config.max_workers))
+            if self.kind == "process":
+                try:
+                    # spawn: the server process runs threads, which fork does not copy safely
+                    self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+                except (OSError, NotImplementedError, ImportError) as e:
+                    logger.warning("Ingestion falls back to threads, no process pool: %s", e)
+                    self.kind = "thread"
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        return self._executor
+
+    def new_job(self, dataset: str, filename: str, mode: str) -> IngestJob:
+        if len(self._running) >= max(1, int(self.config.max_workers)) + max(0, int(self.config.max_queued)):
+            raise JobCapacityError(f"{len(self._running)} uploads are already queued or running; retry later")
+        return IngestJob(uuid.uuid4().hex[:16], dataset, filename, mode, owner_pid=os.getpid())
+
+    def spool_path(self, job: IngestJob) -> str:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        return os.path.join(self.spool_dir, f"nlq_ingest_{job.id}.csv")
+
+    def discard(self, spool_path: str) -> None:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+    def task(self, job: IngestJob, spool_path: str, key: Optional[str] = None,
+             index_keys: Optional[List[Tuple[str, ...]]] = None, encoding: str = "utf-8") -> IngestTask:
+        return IngestTask(job.id, self.db_path, spool_path, job.dataset, job.filename, job.mode, key,
+                          self.chunk_rows, encoding, self.options, list(index_keys or []),
+                          self.config.busy_timeout_seconds)
+
+    def submit(self, task: IngestTask,
+               on_finished: Optional[Callable[[dict], Awaitable]] = None) -> "asyncio.Task[dict]":
+        """Queue ``task`` on the pool; the returned asyncio task resolves to the finished job."""
+        self.counts["submitted"] += 1
+        future = asyncio.get_running_loop().run_in_executor(self._pool(), run_job, task)
+        watcher = asyncio.create_task(self._watch(task, future, on_finished))
+        self._running.add(watcher)
+        watcher.add_done_callback(self._running.discard)
+        return watcher
+
+    async def _watch(self, task: IngestTask, future, on_finished) -> dict:
+        try:
+            job = await future
+        except BrokenProcessPool as e:
+            # A worker died mid-job; the pool is unusable until replaced
+            self._executor = None
+            await asyncio.to_thread(fail_job, self.db_path, task.job_id, f"Ingestion worker exited: {e}")
+            job = await asyncio.to_thread(self._reload, task.job_id)
+        except Exception as e:
+            await asyncio.to_thread(fail_job, self.db_path, task.job_id, str(e))
+            job = await asyncio.to_thread(self._reload, task.job_id)
+        self.counts[job["state"]] = self.counts.get(job["state"], 0) + 1
+        if on_finished is not None:
+            try:
+                await on_finished(job)
+            except Exception as e:
+                logger.warning("Post-ingestion hook failed for job %s: %s", task.job_id, e)
+        return job
+
+    def _reload(self, job_id: str) -> dict:
+        conn = connect(self.db_path, readonly=True)
+        try:
+            return self.store.get(conn, job_id).to_dict()
+        finally:
+            conn.close()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.kind,
+            "max_workers": self.config.max_workers,
+            "max_queued": self.config.max_queued,
+            "active": len(self._running),
+            **self.counts,
+        }
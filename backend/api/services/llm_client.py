@@ -0,0 +1,328 @@
+"""Async LLM client with pooled connections, concurrency limits and failover.
+
+Each provider owns a keep-alive ``httpx.AsyncClient`` and a circuit breaker
+that skips it after repeated failures. ``LLMClient`` caps the number of
+concurrent provider calls and either fails over sequentially or, when
+``hedge_after`` is set, fires the next provider once the current one has
+been silent for that long and returns whichever answers first.
+
+Any OpenAI-compatible endpoint works as a provider, including a local fake
+server, by pointing ``OPENAI_API_BASE`` at it.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
+
+from api.services.metrics import LLM_SECONDS, record
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Raised when no provider produced a completion."""
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive failures for ``reset_timeout`` seconds."""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Forget an in-progress half-open probe that was cancelled."""
+        self._probing = False
+
+
+class Provider:
+    """Base class for an HTTP completion provider."""
+
+    name = "provider"
+
+    def __init__(self, timeout: float, max_connections: int = 10, breaker: Optional[CircuitBreaker] = None):
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.calls = 0
+        self.failures = 0
+        self.latency_total = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self._limits)
+        return self._client
+
+    async def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "avg_latency_ms": round(1000 * self.latency_total / self.calls, 1) if self.calls else 0.0,
+            "circuit": self.breaker.state,
+        }
+
+
+class OpenAICompatibleProvider(Provider):
+    """Chat-completions provider (OpenAI, Groq, or any compatible server)."""
+
+    def __init__(self, api_key: str, base_url: str, model: str, name: str = "openai", timeout: float = 20.0, **kwargs):
+        super().__init__(timeout, **kwargs)
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+
+    async def complete(self, prompt: str) -> str:
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "system", "content": "You are a SQL generator."},
+                         {"role": "user", "content": prompt}],
+            "temperature": 0.0,
+            "max_tokens": 300,
+        }
+        resp = await self.client.post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        )
+        if resp.status_code != 200:
+            raise LLMError(f"API error: {resp.status_code} - {resp.text}")
+        result = resp.json()
+        return result.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+
+class HuggingFaceProvider(Provider):
+    """Hugging Face Inference API text-generation provider."""
+
+    name = "huggingface"
+
+    def __init__(self, api_token: str, model: str, base_url: str = "https://api-inference.huggingface.co/models",
+                 timeout: float = 30.0, **kwargs):
+        super().__init__(timeout, **kwargs)
+        self.api_token = api_token
+        self.url = f"{base_url.rstrip('/')}/{model}"
+
+    async def complete(self, prompt: str) -> str:
+        payload = {"inputs": prompt, "parameters": {"max_new_tokens": 256, "temperature": 0.0}}
+        resp = await self.client.post(self.url, json=payload, headers={"Authorization": f"Bearer {self.api_token}"})
+        if resp.status_code != 200:
+            raise LLMError(f"Hugging Face API error: {resp.status_code} - {resp.text}")
+        result = resp.json()
+        if isinstance(result, list) and result and "generated_text" in result[0]:
+            return result[0]["generated_text"].strip()
+        if isinstance(result, dict) and "generated_text" in result:
+            return result["generated_text"].strip()
+        return str(result)
+
+
+@dataclass
+class LLMResult:
+    text: str
+    provider: str
+    latency: float
+    hedged: bool = False
+    errors: List[str] = field(default_factory=list)
+
+
+class LLMClient:
+    """Run prompts against an ordered list of providers."""
+
+    def __init__(self, providers: List[Provider], max_concurrency: int = 8, hedge_after: Optional[float] = None):
+        self.providers = providers
+        self.max_concurrency = max_concurrency
+        self.hedge_after = hedge_after
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        """Build providers from the same environment variables the server always used."""
+        providers: List[Provider] = []
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+        breaker_kwargs = {
+            "failure_threshold": int(os.getenv("LLM_BREAKER_FAILURES", "3")),
+            "reset_timeout": float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+        }
+        if os.getenv("OPENAI_API_KEY"):
+            providers.append(OpenAICompatibleProvider(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
+                model=os.getenv("OPENAI_MODEL", "llama-3.1-8b-instant"),
+                timeout=float(os.getenv("OPENAI_TIMEOUT", "20")),
+                max_connections=max_connections,
+                breaker=CircuitBreaker(**breaker_kwargs),
+            ))
+        hf_token = os.getenv("HUGGINGFACE_API_TOKEN") or os.getenv("HF_API_TOKEN")
+        if hf_token:
+            providers.append(HuggingFaceProvider(
+                api_token=hf_token,
+                model=os.getenv("HUGGINGFACE_MODEL") or "google/flan-t5-small",
+                base_url=os.getenv("HUGGINGFACE_API_BASE", "https://api-inference.huggingface.co/models"),
+                timeout=float(os.getenv("HUGGINGFACE_TIMEOUT", "30")),
+                max_connections=max_connections,
+                breaker=CircuitBreaker(**breaker_kwargs),
+            ))
+        hedge_after = os.getenv("LLM_HEDGE_AFTER_SECONDS")
+        return cls(
+            providers,
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            hedge_after=float(hedge_after) if hedge_after else None,
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.providers)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _call(self, provider: Provider, prompt: str) -> str:
+        settled = False
+        try:
+            async with self.semaphore:
+                started = time.perf_counter()
+                provider.calls += 1
+                outcome = "ok"
+                try:
+                    text = await provider.complete(prompt)
+                    if not text:
+                        raise LLMError("empty completion")
+                except asyncio.CancelledError:
+                    outcome = "cancelled"
+                    raise
+                except Exception as e:
+                    outcome = "error"
+                    provider.failures += 1
+                    provider.breaker.record_failure()
+                    settled = True
+                    logger.warning("LLM provider %s failed: %s", provider.name, e)
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - started
+                    provider.latency_total += elapsed
+                    LLM_SECONDS.observe(elapsed, provider=provider.name, outcome=outcome)
+                    record(f"llm:{provider.name}", elapsed)
+                provider.breaker.record_success()
+                settled = True
+                return text
+        finally:
+            if not settled:
+                # Cancelled, possibly while still waiting for the semaphore:
+                # hand back a half-open probe ``allow`` gave this call.
+                provider.breaker.release()
+
+    async def generate(self, prompt: str) -> LLMResult:
+        """Return the first successful completion, or raise ``LLMError``."""
+        if not self.providers:
+            raise LLMError("No LLM configured")
+
+        candidates = list(self.providers)
+        errors: List[str] = []
+        pending = {}
+        launched = []
+        started = time.perf_counter()
+
+        def launch() -> bool:
+            # Breakers are consulted lazily so a half-open probe is only
+            # claimed by a provider that is actually called.
+            while candidates:
+                provider = candidates.pop(0)
+                if provider.breaker.allow():
+                    pending[asyncio.ensure_future(self._call(provider, prompt))] = provider
+                    launched.append(provider)
+                    return True
+                errors.append(f"{provider.name}: circuit open")
+            return False
+
+        if not launch():
+            raise LLMError("All LLM providers are unavailable (circuit open)")
+        hedged = False
+        try:
+            while pending:
+                # Without hedging, only move on once the current provider has failed.
+                timeout = self.hedge_after if (self.hedge_after is not None and candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if launch():
+                        self.hedges_fired += 1
+                        hedged = True
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    if hedged and provider is not launched[0]:
+                        self.hedge_wins += 1
+                    return LLMResult(text, provider.name, time.perf_counter() - started, hedged, errors)
+                if not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise LLMError("; ".join(errors))
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "hedge_after_seconds": self.hedge_after,
+            "hedges_fired": self.hedges_fired,
+            "hedge_wins": self.hedge_wins,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
+
+    async def aclose(self) -> None:
+        for provider in self.providers:
+            await provider.aclose()
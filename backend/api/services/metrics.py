@@ -0,0 +1,254 @@
+"""Per-request timing spans, Prometheus metrics and the slow-query log.
+
+A ``RequestTimer`` is bound to the current request through a context
+variable, so any code on the request path (including LLM provider tasks,
+worker threads started with ``asyncio.to_thread`` and ``Database`` calls)
+can record a stage with ``stage("sql")`` without the timer being passed
+around. Stages may nest; each reports its own wall time. A call shared by
+several requests times itself on a timer of its own and each waiting
+request ``merge``s the result.
+
+Metrics are rendered in the Prometheus text exposition format by a small
+in-process registry, so ``/metrics`` needs no extra dependency.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+slow_query_logger = logging.getLogger("nlp_query_engine.slow_queries")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "nlq_request_seconds", "End-to-end latency of query requests.", ("endpoint", "sql_source", "engine"))
+REQUESTS = REGISTRY.counter(
+    "nlq_requests_total", "Query requests answered.", ("endpoint", "sql_source", "engine", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "nlq_stage_seconds", "Time spent in each stage of a query request.", ("endpoint", "stage"))
+LLM_SECONDS = REGISTRY.histogram(
+    "nlq_llm_request_seconds", "Latency of individual LLM provider calls.", ("provider", "outcome"))
+SLOW_QUERIES = REGISTRY.counter(
+    "nlq_slow_queries_total", "Query requests slower than the slow-query threshold.", ("endpoint",))
+
+
+class RequestTimer:
+    """Wall time per named stage of one request."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.tags: Dict[str, str] = {}  # sql, sql_source, engine: labels for metrics and the slow log
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, float]:
+        return {name: round(1000 * seconds, 3) for name, seconds in self.stages.items()}
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_timer", default=None)
+
+
+def start_request(endpoint: str) -> RequestTimer:
+    timer = RequestTimer(endpoint)
+    _current.set(timer)
+    return timer
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as ``name`` on the current request, if any."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(name):
+        yield
+
+
+def tag(**values) -> None:
+    """Attach labels (``sql``, ``sql_source``, ``engine``) to the current request, if any."""
+    timer = _current.get()
+    if timer is not None:
+        timer.tags.update(values)
+
+
+def record(name: str, seconds: float) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+def merge(stages: Dict[str, float]) -> None:
+    """Add stages timed on another timer (e.g. a shared call) to the current request."""
+    timer = _current.get()
+    if timer is not None:
+        for name, seconds in stages.items():
+            timer.add(name, seconds)
+
+
+def observe_request(timer: RequestTimer, sql_source: str, engine: str, status: str) -> float:
+    """Publish a finished request's stages and total; return the total in seconds."""
+    total = timer.elapsed
+    REQUEST_SECONDS.observe(total, endpoint=timer.endpoint, sql_source=sql_source, engine=engine)
+    REQUESTS.inc(endpoint=timer.endpoint, sql_source=sql_source, engine=engine, status=status)
+    for name, seconds in timer.stages.items():
+        STAGE_SECONDS.observe(seconds, endpoint=timer.endpoint, stage=name)
+    return total
+
+
+class SlowQueryLog:
+    """Log requests slower than ``threshold`` seconds with their SQL and stage breakdown."""
+
+    def __init__(self, enabled: bool = True, threshold: float = 5.0, keep: int = 50):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.recent = deque(maxlen=keep)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SlowQueryLog":
+        section = config.get("performance", {})
+        return cls(
+            enabled=section.get("log_slow_queries", True),
+            threshold=float(section.get("slow_query_threshold", 5.0)),
+        )
+
+    def check(self, timer: RequestTimer, total: float, question: str, sql: Optional[str], **extra) -> bool:
+        if not self.enabled or total < self.threshold:
+            return False
+        entry = {
+            "endpoint": timer.endpoint,
+            "seconds": round(total, 4),
+            "question": question,
+            "sql": sql,
+            "stages_ms": timer.to_dict(),
+            "at": time.time(),
+            **extra,
+        }
+        self.recent.append(entry)
+        SLOW_QUERIES.inc(endpoint=timer.endpoint)
+        slow_query_logger.warning("Slow query (%.3fs): %s", total, json.dumps(entry, default=str))
+        return True
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "threshold_seconds": self.threshold, "recent": list(self.recent)}
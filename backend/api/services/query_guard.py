@@ -0,0 +1,294 @@
+"""Cost guard for SQL executed on behalf of users and the LLM.
+
+Before a statement runs, ``EXPLAIN QUERY PLAN`` is inspected: plans that
+multiply full scans of large tables (cartesian products, correlated
+subqueries that rescan a large table per row) are rejected, and unbounded
+scans of large tables are rewritten with a ``LIMIT``. While it runs, a
+SQLite progress handler enforces a wall-clock deadline and an optional
+VM-step budget, an authorizer refuses anything but reads, and the number
+of rows fetched is capped.
+
+Every abort surfaces as ``QueryRejected`` with a machine-readable reason.
+"""
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+_LIMIT_RE = re.compile(r"\blimit\s+(\d+|\?)\s*(offset\s+(\d+|\?)\s*)?;?\s*$", re.IGNORECASE)
+_AGGREGATE_RE = re.compile(r"^\s*select\s+(count|sum|avg|min|max|total)\s*\(", re.IGNORECASE)
+_GROUP_BY_RE = re.compile(r"\bgroup\s+by\b", re.IGNORECASE)
+_NOT_ALIASES = {
+    "where", "join", "on", "left", "right", "inner", "outer", "cross", "natural", "full", "group",
+    "order", "limit", "using", "union", "intersect", "except", "having", "window", "as", "and", "or",
+}
+# VM instructions between progress-handler callbacks.
+PROGRESS_INTERVAL = 1000
+READ_ONLY_ACTIONS = frozenset({sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+                               sqlite3.SQLITE_RECURSIVE})
+
+
+class QueryRejected(Exception):
+    """A query was refused or aborted by the guard."""
+
+    def __init__(self, reason: str, message: str, **details):
+        super().__init__(message)
+        self.reason = reason
+        self.details = details
+
+    def to_dict(self) -> dict:
+        return {"reason": self.reason, "message": str(self), **self.details}
+
+
+def read_only_authorizer(action, arg1, arg2, database, trigger):
+    """SQLite authorizer that only allows reading: no writes, DDL, PRAGMA or ATTACH."""
+    return sqlite3.SQLITE_OK if action in READ_ONLY_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def is_authorization_error(error: Exception) -> bool:
+    return "not authorized" in str(error).lower()
+
+
+def _table_aliases(sql: str, known_tables) -> Dict[str, str]:
+    """Map ``FROM big b`` style aliases back to catalog table names (plans report aliases)."""
+    aliases = {}
+    for table in known_tables:
+        pattern = r'[`"\[]?\b' + re.escape(table) + r'\b[`"\]]?(?:\s+as)?\s+(\w+)'
+        for alias in re.findall(pattern, sql, re.IGNORECASE):
+            alias = alias.lower()
+            if alias not in _NOT_ALIASES and alias not in known_tables:
+                aliases[alias] = table
+    return aliases
+
+
+@dataclass
+class GuardConfig:
+    timeout_seconds: float = 10.0
+    stream_timeout_seconds: float = 300.0
+    max_vm_steps: Optional[int] = None
+    max_rows: int = 10000
+    large_table_rows: int = 100000
+    max_join_rows: int = 100_000_000
+
+    @classmethod
+    def from_config(cls, config: dict) -> "GuardConfig":
+        section = config.get("query_guard", {})
+        return cls(**{k: v for k, v in section.items() if k in cls.__dataclass_fields__})
+
+
+@dataclass
+class PlanReport:
+    sql: str
+    rewritten: bool = False
+    steps: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class GuardedResult:
+    columns: List[str]
+    rows: list
+    truncated: bool
+    plan: PlanReport
+    engine: str = "sqlite"  # or "columnar" when answered from in-memory arrays
+    elapsed_ms: Optional[float] = None
+
+
+class QueryGuard:
+    """Plan checks, deadlines and row caps around SQLite statements."""
+
+    def __init__(self, config: Optional[GuardConfig] = None):
+        self.config = config or GuardConfig()
+        self.rejections: Dict[str, int] = {}
+
+    def _reject(self, reason: str, message: str, **details) -> QueryRejected:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        return QueryRejected(reason, message, **details)
+
+    # -- plan inspection -------------------------------------------------
+
+    def inspect(self, conn, sql: str, params=(), row_counts: Optional[Dict[str, int]] = None,
+                cap_rows: bool = True) -> PlanReport:
+        """Reject or rewrite ``sql`` based on its query plan."""
+        row_counts = {k.lower(): v for k, v in (row_counts or {}).items()}
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except Exception:
+            # Let the real execution report syntax and binding errors.
+            return PlanReport(sql=sql)
+
+        aliases = _table_aliases(sql, row_counts)
+        nodes = {row[0]: (row[1], row[3]) for row in plan}
+        report = PlanReport(sql=sql, steps=[row[3] for row in plan])
+
+        # Group full scans by their parent node: siblings are nested loops.
+        scans_by_parent: Dict[int, List[tuple]] = {}
+        large_scans = []
+        for parent, detail in nodes.values():
+            # SEARCH steps use an index; every SCAN (even of a covering index) reads all rows.
+            match = _SCAN_RE.match(detail)
+            if not match:
+                continue
+            table = aliases.get(match.group(1).lower(), match.group(1).lower())
+            rows = row_counts.get(table, 0)
+            scans_by_parent.setdefault(parent, []).append((table, rows))
+            if rows >= self.config.large_table_rows:
+                large_scans.append(table)
+                if self._has_correlated_ancestor(nodes, parent):
+                    raise self._reject(
+                        "correlated_subquery_scan",
+                        f"Plan rescans large table '{table}' ({rows} rows) once per outer row",
+                        table=table, table_rows=rows,
+                    )
+
+        for scans in scans_by_parent.values():
+            if len(scans) < 2:
+                continue
+            estimated = 1
+            for _, rows in scans:
+                estimated *= max(rows, 1)
+            if estimated > self.config.max_join_rows:
+                raise self._reject(
+                    "cartesian_product",
+                    "Plan joins full scans of "
+                    + ", ".join(f"'{t}' ({r} rows)" for t, r in scans)
+                    + " without an index",
+                    estimated_rows=estimated, limit=self.config.max_join_rows,
+                )
+
+        single_row = _AGGREGATE_RE.match(sql) and not _GROUP_BY_RE.search(sql)
+        if cap_rows and large_scans and not _LIMIT_RE.search(sql) and not single_row:
+            report.sql = f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT {self.config.max_rows + 1}"
+            report.rewritten = True
+            report.notes.append(
+                f"Added LIMIT {self.config.max_rows} to unbounded scan of {', '.join(sorted(set(large_scans)))}"
+            )
+        return report
+
+    @staticmethod
+    def _has_correlated_ancestor(nodes, parent: int) -> bool:
+        seen = set()
+        while parent in nodes and parent not in seen:
+            seen.add(parent)
+            grandparent, detail = nodes[parent]
+            if detail.startswith("CORRELATED"):
+                return True
+            parent = grandparent
+        return False
+
+    # -- execution -------------------------------------------------------
+
+    def install_deadline(self, conn, timeout: float) -> dict:
+        """Abort the running statement once ``timeout`` seconds or the VM-step budget is spent."""
+        state = {"deadline": time.monotonic() + timeout, "steps": 0, "reason": None, "timeout": timeout}
+        max_steps = self.config.max_vm_steps
+
+        def progress():
+            state["steps"] += PROGRESS_INTERVAL
+            if time.monotonic() > state["deadline"]:
+                state["reason"] = "deadline_exceeded"
+                return 1
+            if max_steps and state["steps"] > max_steps:
+                state["reason"] = "vm_step_limit"
+                return 1
+            return 0
+
+        conn.set_progress_handler(progress, PROGRESS_INTERVAL)
+        return state
+
+    def clear_deadline(self, conn) -> None:
+        conn.set_progress_handler(None, PROGRESS_INTERVAL)
+
+    def translate_abort(self, state: dict, error: Exception) -> Exception:
+        """Turn SQLite's 'interrupted' and 'not authorized' errors into structured rejections."""
+        if is_authorization_error(error):
+            return self._reject("not_read_only", "Only read-only SELECT statements may run")
+        if state.get("reason") and "interrupt" in str(error).lower():
+            if state["reason"] == "deadline_exceeded":
+                return self._reject("deadline_exceeded",
+                                    f"Query exceeded the {state['timeout']}s execution deadline",
+                                    limit_seconds=state["timeout"])
+            return self._reject("vm_step_limit",
+                                f"Query exceeded the budget of {self.config.max_vm_steps} VM steps",
+                                limit_steps=self.config.max_vm_steps)
+        return error
+
+    def run(self, conn, sql: str, params=(), row_counts: Optional[Dict[str, int]] = None) -> GuardedResult:
+        """Inspect, execute and fetch at most ``max_rows`` rows of ``sql``."""
+        conn.set_authorizer(read_only_authorizer)
+        state: dict = {}
+        try:
+            report = self.inspect(conn, sql, params, row_counts)
+            state = self.install_deadline(conn, self.config.timeout_seconds)
+            cursor = conn.execute(report.sql, params)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            rows = cursor.fetchmany(self.config.max_rows + 1)
+        except Exception as e:
+            raise self.translate_abort(state, e) from e
+        finally:
+            self.clear_deadline(conn)
+            conn.set_authorizer(None)
+        truncated = len(rows) > self.config.max_rows
+        if truncated:
+            rows = rows[:self.config.max_rows]
+            cursor.close()
+        return GuardedResult(columns, rows, truncated, report)
+
+    def run_many(self, conn, statements, row_counts: Optional[Dict[str, int]] = None) -> list:
+        """Run ``[(sql, params), ...]`` inside one read transaction.
+
+        Every statement sees the same snapshot of the database. Each entry of
+        the returned list is a ``GuardedResult`` or the exception that
+        statement raised, so one bad statement does not fail the others.
+        """
+        outcomes = []
+        conn.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                started = time.perf_counter()
+                try:
+                    result = self.run(conn, sql, params, row_counts)
+                except Exception as e:
+                    outcomes.append(e)
+                    continue
+                result.elapsed_ms = round(1000 * (time.perf_counter() - started), 3)
+                outcomes.append(result)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+        return outcomes
+
+    def stream_session(self, row_counts: Optional[Dict[str, int]] = None) -> "StreamSession":
+        return StreamSession(self, row_counts)
+
+    def stats(self) -> dict:
+        return {
+            "timeout_seconds": self.config.timeout_seconds,
+            "max_rows": self.config.max_rows,
+            "max_vm_steps": self.config.max_vm_steps,
+            "rejections": dict(self.rejections),
+        }
+
+
+class StreamSession:
+    """Guard hooks for a streamed query: plan check and a whole-stream deadline, no row cap."""
+
+    def __init__(self, guard: QueryGuard, row_counts: Optional[Dict[str, int]]):
+        self.guard = guard
+        self.row_counts = row_counts
+        self.state: dict = {}
+
+    def prepare(self, conn, sql: str, params=()) -> str:
+        conn.set_authorizer(read_only_authorizer)
+        report = self.guard.inspect(conn, sql, params, self.row_counts, cap_rows=False)
+        self.state = self.guard.install_deadline(conn, self.guard.config.stream_timeout_seconds)
+        return report.sql
+
+    def cleanup(self, conn) -> None:
+        self.guard.clear_deadline(conn)
+        conn.set_authorizer(None)
+
+    def translate(self, error: Exception) -> Exception:
+        return self.guard.translate_abort(self.state, error)
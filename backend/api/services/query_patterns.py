@@ -0,0 +1,801 @@
+"""Compiled, schema-aware rule-based NL->SQL engine.
+
+A question is tokenized once and matched against compiled intent templates
+(count, filter, aggregate, top-N, group-by). Column mentions are resolved
+against the table's catalog entry, using column names and their word
+parts, and literal values against the catalog's value dictionary. The
+per-table lookup structures are built once per schema version, so
+translating a routine question takes microseconds and needs no LLM call.
+
+``translate`` returns ``None`` when it cannot interpret the question. Its
+``confidence`` drops as more content words go unexplained, so callers can
+send partially understood questions on to the LLM.
+
+``PatternStore`` covers paraphrases the templates miss: SQL that answered
+earlier questions is stored with its literals turned into slots, and a new
+question that is similar enough, and has the same intent, reuses that SQL
+with its own literals substituted.
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the server runs a single worker
+    fcntl = None
+
+from api.services.cache_manager import normalize_question
+from api.services.document_processor import quote_identifier
+
+MAX_NGRAM = 4
+DEFAULT_LIMIT = 100
+
+_TOKEN_RE = re.compile(r"""'([^']*)'|"([^"]*)"|(-?\d+(?:\.\d+)?)|(>=|<=|!=|<>|==|=|>|<)|([A-Za-z_][\w%]*|%)""")
+
+# Filler words that carry no meaning for matching questions to columns or patterns
+STOPWORDS = frozenset("""
+    a an the of in on at to for from with and or is are was were be been what which who whose whom
+    show me list give get find display return fetch all any every some rows row records record data
+    entries entry items item please can you i we tell there that those these their its it do does
+    has have having where whose value values table dataset info information details each per by
+    than then also only just how many much number count total
+""".split())
+
+_COUNT_RE = re.compile(r"\b(how many|count|number of)\b")
+_DISTINCT_RE = re.compile(r"\b(unique|distinct|different)\b")
+_AGGREGATES = (
+    ("AVG", re.compile(r"\b(average|avg|mean)\b")),
+    ("SUM", re.compile(r"\b(sum|total)\b")),
+    ("MAX", re.compile(r"\b(maximum|max|highest|largest|biggest|greatest)\b")),
+    ("MIN", re.compile(r"\b(minimum|min|lowest|smallest|least|cheapest)\b")),
+)
+_TOP_N_RE = re.compile(
+    r"\b(?:(top|first|highest|largest|best|most|bottom|lowest|smallest|worst|least|last)\s+(\d+)"
+    r"|(\d+)\s+(highest|largest|biggest|most|best|top|lowest|smallest|least|worst|bottom))\b"
+)
+_ASCENDING_WORDS = {"bottom", "lowest", "smallest", "worst", "least", "last"}
+_GROUP_WORDS = {"by", "per", "each", "across"}
+_NEGATIONS = {"not", "except", "excluding", "without", "besides", "!=", "<>"}
+_COMPARATORS = [
+    (re.compile(r"(>=|greater than or equal to|at least|no less than|not less than)\s*$"), ">="),
+    (re.compile(r"(<=|less than or equal to|at most|no more than|not more than)\s*$"), "<="),
+    (re.compile(r"(!=|<>|not equal to|other than)\s*$"), "!="),
+    (re.compile(r"(>|greater than|more than|higher than|larger than|bigger than|above|over|exceeds?|exceeding)\s*$"), ">"),
+    (re.compile(r"(<|less than|lower than|smaller than|below|under|fewer than)\s*$"), "<"),
+    (re.compile(r"(==|=|equal to|equals|is|of)\s*$"), "="),
+]
+# Comparison phrases whose words would otherwise read as aggregate or top-N intents.
+_COMPARISON_PHRASE_RE = re.compile(
+    r"\b(at least|at most|no less than|not less than|no more than|not more than|"
+    r"more than|less than|greater than|fewer than|higher than|lower than|larger than|smaller than)\b"
+)
+_BETWEEN_RE = re.compile(r"\bbetween\s+(-?\d+(?:\.\d+)?)\s+and\s+(-?\d+(?:\.\d+)?)")
+# "price is not greater than 50": a negation left in front of the comparator phrase flips it.
+_COMPARATOR_NEGATION_RE = re.compile(r"(\b(?:not|no|never)\b|n't\b)")
+_NEGATED_OPERATORS = {">": "<=", "<": ">=", ">=": "<", "<=": ">", "=": "!=", "!=": "="}
+
+
+@dataclass
+class Token:
+    text: str
+    lower: str
+    kind: str  # word | number | string | op
+    start: int
+    end: int
+
+
+def tokenize(question: str) -> List[Token]:
+    tokens = []
+    for m in _TOKEN_RE.finditer(question):
+        if m.group(1) is not None or m.group(2) is not None:
+            text = m.group(1) if m.group(1) is not None else m.group(2)
+            kind = "string"
+        elif m.group(3) is not None:
+            text, kind = m.group(3), "number"
+        elif m.group(4) is not None:
+            text, kind = m.group(4), "op"
+        else:
+            text, kind = m.group(5), "word"
+        tokens.append(Token(text, text.lower(), kind, m.start(), m.end()))
+    return tokens
+
+
+def _words(name: str) -> List[str]:
+    spaced = re.sub(r"([a-z])([A-Z])", r"\1 \2", name)
+    return [w for w in re.split(r"[^A-Za-z0-9]+", spaced.lower()) if w]
+
+
+def _singular(word: str) -> str:
+    """Plural-insensitive form used for column aliases and the question words matched against them."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _literal(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _token_at(tokens: List[Token], offset: int) -> int:
+    """Index of the last token ending at or before character ``offset``."""
+    return max((k for k, t in enumerate(tokens) if t.end <= offset), default=-1)
+
+
+def _number(text: str):
+    return float(text) if "." in text else int(text)
+
+
+@dataclass
+class Mention:
+    column: str
+    start: int  # token index
+    end: int    # token index (exclusive)
+    exact: bool
+
+
+@dataclass
+class PatternMatch:
+    sql: str
+    intent: str
+    confidence: float
+    columns: List[str] = field(default_factory=list)
+    filters: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {"intent": self.intent, "confidence": self.confidence,
+                "columns": self.columns, "filters": self.filters}
+
+
+class _SchemaIndex:
+    """Column aliases and value lookups for one version of a table."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.numeric = {c.name for c in schema.columns if c.is_numeric}
+        self.aliases: Dict[Tuple[str, ...], Tuple[str, bool]] = {}
+        partial: Dict[str, str] = {}
+        for col in schema.columns:
+            words = _words(col.name)
+            for alias in {tuple(words), (col.name.lower(),), tuple(_singular(w) for w in words)}:
+                if alias:
+                    self.aliases.setdefault(alias, (col.name, True))
+            for w in words:
+                if len(w) > 2 and w not in STOPWORDS:
+                    partial.setdefault(w, col.name)
+                    partial.setdefault(_singular(w), col.name)
+        for word, column in partial.items():
+            self.aliases.setdefault((word,), (column, False))
+        self.values = {}
+        for lowered, pairs in schema.value_dictionary().items():
+            key = tuple(t.lower for t in tokenize(lowered))
+            if key and not (len(key) == 1 and key[0] in STOPWORDS):
+                self.values.setdefault(key, pairs)
+
+
+_INDEXES: Dict[str, _SchemaIndex] = {}
+
+
+def schema_index(schema) -> _SchemaIndex:
+    """Return the lookup structures for ``schema``, rebuilding them when its version changes."""
+    global _INDEXES
+    key = f"{schema.name}:{schema.version}:{schema.fingerprint}"
+    index = _INDEXES.get(key)
+    if index is None:
+        index = _SchemaIndex(schema)
+        _INDEXES = {k: v for k, v in _INDEXES.items() if not k.startswith(schema.name + ":")}
+        _INDEXES[key] = index
+    return index
+
+
+def _scan(index: _SchemaIndex, tokens: List[Token]):
+    """Yield ``(kind, start, end, payload)`` for column mentions and dictionary values.
+
+    Longest n-grams win; ``kind`` is ``"value"`` with ``(column, value)`` or
+    ``"column"`` with ``(column, exact)``. Column aliases also match plural
+    question words ("regions" names ``region``).
+    """
+    i = 0
+    while i < len(tokens):
+        for n in range(min(MAX_NGRAM, len(tokens) - i), 0, -1):
+            key = tuple(t.lower for t in tokens[i:i + n])
+            singular = tuple(_singular(w) for w in key)
+            if key in index.values and not (n == 1 and key in index.aliases and index.aliases[key][1]):
+                yield "value", i, i + n, index.values[key][0]
+            elif key in index.aliases:
+                yield "column", i, i + n, index.aliases[key]
+            elif singular in index.aliases and all(t.kind == "word" for t in tokens[i:i + n]):
+                yield "column", i, i + n, index.aliases[singular]
+            else:
+                continue
+            i += n
+            break
+        else:
+            i += 1
+
+
+class RuleBasedEngine:
+    """Translate routine questions to SQL without an LLM."""
+
+    def translate(self, question: str, schema) -> Optional[PatternMatch]:
+        index = schema_index(schema)
+        tokens = tokenize(question)
+        if not tokens:
+            return None
+        text = question.lower()
+        used = [False] * len(tokens)
+        table = quote_identifier(schema.name)
+
+        # Column mentions and dictionary values, longest n-gram first.
+        mentions: List[Mention] = []
+        value_filters: Dict[Tuple[str, bool], list] = {}  # (column, negated) -> values
+        last_value = None
+        for kind, start, end, payload in _scan(index, tokens):
+            if kind == "value":
+                column, value = payload
+                negated = any(t.lower in _NEGATIONS for t in tokens[max(0, start - 2):start])
+                if last_value and last_value[0] == column and start > 0 and tokens[start - 1].lower in ("and", "or", "nor"):
+                    negated = last_value[1]  # "except setosa and virginica"
+                last_value = (column, negated)
+                values = value_filters.setdefault((column, negated), [])
+                if value not in values:
+                    values.append(value)
+            else:
+                mentions.append(Mention(payload[0], start, end, payload[1]))
+            for j in range(start, end):
+                used[j] = True
+
+        # Comparisons: "<column> <comparator> <number>" and BETWEEN.
+        comparisons: List[Tuple[str, str, object]] = []
+        for k, token in enumerate(tokens):
+            if token.kind not in ("number", "string") or used[k]:
+                continue
+            mention = next((m for m in reversed(mentions) if m.end <= k), None)
+            if mention is None:
+                continue
+            between = _BETWEEN_RE.search(text, tokens[mention.end - 1].end)
+            if between and between.start(1) == token.start:
+                comparisons.append((mention.column, "BETWEEN", (_number(between.group(1)), _number(between.group(2)))))
+                used[k] = True
+                for j in range(k + 1, len(tokens)):
+                    if tokens[j].start >= between.start(2):
+                        used[j] = True
+                        break
+                continue
+            if any(c[1] == "BETWEEN" and c[0] == mention.column for c in comparisons):
+                continue
+            gap = text[tokens[mention.end - 1].end:token.start].strip()
+            for pattern, op in _COMPARATORS:
+                found = pattern.search(gap)
+                if found or (op == "=" and not gap):
+                    if found and _COMPARATOR_NEGATION_RE.search(gap[:found.start()]):
+                        op = _NEGATED_OPERATORS[op]
+                    value = _number(token.text) if token.kind == "number" else token.text
+                    comparisons.append((mention.column, op, value))
+                    used[k] = True
+                    for j in range(mention.end, k):
+                        used[j] = True
+                    break
+
+        # Intents.
+        intent_text = _COMPARISON_PHRASE_RE.sub(lambda m: " " * len(m.group()), text)
+        top = _TOP_N_RE.search(intent_text)
+        is_count = bool(_COUNT_RE.search(intent_text))
+        aggregate = next((fn for fn, rx in _AGGREGATES if rx.search(intent_text)), None)
+        if is_count and aggregate == "SUM":
+            aggregate = None  # "count total records"
+        group_column = None
+        for m in mentions:
+            if m.start > 0 and (tokens[m.start - 1].lower in _GROUP_WORDS
+                                or (m.start > 1 and tokens[m.start - 2].lower == "for" and tokens[m.start - 1].lower == "each")):
+                group_column = m.column
+                used[m.start - 1] = True
+                break
+
+        if top:
+            after = next((m for m in mentions if m.start == _token_at(tokens, top.end()) + 1), None)
+            if after and after.column not in index.numeric:
+                group_column = after.column  # "top 3 regions by revenue"
+            elif group_column in index.numeric and not any(
+                    m.column in index.numeric and m.column != group_column for m in mentions):
+                group_column = None  # "top 5 by price" ranks rows, it does not group them
+        filter_columns = {c for c, _, _ in comparisons} | {c for c, _ in value_filters}
+        measure = next((m.column for m in mentions
+                        if m.column in index.numeric and m.column != group_column and m.column not in filter_columns), None)
+        if measure is None and (aggregate or top):
+            measure = next((m.column for m in mentions if m.column in index.numeric and m.column != group_column), None)
+
+        where = []
+        for (column, negated), values in value_filters.items():
+            q = quote_identifier(column)
+            if len(values) == 1:
+                where.append(f"{q} {'!=' if negated else '='} {_literal(values[0])}")
+            else:
+                where.append(f"{q} {'NOT IN' if negated else 'IN'} ({', '.join(_literal(v) for v in values)})")
+        for column, op, value in comparisons:
+            q = quote_identifier(column)
+            if op == "BETWEEN":
+                where.append(f"{q} BETWEEN {_literal(value[0])} AND {_literal(value[1])}")
+            else:
+                where.append(f"{q} {op} {_literal(value)}")
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+
+        group_q = quote_identifier(group_column) if group_column else None
+        sql = None
+        intent = None
+        if top:
+            n = int(top.group(2) or top.group(3))
+            direction = "ASC" if (top.group(1) or top.group(4)) in _ASCENDING_WORDS else "DESC"
+            if group_column and measure:
+                fn = aggregate or "SUM"
+                alias = quote_identifier(f"{fn.lower()}_{measure}")
+                sql = (f"SELECT {group_q}, {fn}({quote_identifier(measure)}) AS {alias} FROM {table}{where_sql} "
+                       f"GROUP BY {group_q} ORDER BY {alias} {direction} LIMIT {n}")
+            elif group_column:
+                sql = (f"SELECT {group_q}, COUNT(*) AS count FROM {table}{where_sql} "
+                       f"GROUP BY {group_q} ORDER BY count {direction} LIMIT {n}")
+            elif measure:
+                sql = f"SELECT * FROM {table}{where_sql} ORDER BY {quote_identifier(measure)} {direction} LIMIT {n}"
+            else:
+                sql = f"SELECT * FROM {table}{where_sql} LIMIT {n}"
+            intent = "top_n"
+        elif is_count:
+            distinct_col = None
+            if _DISTINCT_RE.search(text):
+                distinct_col = next((m.column for m in mentions if m.column != group_column), None)
+                if distinct_col is None:
+                    return None  # "distinct" with nothing to count distinct values of
+            target = f"COUNT(DISTINCT {quote_identifier(distinct_col)})" if distinct_col else "COUNT(*)"
+            # "how many regions" could mean rows or distinct regions; leave it to the LLM
+            counted_unclear = distinct_col is None and any(
+                m.column != group_column and m.column not in filter_columns for m in mentions)
+            if group_column:
+                sql = f"SELECT {group_q}, {target} AS count FROM {table}{where_sql} GROUP BY {group_q}"
+            else:
+                sql = f"SELECT {target} AS count FROM {table}{where_sql}"
+            intent = "count"
+        elif aggregate and measure:
+            alias = quote_identifier(f"{aggregate.lower()}_{measure}")
+            target = f"{aggregate}({quote_identifier(measure)}) AS {alias}"
+            if group_column:
+                sql = f"SELECT {group_q}, {target} FROM {table}{where_sql} GROUP BY {group_q} ORDER BY {alias} DESC"
+            else:
+                sql = f"SELECT {target} FROM {table}{where_sql}"
+            intent = "aggregate"
+        elif group_column:
+            sql = f"SELECT {group_q}, COUNT(*) AS count FROM {table}{where_sql} GROUP BY {group_q}"
+            intent = "group_by"
+        elif where:
+            sql = f"SELECT * FROM {table}{where_sql} LIMIT {DEFAULT_LIMIT}"
+            intent = "filter"
+        if sql is None:
+            return None
+
+        # Confidence: how many content words did the templates explain?
+        for k, token in enumerate(tokens):
+            if token.kind == "word" and (token.lower in STOPWORDS or _is_intent_word(token.lower)):
+                used[k] = True
+            elif token.kind == "op":
+                used[k] = True
+            elif token.kind == "number" and top and token.text == (top.group(2) or top.group(3)):
+                used[k] = True
+        unexplained = sum(1 for u in used if not u)
+        confidence = 0.95 - 0.15 * unexplained
+        if any(not m.exact for m in mentions):
+            confidence -= 0.1
+        if intent == "count" and counted_unclear:
+            confidence -= 0.3
+        if aggregate and intent not in ("aggregate", "top_n"):
+            confidence -= 0.3  # "average by region": the aggregate found no column to apply to
+        return PatternMatch(
+            sql=sql,
+            intent=intent,
+            confidence=round(max(confidence, 0.1), 2),
+            columns=sorted({m.column for m in mentions}),
+            filters=where,
+        )
+
+
+_INTENT_WORDS = frozenset(
+    "how many count number unique distinct different average avg mean sum total maximum max highest largest "
+    "biggest greatest minimum min lowest smallest least cheapest top first best most bottom worst last "
+    "greater less more fewer higher lower larger smaller bigger above below over under exceeds exceed exceeding "
+    "equal equals between not other no never at or nor except excluding without besides".split()
+)
+
+
+def _is_intent_word(word: str) -> bool:
+    return word in _INTENT_WORDS
+
+
+# -- learned patterns ----------------------------------------------------
+
+VECTOR_DIMENSIONS = 1024
+BIGRAM_WEIGHT = 0.5
+_SUFFIXES = ("ings", "ing", "ers", "er", "ed", "es", "s")
+# Words with the same meaning hash to the same term.
+_CANONICAL = {}
+for _canonical, _words_ in (
+    ("avg", "average avg mean"),
+    ("sum", "sum total"),
+    ("max", "maximum max highest largest biggest greatest"),
+    ("min", "minimum min lowest smallest least cheapest"),
+    ("top", "top first best most"),
+    ("bottom", "bottom worst last"),
+    (">", "> above over exceeds exceed exceeding greater more higher larger bigger"),
+    ("<", "< below under less fewer lower smaller"),
+    ("!=", "!= <> not except excluding without besides"),
+    ("=", "= == equal equals"),
+):
+    _CANONICAL.update(dict.fromkeys(_words_.split(), _canonical))
+_SQL_LITERAL_RE = re.compile(r"""'((?:[^']|'')*)'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|(?<![\w.])(-?\d+(?:\.\d+)?)(?![\w.])""")
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if len(word) - len(suffix) >= 4 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _hash(feature: str) -> Tuple[int, float]:
+    """Stable (across processes) bucket and sign for ``feature``."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % VECTOR_DIMENSIONS, (1.0 if h & 0x80000000 else -1.0)
+
+
+def _same_literal(a, b) -> bool:
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return str(a).strip().lower() == str(b).strip().lower()
+
+
+@dataclass
+class _Question:
+    """A question reduced to hashed features, literal slots and an intent signature."""
+    features: Dict[int, float]
+    slots: List[Tuple[str, Any]]  # (kind, value); kind is num, str or val:<column>
+    signature: str
+
+
+def analyze_question(question: str, schema) -> _Question:
+    index = schema_index(schema)
+    tokens = tokenize(question)
+    terms: List[str] = []
+    slots: List[Tuple[str, Any]] = []
+    columns = set()
+    spans = {start: (kind, end, payload) for kind, start, end, payload in _scan(index, tokens)}
+    k = 0
+    while k < len(tokens):
+        token = tokens[k]
+        if k in spans:
+            kind, end, payload = spans[k]
+            if kind == "value":
+                slot = f"val:{payload[0]}"
+                slots.append((slot, payload[1]))
+                terms.append(f"<{slot}>")
+            else:
+                if payload[1]:
+                    columns.add(payload[0])
+                terms.append(f"<col:{payload[0]}>")
+            k = end
+            continue
+        if token.kind == "number":
+            slots.append(("num", _number(token.text)))
+            terms.append("<num>")
+        elif token.kind == "string":
+            slots.append(("str", token.text))
+            terms.append("<str>")
+        elif token.lower in _CANONICAL:
+            terms.append(_CANONICAL[token.lower])
+        elif token.lower not in STOPWORDS:
+            terms.append(_stem(token.lower))
+        k += 1
+
+    features: Dict[int, float] = {}
+    grams = [(t, 1.0) for t in terms] + [
+        (f"{a} {b}", BIGRAM_WEIGHT) for a, b in zip(terms, terms[1:])
+    ]
+    for gram, weight in grams:
+        bucket, sign = _hash(gram)
+        features[bucket] = features.get(bucket, 0.0) + sign * weight
+
+    # Paraphrases may differ in wording but never in what they compute.
+    text = _COMPARISON_PHRASE_RE.sub(lambda m: " " * len(m.group()), question.lower())
+    intents = [fn for fn, rx in _AGGREGATES if rx.search(text)]
+    if _COUNT_RE.search(text):
+        intents.append("COUNT")
+    if _DISTINCT_RE.search(text):
+        intents.append("DISTINCT")
+    top = _TOP_N_RE.search(text)
+    if top:
+        intents.append("ASC" if (top.group(1) or top.group(4)) in _ASCENDING_WORDS else "DESC")
+    if any(t.lower in _NEGATIONS for t in tokens):
+        intents.append("NOT")
+    intents += {t.upper() for t in terms if t in ("top", "bottom")}
+    signature = ",".join(sorted(intents)) + "|" + ",".join(sorted(columns))
+    return _Question(features, slots, signature)
+
+
+def _templatize(sql: str, slots: List[Tuple[str, Any]]) -> Tuple[list, List[bool]]:
+    """Split ``sql`` into text segments and slot indexes where question literals appear."""
+    literals = []
+    for m in _SQL_LITERAL_RE.finditer(sql):
+        if m.group(1) is not None:
+            literals.append((m.start(), m.end(), m.group(1).replace("''", "'")))
+        elif m.group(2) is not None:
+            literals.append((m.start(), m.end(), m.group(2)))
+    bound = [False] * len(slots)
+    placements = []
+    taken = set()
+    for i, (_, value) in enumerate(slots):
+        for j, (start, end, literal) in enumerate(literals):
+            if j not in taken and _same_literal(literal, value):
+                taken.add(j)
+                bound[i] = True
+                placements.append((start, end, i))
+                break
+    template, pos = [], 0
+    for start, end, i in sorted(placements):
+        template += [sql[pos:start], i]
+        pos = end
+    template.append(sql[pos:])
+    return template, bound
+
+
+@dataclass
+class LearnedPattern:
+    question: str
+    table: str
+    fingerprint: str
+    signature: str
+    template: list
+    slots: List[Tuple[str, Any]]
+    bound: List[bool]
+    features: Dict[int, float] = field(default_factory=dict)
+    hits: int = 0
+    last_used: float = 0.0
+
+    def render(self, slots: List[Tuple[str, Any]]) -> Optional[str]:
+        """Fill the template with ``slots``; ``None`` if they do not fit this pattern."""
+        if len(slots) != len(self.slots):
+            return None
+        for (kind, value), (old_kind, old_value), bound in zip(slots, self.slots, self.bound):
+            if kind != old_kind or (not bound and not _same_literal(value, old_value)):
+                return None
+        return "".join(part if isinstance(part, str) else _literal(slots[part][1]) for part in self.template)
+
+    def to_dict(self) -> dict:
+        return {
+            "question": self.question, "table": self.table, "fingerprint": self.fingerprint,
+            "signature": self.signature, "template": self.template,
+            "slots": [list(s) for s in self.slots], "bound": self.bound,
+            "features": {str(k): v for k, v in self.features.items()},
+            "hits": self.hits, "last_used": self.last_used,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LearnedPattern":
+        data = dict(data)
+        data["slots"] = [tuple(s) for s in data["slots"]]
+        data["features"] = {int(k): v for k, v in data.get("features", {}).items()}
+        return cls(**data)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on ``path`` (created if needed) across processes."""
+    with open(path, "a") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+@dataclass
+class PatternReuse:
+    sql: str
+    similarity: float
+    question: str
+
+
+class PatternStore:
+    """Learned question->SQL patterns searched by TF-IDF cosine similarity.
+
+    Each learned question is hashed into a fixed-width term vector; a dense
+    NumPy matrix of IDF-weighted, L2-normalized rows is rebuilt lazily after
+    the store changes, so a lookup is one matrix-vector product. A hit is
+    only reused when its intent signature (aggregates, ordering, negation,
+    exact column mentions) matches and the new question's literals can be
+    substituted into the stored SQL.
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.7, max_patterns: int = 5000,
+                 learning: bool = True, save_every: int = 10):
+        self.path = path
+        self.threshold = threshold
+        self.max_patterns = max(1, int(max_patterns))
+        self.learning = learning
+        self.save_every = max(1, int(save_every))
+        # (fingerprint, normalized question) -> pattern, least recently used first.
+        self._patterns: "OrderedDict[tuple, LearnedPattern]" = OrderedDict()
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer at a time per process; the .tmp name is per process
+        self._unsaved = 0
+        self.lookups = 0
+        self.reuses = 0
+        self.learned = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PatternStore":
+        section = config.get("pattern_cache", {})
+        return cls(
+            path=config.get("cache_file"),
+            threshold=section.get("pattern_similarity_threshold", 0.7),
+            max_patterns=section.get("max_patterns", 5000),
+            learning=section.get("enable_pattern_learning", True),
+            save_every=section.get("save_every", 10),
+        )
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _rebuild(self):
+        rows = list(self._patterns.values())
+        n = len(rows)
+        raw = np.zeros((n, VECTOR_DIMENSIONS), dtype=np.float32)
+        for row, pattern in enumerate(rows):
+            raw[row, list(pattern.features)] = list(pattern.features.values())
+        df = np.count_nonzero(raw, axis=0)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        weighted = raw * idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix = (weighted / norms, idf, np.array([p.fingerprint for p in rows]), rows)
+        return self._matrix
+
+    def lookup(self, question: str, schema) -> Optional[PatternReuse]:
+        """Return re-parameterized SQL from the most similar compatible pattern."""
+        if not self._patterns:
+            return None
+        self.lookups += 1
+        parsed = analyze_question(question, schema)
+        if not parsed.features:
+            return None
+        with self._lock:
+            matrix, idf, fingerprints, patterns = self._matrix or self._rebuild()
+        q = np.zeros(VECTOR_DIMENSIONS, dtype=np.float32)
+        q[list(parsed.features)] = list(parsed.features.values())
+        q *= idf
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return None
+        scores = matrix @ (q / norm)
+        scores[fingerprints != schema.fingerprint] = -1.0
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for row in candidates[np.argsort(-scores[candidates])]:
+            pattern = patterns[row]
+            if pattern.signature != parsed.signature:
+                continue
+            sql = pattern.render(parsed.slots)
+            if sql is None:
+                continue
+            with self._lock:
+                pattern.hits += 1
+                pattern.last_used = time.time()
+                key = (pattern.fingerprint, normalize_question(pattern.question))
+                if key in self._patterns:
+                    self._patterns.move_to_end(key)
+            self.reuses += 1
+            return PatternReuse(sql, round(float(scores[row]), 4), pattern.question)
+        return None
+
+    def learn(self, question: str, schema, sql: str) -> None:
+        """Remember that ``sql`` answered ``question`` on ``schema``."""
+        if not self.learning:
+            return
+        parsed = analyze_question(question, schema)
+        if not parsed.features:
+            return
+        template, bound = _templatize(sql, parsed.slots)
+        pattern = LearnedPattern(
+            question=question, table=schema.name, fingerprint=schema.fingerprint,
+            signature=parsed.signature, template=template, slots=parsed.slots, bound=bound,
+            features=parsed.features, last_used=time.time(),
+        )
+        with self._lock:
+            key = (pattern.fingerprint, normalize_question(question))
+            self._patterns[key] = pattern
+            self._patterns.move_to_end(key)
+            while len(self._patterns) > self.max_patterns:
+                self._patterns.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+            self._unsaved += 1
+            self.learned += 1
+
+    def needs_save(self) -> bool:
+        return bool(self.path) and self._unsaved >= self.save_every
+
+    def _read(self) -> List[LearnedPattern]:
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("dimensions") != VECTOR_DIMENSIONS:
+            return []
+        return [LearnedPattern.from_dict(p) for p in data.get("patterns", [])]
+
+    def load(self) -> int:
+        """Load persisted patterns from ``path``; returns how many were loaded."""
+        patterns = self._read()[-self.max_patterns:]
+        if not patterns:
+            return 0
+        with self._lock:
+            self._patterns = OrderedDict(((p.fingerprint, normalize_question(p.question)), p) for p in patterns)
+            self._matrix = None
+            self._unsaved = 0
+        return len(patterns)
+
+    def save(self) -> None:
+        """Merge the store with ``path`` and write the result back atomically.
+
+        Every worker process saves to the same file, so the file is re-read
+        under a lock and what other workers learned is kept (and adopted
+        here); for a question known to both, the more recently used pattern
+        wins.
+        """
+        if not self.path:
+            return
+        with self._save_lock, _file_lock(f"{self.path}.lock"):
+            merged = {(p.fingerprint, normalize_question(p.question)): p for p in self._read()}
+            with self._lock:
+                for key, pattern in self._patterns.items():
+                    other = merged.get(key)
+                    if other is None or pattern.last_used >= other.last_used:
+                        if other is not None:
+                            pattern.hits = max(pattern.hits, other.hits)
+                        merged[key] = pattern
+                ordered = sorted(merged.items(), key=lambda item: item[1].last_used)[-self.max_patterns:]
+                self._patterns = OrderedDict(ordered)
+                self._matrix = None
+                self._unsaved = 0
+                payload = {"version": 1, "dimensions": VECTOR_DIMENSIONS,
+                           "patterns": [p.to_dict() for p in self._patterns.values()]}
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.path)
+
+    def stats(self) -> dict:
+        return {
+            "patterns": len(self._patterns),
+            "max_patterns": self.max_patterns,
+            "threshold": self.threshold,
+            "learning": self.learning,
+            "lookups": self.lookups,
+            "reuses": self.reuses,
+            "hit_rate": round(self.reuses / self.lookups, 4) if self.lookups else 0.0,
+            "learned": self.learned,
+            "evictions": self.evictions,
+            "unsaved": self._unsaved,
+        }
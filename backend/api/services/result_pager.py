@@ -0,0 +1,137 @@
+"""Paginated, streaming and columnar result delivery.
+
+Query endpoints accept these optional request fields:
+
+* ``page_size``: return at most this many rows plus a ``next_cursor``;
+* ``cursor``: continue from a previous page (no SQL generation is redone);
+* ``format``: ``"rows"`` (default, one object per row), ``"columnar"``
+  (``columns`` once plus row arrays) or ``"ndjson"`` (streamed lines).
+
+Cursors are opaque, HMAC-signed tokens carrying the SQL, the next offset
+and the catalog version the first page was read at, so a client cannot
+smuggle its own SQL in and a cursor taken before an upload is rejected.
+Generated SQL can be an arbitrary aggregate or ordered query, so pages are
+cut with ``LIMIT/OFFSET`` over the pinned statement rather than by key.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+
+FORMATS = ("rows", "columnar", "ndjson")
+MAX_PAGE_SIZE = 10_000
+STREAM_BATCH_ROWS = 1_000
+
+
+class CursorError(ValueError):
+    """Raised for malformed, tampered or expired cursors."""
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def dumps(payload) -> str:
+    return json.dumps(payload, separators=(",", ":"), default=_json_default)
+
+
+class CompactJSONResponse(JSONResponse):
+    """JSON response that skips ``jsonable_encoder`` and whitespace."""
+
+    def render(self, content) -> bytes:
+        return dumps(content).encode("utf-8")
+
+
+class CursorCodec:
+    """Sign and verify pagination cursors."""
+
+    def __init__(self, secret: Optional[bytes] = None):
+        self.secret = secret or os.getenv("CURSOR_SECRET", "").encode() or os.urandom(32)
+
+    def _sign(self, body: bytes) -> str:
+        return hmac.new(self.secret, body, hashlib.sha256).hexdigest()[:32]
+
+    def encode(self, sql: str, offset: int, version: int, table: Optional[str], page_size: int) -> str:
+        body = dumps({
+            "sql": sql, "offset": offset, "version": version, "table": table, "page_size": page_size
+        }).encode("utf-8")
+        token = body + b"." + self._sign(body).encode("ascii")
+        return base64.urlsafe_b64encode(token).decode("ascii")
+
+    def decode(self, token: str) -> dict:
+        try:
+            raw = base64.urlsafe_b64decode(token.encode("ascii"))
+            body, signature = raw.rsplit(b".", 1)
+        except Exception:
+            raise CursorError("Malformed cursor")
+        if not hmac.compare_digest(self._sign(body), signature.decode("ascii", errors="replace")):
+            raise CursorError("Invalid cursor signature")
+        return json.loads(body)
+
+
+@dataclass
+class ResultOptions:
+    page_size: Optional[int] = None
+    cursor: Optional[str] = None
+    format: str = "rows"
+
+    @classmethod
+    def from_request(cls, request: dict) -> "ResultOptions":
+        fmt = request.get("format") or "rows"
+        if request.get("stream"):
+            fmt = "ndjson"
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'. Expected one of {', '.join(FORMATS)}")
+        page_size = request.get("page_size")
+        if page_size is not None:
+            page_size = int(page_size)
+            if not 1 <= page_size <= MAX_PAGE_SIZE:
+                raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+        return cls(page_size=page_size, cursor=request.get("cursor"), format=fmt)
+
+
+def paginate_sql(sql: str) -> str:
+    """Wrap ``sql`` so ``LIMIT ? OFFSET ?`` applies on top of it."""
+    return f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT ? OFFSET ?"
+
+
+def rows_payload(columns, rows, fmt: str) -> dict:
+    if fmt == "columnar":
+        return {"format": "columnar", "columns": columns, "rows": [list(row) for row in rows]}
+    return {"results": [dict(zip(columns, row)) for row in rows]}
+
+
+async def ndjson_lines(header: dict, batches):
+    """Yield NDJSON: a header line with the columns, one array per row, then a summary.
+
+    A failure after the first line has been sent is reported as a final
+    ``{"error": ...}`` line, since the status code can no longer change.
+    """
+    total = 0
+    columns = []
+    try:
+        async for columns, rows in batches:
+            if header is not None:
+                yield (dumps({**header, "columns": columns}) + "\n").encode("utf-8")
+                header = None
+            if rows:
+                total += len(rows)
+                yield ("\n".join(dumps(list(row)) for row in rows) + "\n").encode("utf-8")
+    except Exception as e:
+        if header is not None:
+            yield (dumps({**header, "columns": columns}) + "\n").encode("utf-8")
+        summary = {"done": False, "error": str(e), "total_results": total}
+        if hasattr(e, "to_dict"):
+            summary["guard"] = e.to_dict()
+        yield (dumps(summary) + "\n").encode("utf-8")
+        return
+    if header is not None:
+        yield (dumps({**header, "columns": columns}) + "\n").encode("utf-8")
+    yield (dumps({"done": True, "total_results": total}) + "\n").encode("utf-8")
@@ -0,0 +1,311 @@
+"""In-process schema catalog.
+
+Table metadata (columns, declared and inferred types, row counts and
+per-column statistics) is collected once when a table is written and then
+served from memory, so request handlers never need ``PRAGMA table_info``
+or ``COUNT(*)`` on the hot path. Every write bumps the catalog version,
+which downstream caches use as part of their keys.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from api.services.document_processor import layout_of, quote_identifier
+
+TYPE_SAMPLE_ROWS = 1000
+# Text columns with at most this many distinct values get a value dictionary.
+VALUE_DICTIONARY_MAX = 1000
+
+_INT_RE = re.compile(r"^[+-]?\d+$")
+_REAL_RE = re.compile(r"^[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?$")
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def infer_type(values) -> str:
+    """Classify sampled values as integer, real, boolean, date, text or empty."""
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add("boolean")
+        elif isinstance(value, int):
+            kinds.add("integer")
+        elif isinstance(value, float):
+            kinds.add("real")
+        elif isinstance(value, bytes):
+            kinds.add("blob")
+        else:
+            text = str(value).strip()
+            if _INT_RE.match(text):
+                kinds.add("integer")
+            elif _REAL_RE.match(text):
+                kinds.add("real")
+            elif _DATE_RE.match(text):
+                kinds.add("date")
+            elif text.lower() in ("true", "false"):
+                kinds.add("boolean")
+            else:
+                kinds.add("text")
+    if not kinds:
+        return "empty"
+    if kinds <= {"integer"}:
+        return "integer"
+    if kinds <= {"integer", "real"}:
+        return "real"
+    if len(kinds) == 1:
+        return kinds.pop()
+    return "text"
+
+
+@dataclass
+class ColumnInfo:
+    name: str
+    declared_type: str
+    inferred_type: str = "text"
+    distinct_count: Optional[int] = None
+    null_count: int = 0
+    min_value: Any = None
+    max_value: Any = None
+    values: Optional[List[Any]] = None  # distinct values of low-cardinality columns
+    distinct_estimated: bool = False  # merged from an appended delta without a full scan
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.inferred_type in ("integer", "real")
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "type": self.declared_type,
+            "inferred_type": self.inferred_type,
+            "distinct_count": self.distinct_count,
+            "null_count": self.null_count,
+            "min": self.min_value,
+            "max": self.max_value,
+            "has_value_dictionary": self.values is not None,
+            "distinct_estimated": self.distinct_estimated,
+        }
+
+
+@dataclass
+class TableSchema:
+    name: str
+    columns: List[ColumnInfo] = field(default_factory=list)
+    row_count: int = 0
+    version: int = 0
+    refreshed_at: float = 0.0
+    encoded: List[str] = field(default_factory=list)  # dictionary-encoded columns
+    storage_table: Optional[str] = None  # table holding the rows when ``name`` is a view
+
+    @property
+    def storage(self) -> str:
+        return self.storage_table or self.name
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        lowered = name.lower()
+        for col in self.columns:
+            if col.name.lower() == lowered:
+                return col
+        return None
+
+    def value_dictionary(self) -> Dict[str, List[tuple]]:
+        """Map lowercased values to ``(column, value)`` pairs across dictionary columns."""
+        mapping: Dict[str, List[tuple]] = {}
+        for col in self.columns:
+            for value in col.values or ():
+                mapping.setdefault(str(value).strip().lower(), []).append((col.name, value))
+        return mapping
+
+    @property
+    def fingerprint(self) -> str:
+        """Stable hash of the table shape (name, column names and types)."""
+        shape = self.name + "|" + "|".join(f"{c.name}:{c.declared_type}" for c in self.columns)
+        return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "row_count": self.row_count,
+            "columns": [c.to_dict() for c in self.columns],
+            "version": self.version,
+            "dictionary_encoded": self.encoded,
+        }
+
+    def to_json(self) -> str:
+        """Complete snapshot, including statistics and value dictionaries, for ``from_json``."""
+        return json.dumps(asdict(self), default=str)
+
+    @classmethod
+    def from_json(cls, text: str) -> "TableSchema":
+        data = json.loads(text)
+        data["columns"] = [ColumnInfo(**col) for col in data.get("columns", [])]
+        return cls(**data)
+
+
+def analyze_table(conn, table: str) -> TableSchema:
+    """Collect columns, row count and per-column stats in one table scan."""
+    info = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+    if not info:
+        raise LookupError(f"Table '{table}' does not exist")
+    columns = [ColumnInfo(name=row[1], declared_type=row[2] or "") for row in info]
+    layout = layout_of(conn, table)
+    dictionaries = layout.dictionaries if layout else {}
+
+    aggregates = ["COUNT(*)"]
+    for col in columns:
+        q = quote_identifier(col.name)
+        aggregates += [f"COUNT(DISTINCT {q})", f"COUNT({q})", f"MIN({q})", f"MAX({q})"]
+    stats = conn.execute(f"SELECT {', '.join(aggregates)} FROM {quote_identifier(table)}").fetchone()
+
+    row_count = stats[0]
+    for i, col in enumerate(columns):
+        distinct, non_null, min_value, max_value = stats[1 + 4 * i: 5 + 4 * i]
+        col.distinct_count = distinct
+        col.null_count = row_count - non_null
+        col.min_value = min_value
+        col.max_value = max_value
+
+    sample = conn.execute(
+        f"SELECT * FROM {quote_identifier(table)} LIMIT {TYPE_SAMPLE_ROWS}"
+    ).fetchall()
+    for i, col in enumerate(columns):
+        col.inferred_type = infer_type(row[i] for row in sample)
+        if col.inferred_type in ("text", "boolean") and col.distinct_count <= VALUE_DICTIONARY_MAX:
+            q = quote_identifier(col.name)
+            if col.name in dictionaries:
+                # Scan the narrow integer codes; lookup tables may hold values no row uses.
+                distinct_sql = (
+                    f"SELECT value FROM {quote_identifier(dictionaries[col.name])} WHERE value IS NOT NULL "
+                    f"AND id IN (SELECT DISTINCT {q} FROM {quote_identifier(layout.storage)})"
+                )
+            else:
+                distinct_sql = f"SELECT DISTINCT {q} FROM {quote_identifier(table)} WHERE {q} IS NOT NULL"
+            col.values = [row[0] for row in conn.execute(distinct_sql)]
+
+    return TableSchema(
+        name=table, columns=columns, row_count=row_count, refreshed_at=time.time(),
+        encoded=list(dictionaries), storage_table=layout.storage if layout and layout.encoded else None,
+    )
+
+
+def merge_types(a: str, b: str) -> str:
+    """Combine the inferred types of two samples of the same column."""
+    if a == b or b == "empty":
+        return a
+    if a == "empty":
+        return b
+    if {a, b} <= {"integer", "real"}:
+        return "real"
+    return "text"
+
+
+def _merge_bound(a, b, pick):
+    if a is None or b is None:
+        return b if a is None else a
+    try:
+        return pick(a, b)
+    except TypeError:  # mixed storage classes; SQLite orders numbers before text
+        return pick(a, b, key=lambda v: (isinstance(v, str), str(v) if isinstance(v, str) else v))
+
+
+def merge_delta(base: TableSchema, delta: TableSchema, inserted: int, updated: int = 0,
+                replaced_non_null: Optional[Dict[str, int]] = None,
+                unique: tuple = ()) -> TableSchema:
+    """Fold the stats of appended/upserted rows (``delta``) into ``base``.
+
+    ``delta`` describes exactly the rows written: ``inserted`` new rows plus
+    ``updated`` rows that overwrote live ones, whose previous non-null counts
+    are in ``replaced_non_null``. Row and null counts stay exact. Min/max and
+    value dictionaries only grow, so after an upsert they may still include
+    overwritten values. Distinct counts are exact for ``unique`` columns and
+    dictionary columns, and otherwise an upper bound marked
+    ``distinct_estimated``.
+    """
+    replaced_non_null = replaced_non_null or {}
+    row_count = base.row_count + inserted
+    columns = []
+    for col in base.columns:
+        d = delta.column(col.name)
+        merged = ColumnInfo(name=col.name, declared_type=col.declared_type, inferred_type=col.inferred_type,
+                            distinct_count=col.distinct_count, null_count=col.null_count,
+                            min_value=col.min_value, max_value=col.max_value,
+                            values=col.values, distinct_estimated=col.distinct_estimated)
+        if d is None:
+            # Absent from the delta: inserted rows are NULL, updated rows keep their value.
+            merged.null_count += inserted
+        else:
+            replaced_nulls = updated - replaced_non_null.get(col.name, updated)
+            merged.null_count += d.null_count - replaced_nulls
+            if not d.distinct_count:
+                columns.append(merged)
+                continue  # only NULLs (or no rows) in the delta
+            merged.inferred_type = merge_types(col.inferred_type, d.inferred_type)
+            merged.min_value = _merge_bound(col.min_value, d.min_value, min)
+            merged.max_value = _merge_bound(col.max_value, d.max_value, max)
+            if col.values is not None and d.values is not None:
+                known = set(col.values)
+                merged.values = col.values + [v for v in d.values if v not in known]
+            else:
+                merged.values = None
+            if merged.values is not None and len(merged.values) > VALUE_DICTIONARY_MAX:
+                merged.values = None
+            if col.name in unique:
+                merged.distinct_count = row_count - merged.null_count
+                merged.distinct_estimated = False
+            elif merged.values is not None:
+                merged.distinct_count = len(merged.values)
+            elif d.distinct_count:
+                merged.distinct_count = min((col.distinct_count or 0) + d.distinct_count,
+                                            row_count - merged.null_count)
+                merged.distinct_estimated = True
+        columns.append(merged)
+    return TableSchema(name=base.name, columns=columns, row_count=row_count, refreshed_at=time.time(),
+                       encoded=list(base.encoded), storage_table=base.storage_table)
+
+
+class SchemaCatalog:
+    """Thread-safe, versioned map of table name to ``TableSchema``."""
+
+    def __init__(self):
+        self._tables: Dict[str, TableSchema] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, table: str) -> Optional[TableSchema]:
+        return self._tables.get(table)
+
+    def put(self, schema: TableSchema) -> TableSchema:
+        """Store ``schema`` and bump the catalog version."""
+        with self._lock:
+            self._version += 1
+            schema.version = self._version
+            self._tables[schema.name] = schema
+        return schema
+
+    def refresh(self, conn, table: str) -> TableSchema:
+        """Re-analyze ``table`` after a write and publish the new entry."""
+        return self.put(analyze_table(conn, table))
+
+    def drop(self, table: str) -> None:
+        with self._lock:
+            if self._tables.pop(table, None) is not None:
+                self._version += 1
+
+    def tables(self) -> List[TableSchema]:
+        return list(self._tables.values())
+
+    def stats(self) -> dict:
+        return {"version": self._version, "tables": len(self._tables)}
@@ -0,0 +1,204 @@
+"""Schema linking: choose the columns an LLM prompt needs for a question.
+
+Wide tables make every prompt long, slow and less accurate. Columns are
+scored lexically against the question:
+
+* words of the column name that appear in the question (exact, stemmed,
+  or close misspellings via difflib), weighted by how much of the name
+  they cover;
+* question phrases found in a column's value dictionary ("mumbai" links
+  ``city``), when ``enable_context_matching`` is on;
+* name words and values shared by many columns (``metric_1`` ..
+  ``metric_90``) count for less, by ``1 / sqrt(columns sharing them)``;
+* numbers that fall inside a numeric column's range, and date words for
+  date columns, as weak hints.
+
+Only the ``max_relevant_elements`` best columns scoring at least
+``similarity_threshold`` are sent, each with a compact type and example
+hint. Tables that already fit are sent whole.
+"""
+import difflib
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from api.services.query_patterns import MAX_NGRAM, STOPWORDS, schema_index, tokenize
+
+# Below this many relevant columns the best-scoring others are added back.
+MIN_COLUMNS = 5
+EXAMPLE_VALUES = 3
+_DATE_WORDS = {"date", "day", "days", "month", "months", "year", "years", "when", "recent", "latest",
+               "earliest", "week", "weeks", "since", "before", "after", "quarter"}
+_TOKEN_ESTIMATE_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE-style token count: one per punctuation mark or four word characters."""
+    return len(_TOKEN_ESTIMATE_RE.findall(text))
+
+
+def _name_words(name: str) -> List[str]:
+    spaced = re.sub(r"([a-z])([A-Z])", r"\1 \2", name)
+    return [w for w in re.split(r"[^A-Za-z0-9]+", spaced.lower()) if w]
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ies", "es", "s", "ing", "ed"):
+        if len(word) - len(suffix) >= 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def prompt_name(name: str) -> str:
+    """Column name as the prompt shows it: backticks around names with special characters."""
+    return f"`{name}`" if re.search(r"[^A-Za-z0-9_]", name) else name
+
+
+def column_hint(col) -> str:
+    """``name type`` plus a range or a few example values."""
+    hint = f"{prompt_name(col.name)} {col.inferred_type}"
+    if col.values:
+        examples = ", ".join(repr(str(v))[:40] for v in col.values[:EXAMPLE_VALUES])
+        more = len(col.values) - EXAMPLE_VALUES
+        hint += f" e.g. {examples}" + (f" (+{more} more)" if more > 0 else "")
+    elif col.min_value is not None and col.max_value is not None and col.inferred_type != "text":
+        hint += f" {col.min_value}..{col.max_value}"
+    return hint
+
+
+@dataclass
+class LinkedSchema:
+    columns: list  # ColumnInfo, in table order
+    total_columns: int
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def pruned(self) -> bool:
+        return len(self.columns) < self.total_columns
+
+    def column_block(self) -> str:
+        return "\n".join(f"- {column_hint(col)}" for col in self.columns)
+
+
+class SchemaLinker:
+    def __init__(self, max_columns: int = 20, threshold: float = 0.3, context_matching: bool = True):
+        self.max_columns = max(1, int(max_columns))
+        self.threshold = threshold
+        self.context_matching = context_matching
+        self.linked = 0
+        self.pruned = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._vocabulary: Tuple[Optional[str], Dict[str, List[str]]] = (None, {})
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SchemaLinker":
+        section = config.get("schema_mapping", {})
+        return cls(
+            max_columns=section.get("max_relevant_elements", 20),
+            threshold=section.get("similarity_threshold", 0.3),
+            context_matching=section.get("enable_context_matching", True),
+        )
+
+    def _words_by_column(self, schema) -> Dict[str, List[str]]:
+        key = f"{schema.name}:{schema.version}:{schema.fingerprint}"
+        if self._vocabulary[0] != key:
+            vocabulary = {}
+            for col in schema.columns:
+                words = _name_words(col.name)
+                # "customer_id" is about customers; a bare "id" column keeps its word
+                vocabulary[col.name] = [w for w in words if w != "id"] or words
+            self._vocabulary = (key, vocabulary)
+        return self._vocabulary[1]
+
+    def score(self, question: str, schema) -> Dict[str, float]:
+        tokens = tokenize(question)
+        words = [t.lower for t in tokens if t.kind in ("word", "number") and t.lower not in STOPWORDS]
+        # Whole words are strong evidence; the parts of "metric_12" weaker
+        strength = {}
+        for word in words:
+            for part in _name_words(word):
+                strength.setdefault(_stem(part), 1.0 if part == word else 0.5)
+        mentioned = {name.lower() for name in schema.column_names
+                     if re.search(rf"(?<!\w){re.escape(name.lower())}(?!\w)", question.lower())}
+        numbers = [float(t.text) for t in tokens if t.kind == "number"]
+        columns = self._words_by_column(schema)
+
+        sharing = Counter(w for names in columns.values() for w in set(names))
+        vocabulary = set(sharing)
+        close: Dict[str, float] = {}
+        for word in words:
+            if len(word) < 4:
+                continue
+            for match in difflib.get_close_matches(word, vocabulary, n=3, cutoff=0.8):
+                ratio = difflib.SequenceMatcher(None, word, match).ratio()
+                close[match] = max(close.get(match, 0.0), 0.8 * ratio)
+
+        scores: Dict[str, float] = {}
+        date_question = bool(_DATE_WORDS & set(words))
+        for col in schema.columns:
+            names = columns[col.name]
+            score = 0.0
+            if names:
+                weights = [1 / math.sqrt(sharing[w]) for w in names]
+                matched = sum(weight * max(strength.get(_stem(w), 0.0), close.get(w, 0.0))
+                              for w, weight in zip(names, weights))
+                score = matched / sum(weights)
+                if col.name.lower() in mentioned:
+                    score += 0.5
+            # A numeric column may still hold a stray text bound; only compare numbers
+            if (col.is_numeric and isinstance(col.min_value, (int, float))
+                    and isinstance(col.max_value, (int, float))
+                    and any(col.min_value <= n <= col.max_value for n in numbers)):
+                score += 0.15
+            if date_question and col.inferred_type == "date":
+                score += 0.3
+            if score:
+                scores[col.name] = score
+
+        if self.context_matching:
+            values = schema_index(schema).values
+            lowered = [t.lower for t in tokens]
+            for i in range(len(lowered)):
+                for n in range(1, min(MAX_NGRAM, len(lowered) - i) + 1):
+                    pairs = values.get(tuple(lowered[i:i + n]), ())
+                    for column, _ in pairs:
+                        scores[column] = scores.get(column, 0.0) + 1 / math.sqrt(len(pairs))
+        return scores
+
+    def link_all(self, schema) -> LinkedSchema:
+        return LinkedSchema(list(schema.columns), len(schema.columns))
+
+    def link(self, question: str, schema) -> LinkedSchema:
+        """The columns to describe for ``question``, in table order."""
+        self.linked += 1
+        total = len(schema.columns)
+        if total <= self.max_columns:
+            return self.link_all(schema)
+        scores = self.score(question, schema)
+        ranked = sorted(scores, key=lambda name: scores[name], reverse=True)
+        chosen = [name for name in ranked if scores[name] >= self.threshold][:self.max_columns]
+        if len(chosen) < MIN_COLUMNS:
+            rest = [name for name in ranked if name not in chosen]
+            rest += [c.name for c in schema.columns if c.name not in scores]
+            chosen += rest[:MIN_COLUMNS - len(chosen)]
+        keep = set(chosen)
+        self.pruned += 1
+        return LinkedSchema([c for c in schema.columns if c.name in keep], total,
+                            {name: round(scores[name], 3) for name in chosen if name in scores})
+
+    def record_tokens(self, before: int, after: int) -> None:
+        self.tokens_before += before
+        self.tokens_after += after
+
+    def stats(self) -> dict:
+        return {
+            "max_columns": self.max_columns,
+            "threshold": self.threshold,
+            "linked": self.linked,
+            "pruned": self.pruned,
+            "prompt_tokens_before": self.tokens_before,
+            "prompt_tokens_after": self.tokens_after,
+        }
@@ -0,0 +1,262 @@
+"""Local validation and repair of generated SQL.
+
+LLM answers are checked and, where possible, fixed here instead of being
+thrown away or sent back for another paid round trip:
+
+* markdown fences, ``SQL:`` labels and surrounding prose are stripped;
+* the text is split into statements by a splitter that skips string
+  literals, quoted identifiers and comments, so ``'a;b'`` is one statement;
+* column names that need quoting (``Discount%``, ``Product Name``) are
+  quoted where they appear bare;
+* the statement is compiled with ``EXPLAIN`` under the guard's read-only
+  authorizer, so writes, DDL, PRAGMA and ATTACH are refused by SQLite
+  itself rather than by keyword matching; ``no such column`` / ``no such
+  table`` errors are repaired by fuzzy-matching the name against the
+  schema, up to ``max_repair_attempts`` times.
+
+Anything that still does not compile is rejected with a reason, and the
+caller falls back to the rule-based engine.
+"""
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from api.services.document_processor import quote_identifier
+from api.services.query_guard import is_authorization_error, read_only_authorizer
+
+_SEGMENT_RE = re.compile(
+    r"""(?P<string>'(?:[^']|'')*'?)
+      | (?P<quoted>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+      | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+      | (?P<code>[^'"`\[\-/]+|[-/])""",
+    re.VERBOSE | re.DOTALL,
+)
+_FENCE_RE = re.compile(r"```[ \t]*(?:sql|sqlite)?[ \t]*\n?(.*?)(?:```|$)", re.IGNORECASE | re.DOTALL)
+_LABEL_RE = re.compile(r"^(?:sql|sqlite|query)\s*:\s*", re.IGNORECASE)
+_QUERY_START_RE = re.compile(r"^\s*(?:select|with)\b", re.IGNORECASE | re.MULTILINE)
+# Mid-line, "with" is usually prose; only a CTE head ("WITH t AS (") starts a query there.
+_QUERY_INLINE_RE = re.compile(
+    r"\bselect\b|\bwith\s+(?:recursive\s+)?(?:\w+|\"[^\"]*\")\s*(?:\([^)]*\)\s*)?as\s*\(",
+    re.IGNORECASE,
+)
+_STATEMENT_RE = re.compile(
+    r"^\s*(?:select|with|values|insert|replace|update|delete|create|drop|alter|pragma|attach|detach|"
+    r"vacuum|reindex|analyze|begin|commit|end|rollback|savepoint|release|explain)\b",
+    re.IGNORECASE,
+)
+# A blank line followed by a capitalized English word ("This query ...") starts an explanation.
+_TRAILING_PROSE_RE = re.compile(r"\n\s*\n\s*(?=([A-Z][a-z]+)\b)")
+_CLAUSE_WORDS = {"select", "from", "where", "group", "order", "having", "limit", "offset", "union", "join",
+                 "left", "inner", "cross", "and", "or", "on", "with", "as", "case", "when", "then", "else", "end"}
+_PLAIN_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_NO_COLUMN_RE = re.compile(r"no such column:\s*(\S+)")
+_NO_TABLE_RE = re.compile(r"no such table:\s*(?:\w+\.)?(\S+)")
+
+
+def _segments(sql: str) -> List[Tuple[str, str]]:
+    """``(kind, text)`` pieces: ``code``, ``string``, ``quoted`` or ``comment``."""
+    return [(m.lastgroup, m.group()) for m in _SEGMENT_RE.finditer(sql)]
+
+
+def _unquote(text: str) -> str:
+    inner = text[1:-1] if len(text) >= 2 else text
+    return inner.replace('""', '"') if text[0] == '"' else inner
+
+
+def strip_fences(text: str) -> str:
+    """The SQL inside a model answer: fenced block if any, without labels or leading prose."""
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = _LABEL_RE.sub("", text.strip())
+    if not _QUERY_START_RE.match(text):
+        # Prefer a line that starts the query, else the first query keyword
+        # after prose on the same line ("Here is the query: SELECT ...")
+        start = _QUERY_START_RE.search(text) or _QUERY_INLINE_RE.search(text)
+        if start:
+            text = text[start.start():]
+    for prose in _TRAILING_PROSE_RE.finditer(text):
+        if prose.group(1).lower() not in _CLAUSE_WORDS:
+            text = text[:prose.start()]
+            break
+    return text.strip()
+
+
+def split_statements(sql: str) -> List[str]:
+    """Split on semicolons outside strings, quoted identifiers and comments."""
+    statements, current = [], []
+    for kind, text in _segments(sql):
+        if kind != "code":
+            current.append(text)
+            continue
+        parts = text.split(";")
+        current.append(parts[0])
+        for part in parts[1:]:
+            statements.append("".join(current))
+            current = [part]
+    statements.append("".join(current))
+    return [s.strip() for s in statements if "".join(t for k, t in _segments(s) if k != "comment").strip()]
+
+
+def _rewrite_code(sql: str, pattern: re.Pattern, replacement: str) -> str:
+    return "".join(pattern.sub(replacement.replace("\\", "\\\\"), text) if kind == "code" else text
+                   for kind, text in _segments(sql))
+
+
+def quote_special_columns(sql: str, columns: List[str]) -> str:
+    """Quote bare occurrences of column names that are not plain identifiers."""
+    for name in sorted((c for c in columns if not _PLAIN_IDENTIFIER_RE.match(c)), key=len, reverse=True):
+        body = r"\s+".join(re.escape(part) for part in name.split())
+        pattern = re.compile(rf"(?<![\w.]){body}(?!\w)", re.IGNORECASE)
+        sql = _rewrite_code(sql, pattern, quote_identifier(name))
+    return sql
+
+
+def replace_identifier(sql: str, old: str, new: str) -> str:
+    """Replace identifier ``old`` (bare or quoted, any case) with the quoted name ``new``."""
+    pattern = re.compile(rf"(?<!\w){re.escape(old)}(?!\w)", re.IGNORECASE)
+    out = []
+    for kind, text in _segments(sql):
+        if kind == "code":
+            text = pattern.sub(quote_identifier(new).replace("\\", "\\\\"), text)
+        elif kind == "quoted" and _unquote(text).lower() == old.lower():
+            text = quote_identifier(new)
+        out.append(text)
+    return "".join(out)
+
+
+def _normalized(name: str) -> str:
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+
+def closest(name: str, candidates: List[str], cutoff: float) -> Optional[str]:
+    """The single best fuzzy match for ``name``, or None when nothing (or a tie) qualifies."""
+    target = _normalized(name)
+    scored = []
+    for candidate in candidates:
+        other = _normalized(candidate)
+        score = difflib.SequenceMatcher(None, target, other).ratio()
+        if min(len(target), len(other)) >= 3 and (target in other or other in target):
+            score = max(score, cutoff)
+        scored.append((score, candidate))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    if not scored or scored[0][0] < cutoff or (len(scored) > 1 and scored[1][0] == scored[0][0]):
+        return None
+    return scored[0][1]
+
+
+def compile_error(conn, sql: str) -> Optional[str]:
+    """Compile ``sql`` under the read-only authorizer; return SQLite's error, if any."""
+    conn.set_authorizer(read_only_authorizer)
+    try:
+        conn.execute(f"EXPLAIN {sql}").close()
+        return None
+    except Exception as e:
+        return str(e)
+    finally:
+        conn.set_authorizer(None)
+
+
+@dataclass
+class RepairResult:
+    sql: Optional[str]
+    repairs: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class SQLRepairer:
+    """Validate generated SQL against the live schema and fix what can be fixed locally."""
+
+    def __init__(self, enabled: bool = True, max_attempts: int = 3, cutoff: float = 0.7):
+        self.enabled = enabled
+        self.max_attempts = max(0, int(max_attempts))
+        self.cutoff = cutoff
+        self.checked = 0
+        self.repaired = 0
+        self.rejected: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SQLRepairer":
+        section = config.get("sql_repair", {})
+        return cls(
+            enabled=section.get("enable_auto_repair", True),
+            max_attempts=section.get("max_repair_attempts", 3),
+            cutoff=section.get("confidence_threshold", 0.7),
+        )
+
+    def _reject(self, reason: str, message: str, repairs: List[str]) -> RepairResult:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return RepairResult(None, repairs, message)
+
+    def _fix(self, sql: str, error: str, schema) -> Optional[Tuple[str, str]]:
+        missing = _NO_COLUMN_RE.search(error)
+        if missing:
+            name = missing.group(1).rsplit(".", 1)[-1]
+            match = closest(name, schema.column_names, self.cutoff)
+            if match:
+                return replace_identifier(sql, name, match), f"column {name} -> {match}"
+            return None
+        missing = _NO_TABLE_RE.search(error)
+        if missing:
+            name = missing.group(1)
+            match = closest(name, [schema.name], self.cutoff)
+            if match:
+                return replace_identifier(sql, name, match), f"table {name} -> {match}"
+        return None
+
+    def repair(self, conn, text: str, schema) -> RepairResult:
+        """Return runnable read-only SQL for ``text``, or the reason it was rejected."""
+        self.checked += 1
+        repairs: List[str] = []
+        sql = text.strip()
+        if self.enabled:
+            stripped = strip_fences(sql)
+            if stripped != sql:
+                repairs.append("stripped markdown or prose around the SQL")
+            sql = stripped
+
+        statements = split_statements(sql)
+        if not statements:
+            return self._reject("empty", "Generated SQL was empty", repairs)
+        extra = statements[1:]
+        if any(_STATEMENT_RE.match(s) for s in extra) or (extra and not self.enabled):
+            return self._reject("multiple_statements", "Generated SQL contained multiple statements", repairs)
+        if extra:
+            repairs.append("dropped text after the first statement")
+        sql = statements[0]
+
+        if self.enabled:
+            quoted = quote_special_columns(sql, schema.column_names)
+            if quoted != sql:
+                repairs.append("quoted column names containing special characters")
+            sql = quoted
+
+        attempts = self.max_attempts if self.enabled else 0
+        for attempt in range(attempts + 1):
+            error = compile_error(conn, sql)
+            if error is None:
+                if repairs:
+                    self.repaired += 1
+                return RepairResult(sql, repairs)
+            if is_authorization_error(error):
+                return self._reject("not_read_only", "Generated SQL is not a read-only query", repairs)
+            fixed = self._fix(sql, error, schema) if attempt < attempts else None
+            if fixed is None:
+                break
+            sql, note = fixed
+            repairs.append(note)
+        return self._reject("invalid", f"Generated SQL is invalid: {error}", repairs)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_repair_attempts": self.max_attempts,
+            "checked": self.checked,
+            "repaired": self.repaired,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,234 @@
+"""Ingest-time type inference and dictionary encoding.
+
+The first chunk of an upload is profiled to choose a storage plan for each
+column:
+
+* native integers and floats stay INTEGER / REAL;
+* text that is entirely percentages (``"35%"``), currency amounts
+  (``"₹1,299"``, ``"$12.50"``) or thousands-separated numbers is parsed to
+  REAL, keeping the number as written (``"35%"`` becomes ``35.0``);
+* dates in one consistent format are normalized to ISO-8601 text, which
+  sorts and compares correctly in SQLite;
+* low-cardinality text is dictionary-encoded as small integer codes.
+
+Later chunks are converted with the same plan. A value the plan cannot
+represent raises ``TypeMismatch`` naming the column and a wider type, so
+the loader can demote that column and reload.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+SQLITE_TYPES = {
+    "integer": "INTEGER", "real": "REAL", "percent": "REAL", "currency": "REAL", "number": "REAL",
+    "date": "TEXT", "datetime": "TEXT", "text": "TEXT", "any": "ANY",
+}
+# Rows per chunk used to estimate stored bytes.
+PAYLOAD_SAMPLE_ROWS = 10_000
+# Distinct values per column used to pick a plan; conversion still checks every row.
+PLAN_SAMPLE_VALUES = 2_000
+NULL_CODE = 0
+
+_PERCENT_RE = r"^[+-]?\d[\d,]*(?:\.\d+)?\s*%$"
+_CURRENCY_TOKENS = r"(?:rs\.?|inr|usd|eur|gbp|[$€£₹¥])"
+_CURRENCY_RE = rf"(?i)^[+-]?\s*{_CURRENCY_TOKENS}\s*\d[\d,]*(?:\.\d+)?$|^[+-]?\d[\d,]*(?:\.\d+)?\s*{_CURRENCY_TOKENS}$"
+_NUMBER_RE = r"^[+-]?\d{1,3}(?:,\d{3})+(?:\.\d+)?$"
+_STRIP_RE = re.compile(rf"(?i){_CURRENCY_TOKENS}|[,%\s]")
+_DATE_FORMATS = (
+    ("%Y-%m-%d", "date"), ("%Y/%m/%d", "date"), ("%d/%m/%Y", "date"), ("%m/%d/%Y", "date"),
+    ("%d-%m-%Y", "date"), ("%d-%b-%Y", "date"), ("%d %b %Y", "date"), ("%b %d, %Y", "date"),
+    ("%Y-%m-%d %H:%M:%S", "datetime"), ("%Y-%m-%dT%H:%M:%S", "datetime"), ("%Y-%m-%d %H:%M", "datetime"),
+    ("%d/%m/%Y %H:%M", "datetime"), ("%m/%d/%Y %H:%M", "datetime"),
+)
+_ISO_FORMATS = {"date": "%Y-%m-%d", "datetime": "%Y-%m-%d %H:%M:%S"}
+_DATE_HINT_RE = r"^\d{1,4}[-/ ][\dA-Za-z]{1,3}[-/ ,]+\d{1,4}"
+
+
+class TypeMismatch(Exception):
+    """A value in a later chunk does not fit the column's planned type."""
+
+    def __init__(self, column: str, fallback: str):
+        super().__init__(f"Column '{column}' does not fit its inferred type; retrying as {fallback}")
+        self.column = column
+        self.fallback = fallback
+
+
+@dataclass
+class IngestOptions:
+    type_inference: bool = True
+    dictionary_encoding: bool = True
+    dictionary_max_values: int = 1000
+    dictionary_max_ratio: float = 0.2
+    dictionary_min_rows: int = 1000
+    strict_tables: bool = True
+
+    @classmethod
+    def from_config(cls, config: dict) -> "IngestOptions":
+        section = config.get("ingest", {})
+        return cls(**{k: v for k, v in section.items() if k in cls.__dataclass_fields__})
+
+
+@dataclass
+class ColumnPlan:
+    name: str
+    kind: str = "text"
+    date_format: Optional[str] = None
+    dictionary: Optional[Dict[str, int]] = None  # value -> code; NULL is NULL_CODE
+
+    @property
+    def sqlite_type(self) -> str:
+        return "INTEGER" if self.dictionary is not None else SQLITE_TYPES[self.kind]
+
+    def describe(self) -> str:
+        return f"{self.kind} (dictionary)" if self.dictionary is not None else self.kind
+
+
+def _text_values(series: pd.Series) -> pd.Series:
+    return series.dropna().astype(str).str.strip()
+
+
+def _all_match(values: pd.Series, pattern: str) -> bool:
+    return bool(len(values)) and bool(values.str.match(pattern).all())
+
+
+def _date_format(values: pd.Series) -> Optional[Tuple[str, str]]:
+    if not _all_match(values, _DATE_HINT_RE):
+        return None
+    for fmt, kind in _DATE_FORMATS:
+        if pd.to_datetime(values, format=fmt, errors="coerce").notna().all():
+            return fmt, kind
+    return None
+
+
+def plan_columns(chunk: pd.DataFrame, options: IngestOptions, overrides: Optional[Dict[str, str]] = None,
+                 encode: bool = True) -> List[ColumnPlan]:
+    """Choose a storage plan for every column from the first chunk."""
+    overrides = overrides or {}
+    plans = []
+    for name in chunk.columns:
+        series = chunk[name]
+        plan = ColumnPlan(name=str(name))
+        if plan.name in overrides:
+            plan.kind = overrides[plan.name]
+        elif series.isna().all():
+            plan.kind = "any"
+        elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+            plan.kind = "integer"
+        elif pd.api.types.is_float_dtype(series):
+            plan.kind = "real"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            plan.kind, plan.date_format = "datetime", None
+        else:
+            values = _text_values(series).drop_duplicates().head(PLAN_SAMPLE_VALUES)
+            if values.empty:
+                plan.kind = "any"
+            elif options.type_inference and _all_match(values, _PERCENT_RE):
+                plan.kind = "percent"
+            elif options.type_inference and _all_match(values, _CURRENCY_RE):
+                plan.kind = "currency"
+            elif options.type_inference and _all_match(values, _NUMBER_RE):
+                plan.kind = "number"
+            elif options.type_inference and (found := _date_format(values)):
+                plan.date_format, plan.kind = found
+        if plan.kind == "text" and encode and options.dictionary_encoding:
+            values = _text_values(series)
+            distinct = values.nunique()
+            if (len(chunk) >= options.dictionary_min_rows and distinct <= options.dictionary_max_values
+                    and distinct <= options.dictionary_max_ratio * max(len(values), 1)):
+                plan.dictionary = {}
+        plans.append(plan)
+    return plans
+
+
+def _numeric(series: pd.Series, plan: ColumnPlan, strip: bool) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        parsed = series
+    else:
+        text = series.dropna().astype(str)
+        if strip:
+            text = text.str.replace(_STRIP_RE, "", regex=True)
+        parsed = pd.to_numeric(text, errors="coerce").reindex(series.index)
+    if (parsed.isna() & series.notna()).any():
+        raise TypeMismatch(plan.name, "text")
+    if plan.kind == "integer":
+        finite = parsed.dropna()
+        if not (finite == np.floor(finite)).all():
+            raise TypeMismatch(plan.name, "real")
+    return parsed
+
+
+def convert_chunk(chunk: pd.DataFrame, plans: List[ColumnPlan]) -> Tuple[pd.DataFrame, Dict[str, List[tuple]]]:
+    """Apply ``plans`` to ``chunk``; also return new dictionary entries per column."""
+    out = {}
+    new_codes: Dict[str, List[tuple]] = {}
+    for plan in plans:
+        series = chunk[plan.name]
+        if plan.kind in ("integer", "real"):
+            out[plan.name] = _numeric(series, plan, strip=False)
+        elif plan.kind in ("percent", "currency", "number"):
+            out[plan.name] = _numeric(series, plan, strip=True)
+        elif plan.kind in ("date", "datetime"):
+            if pd.api.types.is_datetime64_any_dtype(series):
+                parsed = series
+            else:
+                parsed = pd.to_datetime(_text_values(series).reindex(series.index), format=plan.date_format,
+                                        errors="coerce")
+                if (parsed.isna() & series.notna()).any():
+                    raise TypeMismatch(plan.name, "text")
+            text = parsed.dt.strftime(_ISO_FORMATS[plan.kind])
+            out[plan.name] = text.astype(object).where(parsed.notna(), None)
+        elif plan.dictionary is not None:
+            values = series.dropna().astype(str).reindex(series.index)
+            added = []
+            for value in values.dropna().unique():
+                if value not in plan.dictionary:
+                    plan.dictionary[value] = len(plan.dictionary) + 1
+                    added.append((plan.dictionary[value], value))
+            if added:
+                new_codes[plan.name] = added
+            out[plan.name] = values.map(plan.dictionary).fillna(NULL_CODE).astype("int64")
+        else:
+            out[plan.name] = series
+    return pd.DataFrame(out, index=chunk.index), new_codes
+
+
+def _int_bytes(values: np.ndarray) -> np.ndarray:
+    """Bytes SQLite's record format needs for each integer (0 and 1 are free)."""
+    a = np.abs(values.astype(np.float64))
+    return np.select(
+        [(values == 0) | (values == 1), a < 2 ** 7, a < 2 ** 15, a < 2 ** 23, a < 2 ** 31, a < 2 ** 47],
+        [0, 1, 2, 3, 4, 6], 8,
+    )
+
+
+def estimate_payload(raw: pd.DataFrame, converted: pd.DataFrame,
+                     plans: List[ColumnPlan]) -> Dict[str, Tuple[int, int]]:
+    """Estimate record payload bytes per column, as TEXT versus as planned.
+
+    Measured on a sample of the chunk and scaled to its length. SQLite
+    writes integral REAL values as integers, so ``"5%"`` costs one byte as
+    ``5.0`` rather than eight.
+    """
+    sample = min(len(raw), PAYLOAD_SAMPLE_ROWS)
+    if not sample:
+        return {}
+    scale = len(raw) / sample
+    out = {}
+    for plan in plans:
+        original = raw[plan.name].iloc[:sample]
+        text_bytes = _text_values(original).str.len().sum()
+        stored = converted[plan.name].iloc[:sample]
+        if plan.dictionary is not None or plan.kind == "integer":
+            numbers = pd.to_numeric(stored, errors="coerce").dropna().to_numpy()
+            typed_bytes = _int_bytes(numbers).sum()
+        elif plan.sqlite_type == "REAL":
+            numbers = pd.to_numeric(stored, errors="coerce").dropna().to_numpy(dtype=np.float64)
+            integral = np.isfinite(numbers) & (numbers == np.floor(numbers)) & (np.abs(numbers) < 2 ** 47)
+            typed_bytes = _int_bytes(numbers[integral]).sum() + 8 * int((~integral).sum())
+        else:
+            typed_bytes = _text_values(stored).str.len().sum()
+        out[plan.name] = (int(text_bytes * scale), int(typed_bytes * scale))
+    return out
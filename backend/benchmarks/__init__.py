@@ -0,0 +1,11 @@
+"""Reproducible benchmarks for the backend.
+
+* ``benchmarks.datagen`` writes synthetic narrow or wide sales CSVs;
+* ``benchmarks.fake_llm`` serves OpenAI-compatible chat completions with a
+  configurable delay, so the LLM path can be measured without a network;
+* ``benchmarks.run`` starts the server against a scratch directory, uploads
+  the data and drives the query endpoints at a fixed concurrency, printing
+  one JSON report.
+
+Run from ``backend/``: ``python -m benchmarks.run --rows 100000 --concurrency 8``.
+"""
@@ -0,0 +1,78 @@
+"""Synthetic sales CSVs for benchmarks.
+
+The narrow shape has eight columns of mixed types: an integer key, two
+low-cardinality categories, currency and percent text, a quantity, a
+dd/mm/yyyy date and free text. The wide shape adds numeric and categorical
+columns up to ``--columns``. Output is deterministic for a given seed and
+is written in chunks, so 10M-row files need little memory.
+
+    python -m benchmarks.datagen out.csv --rows 1000000 --shape wide --columns 60
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+REGIONS = np.array(["north", "south", "east", "west", "central", "delhi", "mumbai", "pune"])
+CATEGORIES = np.array(["electronics", "fashion", "grocery", "home", "sports", "toys", "books", "beauty"])
+NOTES = np.array(["", "gift", "express delivery", "returned", "bulk order", "discount applied"])
+NARROW_COLUMNS = 8
+CHUNK_ROWS = 250_000
+
+
+def make_chunk(rng: np.random.Generator, start: int, rows: int, shape: str = "narrow",
+               columns: int = NARROW_COLUMNS) -> pd.DataFrame:
+    """Rows ``start`` .. ``start + rows`` of the synthetic table."""
+    price = rng.gamma(2.0, 2500.0, rows).round(2)
+    days = rng.integers(0, 3 * 365, rows)
+    data = {
+        "order_id": np.arange(start + 1, start + rows + 1),
+        "region": REGIONS[rng.integers(0, len(REGIONS), rows)],
+        "category": CATEGORIES[rng.integers(0, len(CATEGORIES), rows)],
+        "price": ["₹{:,.2f}".format(p) for p in price],
+        "discount": [f"{d}%" for d in rng.integers(0, 60, rows)],
+        "quantity": rng.integers(1, 20, rows),
+        "order_date": (pd.Timestamp("2022-01-01") + pd.to_timedelta(days, unit="D")).strftime("%d/%m/%Y"),
+        "note": NOTES[rng.integers(0, len(NOTES), rows)],
+    }
+    for i in range(max(0, columns - NARROW_COLUMNS) if shape == "wide" else 0):
+        if i % 3 == 2:
+            data[f"attr_{i}"] = np.char.add("level_", rng.integers(0, 12, rows).astype(str))
+        else:
+            data[f"metric_{i}"] = rng.normal(100.0, 25.0, rows).round(3)
+    return pd.DataFrame(data)
+
+
+def generate(path: str, rows: int, shape: str = "narrow", columns: int = NARROW_COLUMNS,
+             seed: int = 42) -> dict:
+    """Write ``rows`` synthetic rows to ``path``; return a summary."""
+    if shape not in ("narrow", "wide"):
+        raise ValueError("shape must be 'narrow' or 'wide'")
+    rng = np.random.default_rng(seed)
+    written = 0
+    width = 0
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        while written < rows:
+            chunk = make_chunk(rng, written, min(CHUNK_ROWS, rows - written), shape, columns)
+            chunk.to_csv(fh, index=False, header=(written == 0))
+            written += len(chunk)
+            width = len(chunk.columns)
+    return {"path": path, "rows": written, "columns": width, "shape": shape, "seed": seed,
+            "bytes": os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--shape", choices=("narrow", "wide"), default="narrow")
+    parser.add_argument("--columns", type=int, default=60, help="total columns for the wide shape")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    columns = args.columns if args.shape == "wide" else NARROW_COLUMNS
+    print(generate(args.path, args.rows, args.shape, columns, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""A local OpenAI-compatible chat-completions server for benchmarks.
+
+``POST /v1/chat/completions`` sleeps for ``latency`` seconds (plus optional
+uniform ``jitter``) and answers with a SELECT over the table and columns
+named in the server's prompt, so generated SQL always runs. ``GET /stats``
+returns the number of completions served. Point the backend at it with
+``OPENAI_API_KEY=fake OPENAI_API_BASE=http://127.0.0.1:<port>/v1``.
+
+    python -m benchmarks.fake_llm --port 8765 --latency 0.3
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TABLE_RE = re.compile(r"^Table:\s*(.+)$", re.MULTILINE)
+_COLUMN_RE = re.compile(r"^- (`[^`]+`|\S+)", re.MULTILINE)
+_QUERY_RE = re.compile(r"^Query:\s*(.+)$", re.MULTILINE)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.strip().strip("`").replace('"', '""') + '"'
+
+
+def answer(prompt: str) -> str:
+    """A deterministic SELECT for the question in ``prompt``."""
+    table = _TABLE_RE.search(prompt)
+    question = _QUERY_RE.search(prompt)
+    if not table:
+        return "SELECT 1"
+    table = _quote(table.group(1))
+    names = _COLUMN_RE.findall(prompt.split("CRITICAL RULES")[0])
+    if len(names) < 2:
+        return f"SELECT * FROM {table} LIMIT 100"
+    choice = zlib.crc32((question.group(1) if question else prompt).encode()) % 3
+    key, other = _quote(names[1]), _quote(names[-1])
+    if choice == 0:
+        return f"SELECT {key}, COUNT(*) AS n FROM {table} GROUP BY {key} ORDER BY n DESC LIMIT 100"
+    if choice == 1:
+        return f"SELECT {key}, {other} FROM {table} WHERE {key} IS NOT NULL LIMIT 100"
+    return f"SELECT * FROM {table} LIMIT 100"
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.2, jitter: float = 0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.completions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeLLMServer
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            prompt = body["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError):
+            return self._send(400, {"error": {"message": "expected a chat-completions request"}})
+        time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        with self.server._lock:
+            self.server.completions += 1
+        self._send(200, {
+            "object": "chat.completion",
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": answer(prompt)}}],
+        })
+
+    def do_GET(self):
+        self._send(200, {"completions": self.server.completions})
+
+    def _send(self, status: int, payload: dict):
+        out = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(port: int = 0, latency: float = 0.2, jitter: float = 0.0) -> FakeLLMServer:
+    """Serve on a background thread; ``port=0`` picks a free port."""
+    server = FakeLLMServer(("127.0.0.1", port), latency, jitter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random seconds")
+    args = parser.parse_args()
+    server = FakeLLMServer(("127.0.0.1", args.port), args.latency, args.jitter)
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Load driver: upload a synthetic CSV and measure the query endpoints.
+
+By default the server is started as a subprocess in a scratch directory
+(so its database and learned patterns start empty) with the fake LLM as
+its only provider. Each endpoint is driven by ``--concurrency`` workers for
+``--requests`` requests and the report is printed as JSON:
+
+* per endpoint: p50/p95/p99/mean/max latency in ms, throughput (req/s),
+  error count, and the ``sql_source`` / ``engine`` mix from the responses;
+* upload: wall time, rows/sec measured by the client and by the server,
+  and the peak RSS of the ingestion worker process that ran the job;
+* server: peak RSS (Linux ``VmHWM``) of the server process and the largest
+  of its child processes (``--workers`` workers, ingestion pools) when the
+  driver started the server.
+
+    python -m benchmarks.run --rows 1000000 --shape wide --concurrency 16 --output report.json
+    python -m benchmarks.run --url http://127.0.0.1:8000 --endpoints query,schema
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+from benchmarks import datagen, fake_llm
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("schema", "query", "ai-query")
+RULE_QUESTIONS = (
+    "count by region", "average price by category", "how many rows", "show north rows",
+    "total quantity by region", "show electronics rows", "average discount by region",
+)
+AI_QUESTIONS = (
+    "which categories sell best in {region}", "list recent {region} orders with notes",
+    "how do returns compare across regions", "what does a typical {region} basket look like",
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid: int):
+    """Peak resident set size of ``pid`` in MB, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def descendant_pids(pid: int):
+    """Every live process below ``pid``: uvicorn workers and their ingestion pools."""
+    found, pending = [], [pid]
+    while pending:
+        parent = pending.pop()
+        try:
+            tasks = os.listdir(f"/proc/{parent}/task")
+        except OSError:
+            continue
+        for tid in tasks:
+            try:
+                with open(f"/proc/{parent}/task/{tid}/children") as fh:
+                    children = [int(c) for c in fh.read().split()]
+            except OSError:
+                continue
+            found.extend(children)
+            pending.extend(children)
+    return found
+
+
+def server_memory(pid: int) -> dict:
+    """Peak RSS of the server process and of the largest of its child processes."""
+    children = [rss for rss in map(peak_rss_mb, descendant_pids(pid)) if rss is not None]
+    return {"peak_rss_mb": peak_rss_mb(pid), "children": len(children),
+            "children_peak_rss_mb": max(children, default=None)}
+
+
+def summarize(latencies, errors: Counter, wall: float, sources: Counter, engines: Counter) -> dict:
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies) + sum(errors.values()),
+        "errors": sum(errors.values()),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "sql_sources": dict(sources),
+        "engines": dict(engines),
+        "error_samples": dict(errors.most_common(5)),
+    }
+
+
+def request_for(endpoint: str, i: int):
+    """``(method, path, json_body)`` for the ``i``-th request to ``endpoint``."""
+    if endpoint == "schema":
+        return "GET", "/api/schema", None
+    if endpoint == "query":
+        return "POST", "/api/query", {"query": RULE_QUESTIONS[i % len(RULE_QUESTIONS)]}
+    template = AI_QUESTIONS[i % len(AI_QUESTIONS)]
+    region = datagen.REGIONS[(i // len(AI_QUESTIONS)) % len(datagen.REGIONS)]
+    # A run counter keeps questions distinct, so each one reaches the LLM path
+    return "POST", "/api/ai-query", {"query": template.format(region=region) + f" (run {i})"}
+
+
+async def drive(client: httpx.AsyncClient, endpoint: str, requests: int, concurrency: int) -> dict:
+    counter = itertools.count()
+    latencies, sources, engines, errors = [], Counter(), Counter(), Counter()
+
+    async def worker():
+        while (i := next(counter)) < requests:
+            method, path, body = request_for(endpoint, i)
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                payload = resp.json()
+                error = None if resp.status_code == 200 else f"HTTP {resp.status_code}"
+                error = error or (None if payload.get("success", True) else str(payload.get("error"))[:200])
+            except (httpx.HTTPError, ValueError) as e:
+                error, payload = f"{type(e).__name__}: {e}"[:200], {}
+            if error:
+                errors[error] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            metadata = payload.get("metadata") or {}
+            if endpoint != "schema":
+                sources[payload.get("source") or metadata.get("sql_source") or "rules"] += 1
+                engines[metadata.get("engine", "none")] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started, sources, engines)
+
+
+async def upload(client: httpx.AsyncClient, path: str) -> dict:
+    started = time.perf_counter()
+    with open(path, "rb") as fh:
+        resp = await client.post("/api/upload", files={"file": (os.path.basename(path), fh, "text/csv")})
+    wall = time.perf_counter() - started
+    resp.raise_for_status()
+    payload = resp.json()
+    ingestion = payload.get("ingestion", {})
+    rows = payload.get("rows_processed", 0)
+    return {
+        "rows": rows,
+        "seconds": round(wall, 3),
+        "rows_per_second": round(rows / wall, 1) if wall else 0.0,
+        "server_rows_per_second": ingestion.get("rows_per_second"),
+        # Recorded by the job itself: ingestion runs in a pool worker, not the server process
+        "worker_peak_rss_mb": ingestion.get("peak_rss_mb"),
+        "storage": ingestion.get("storage"),
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, server=None, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def benchmark(args, base_url: str, csv_path: str, server=None) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client, server)
+        report = {"upload": await upload(client, csv_path), "endpoints": {}}
+        for endpoint in args.endpoints:
+            report["endpoints"][endpoint] = await drive(client, endpoint, args.requests, args.concurrency)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--shape", choices=("narrow", "wide"), default="narrow")
+    parser.add_argument("--columns", type=int, default=60, help="total columns for the wide shape")
+    parser.add_argument("--csv", help="use this CSV instead of generating one")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        type=lambda s: [e for e in s.split(",") if e])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the started server")
+    parser.add_argument("--config", help="config JSON for the server (NLP_ENGINE_CONFIG)")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--workdir", help="scratch directory (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nlq-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "keep", "workdir")},
+    }
+    llm = server = None
+    try:
+        if args.csv:
+            csv_path = os.path.abspath(args.csv)
+        else:
+            csv_path = os.path.join(workdir, f"bench_{args.shape}.csv")
+            started = time.perf_counter()
+            report["dataset"] = datagen.generate(csv_path, args.rows, args.shape, args.columns)
+            report["dataset"]["generate_seconds"] = round(time.perf_counter() - started, 2)
+
+        base_url = args.url
+        if base_url is None:
+            llm = fake_llm.start(latency=args.llm_latency, jitter=args.llm_jitter)
+            env = dict(os.environ, OPENAI_API_KEY="fake", OPENAI_API_BASE=llm.base_url)
+            env.pop("HUGGINGFACE_API_TOKEN", None)
+            env.pop("HF_API_TOKEN", None)
+            if args.config:
+                env["NLP_ENGINE_CONFIG"] = os.path.abspath(args.config)
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "final_server:app", "--app-dir", BACKEND_DIR,
+                 "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+                 "--workers", str(args.workers)],
+                cwd=workdir, env=env,
+            )
+            base_url = f"http://127.0.0.1:{port}"
+
+        report.update(asyncio.run(benchmark(args, base_url, csv_path, server)))
+        if server is not None:
+            report["server"] = {**server_memory(server.pid), "llm_completions": llm.completions}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if llm is not None:
+            llm.shutdown()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,57 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import sqlite3
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
+import argparse
 import os
+import json
+import asyncio
+import logging
 import shutil
-import requests
+import time
 from dotenv import load_dotenv
 
+from api.routes.ingestion import router as ingestion_router
+from api.services.batch_query import BatchConfig, BatchItem, gather_limited
+from api.services.cache_manager import QueryCacheManager
+from api.services.columnar_engine import ColumnarEngine
+from api.services.database import Database
+from api.services.dataset_registry import DatasetRegistry
+from api.services.document_processor import drop_generation, drop_leftover_tables, quote_identifier, table_exists
+from api.services.type_inference import IngestOptions
+from api.services.index_advisor import IndexAdvisor
+from api.services.ingest_jobs import IngestJobManager
+from api.services.llm_client import LLMClient, LLMError
+from api.services.metrics import (
+    REGISTRY, SlowQueryLog, current_timer, merge, observe_request, stage, start_request, tag
+)
+from api.services.query_guard import GuardConfig, GuardedResult, PlanReport, QueryGuard, QueryRejected
+from api.services.query_patterns import PatternStore, RuleBasedEngine
+from api.services.result_pager import (
+    STREAM_BATCH_ROWS, CompactJSONResponse, CursorCodec, CursorError, ResultOptions,
+    ndjson_lines, paginate_sql, rows_payload
+)
+from api.services.schema_discovery import SchemaCatalog, analyze_table
+from api.services.schema_linker import SchemaLinker, estimate_tokens
+from api.services.sql_repair import SQLRepairer
+
 # Load environment variables from backend/.env if present
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+CONFIG_PATH = os.getenv("NLP_ENGINE_CONFIG", os.path.join(os.path.dirname(__file__), '..', 'config_enhanced.json'))
+
+def load_config(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+CONFIG = load_config(CONFIG_PATH)
+
+logger = logging.getLogger("nlp_query_engine")
+
 app = FastAPI()
 
 # Add CORS middleware
@@ -23,8 +64,317 @@ app.add_middleware(
 )
 
 # Global variables
-current_table_name = None
 DB_PATH = "final_database.db"
+db = Database(DB_PATH, read_pool_size=int(os.getenv("DB_READ_POOL_SIZE", "4")))
+ingest_jobs = IngestJobManager.from_config(CONFIG, DB_PATH, chunk_rows=int(os.getenv("UPLOAD_CHUNK_ROWS", "50000")),
+                                           options=IngestOptions.from_config(CONFIG))
+catalog = SchemaCatalog()
+registry = DatasetRegistry()
+query_cache = QueryCacheManager.from_config(CONFIG)
+llm_client = LLMClient.from_env()
+cursor_codec = CursorCodec()
+query_guard = QueryGuard(GuardConfig.from_config(CONFIG))
+index_advisor = IndexAdvisor.from_config(CONFIG)
+rule_engine = RuleBasedEngine()
+pattern_store = PatternStore.from_config(CONFIG)
+columnar_engine = ColumnarEngine.from_config(CONFIG)
+slow_query_log = SlowQueryLog.from_config(CONFIG)
+sql_repairer = SQLRepairer.from_config(CONFIG)
+schema_linker = SchemaLinker.from_config(CONFIG)
+batch_config = BatchConfig.from_config(CONFIG)
+RULE_MIN_CONFIDENCE = CONFIG.get("rule_engine", {}).get("min_confidence", 0.85)
+background_tasks = []
+
+# Registry version last applied to the caches, per dataset
+applied_versions = {}
+
+async def sync_datasets():
+    """Apply uploads and removals made by other worker processes to this worker's caches."""
+    for name, schema, version in await db.read(registry.changes):
+        if version <= applied_versions.get(name, -1):
+            continue  # a concurrent sync that read a newer snapshot already applied it
+        applied_versions[name] = version
+        columnar_engine.invalidate(name)
+        if schema is None:
+            catalog.drop(name)
+            index_advisor.forget_table(name)
+        else:
+            catalog.put(schema)
+
+async def resolve_dataset(name=None):
+    """The dataset a request targets: ``name`` when given, otherwise the shared default."""
+    with stage("registry"):
+        await sync_datasets()
+    if not name:
+        return registry.default
+    if name not in registry and catalog.get(name) is None and not await db.read(table_exists, name):
+        raise HTTPException(status_code=404, detail=f"Unknown dataset '{name}'")
+    return name
+
+async def ingest_finished(job):
+    """Runs in this worker when one of its ingestion jobs ends."""
+    if job["state"] == "succeeded" and job["result"]["indexes"]:
+        built = {tuple(key): name for key, name in job["result"]["indexes"]}
+        await db.read(index_advisor.rebind, job["dataset"], built)
+    await sync_datasets()
+
+# Shared with the ingestion routes
+app.state.db = db
+app.state.ingest_jobs = ingest_jobs
+app.state.index_keys = index_advisor.keys_for
+app.state.ingest_finished = ingest_finished
+app.include_router(ingestion_router)
+
+def requested_dataset(request):
+    return request.get("dataset") or request.get("table")
+
+async def get_table_schema(table):
+    """Return the catalog entry for ``table``, analyzing it once on a miss."""
+    schema = catalog.get(table)
+    if schema is None:
+        schema = catalog.put(await db.read(analyze_table, table))
+    return schema
+
+def table_row_counts():
+    counts = {schema.name: schema.row_count for schema in catalog.tables()}
+    counts.update({schema.storage: schema.row_count for schema in catalog.tables()})
+    return counts
+
+async def execute_sql(sql, params=(), table=None):
+    """Run a read query under the cost guard, serving repeats from the result cache
+    until the next write. Aggregates over ``table`` are answered by the columnar
+    engine when it supports them. Returns ``(GuardedResult, cached)``."""
+    version = registry.generation
+    cached = query_cache.get_result(sql, version, params)
+    if cached is not None:
+        return cached, True
+    result = await run_columnar(sql, table) if table and not params else None
+    if result is None:
+        started = time.perf_counter()
+        result = await db.read(query_guard.run, sql, params, table_row_counts())
+        result.elapsed_ms = round(1000 * (time.perf_counter() - started), 3)
+    query_cache.put_result(sql, version, result, len(result.rows), params)
+    return result, False
+
+async def run_columnar(sql, table):
+    """Answer ``sql`` from in-memory column arrays, or return None to use SQLite."""
+    schema = catalog.get(table)
+    if not columnar_engine.accepts(schema):
+        return None
+    statement = columnar_engine.compile(sql, schema)
+    if statement is None:
+        return None
+    notes = []
+    needed = sorted(statement.columns)
+    store = columnar_engine.view(schema, needed)
+    if store is None:
+        store = await db.read(columnar_engine.load, schema, needed)
+        if store is None:
+            return None
+        notes.append(f"Loaded {len(needed)} column(s) of '{table}' into the columnar engine "
+                     f"in {1000 * store.load_seconds:.1f} ms")
+    started = time.perf_counter()
+    answer = await asyncio.to_thread(columnar_engine.run, statement, store)
+    if answer is None:
+        return None
+    columns, rows = answer
+    max_rows = query_guard.config.max_rows
+    return GuardedResult(columns, rows[:max_rows], len(rows) > max_rows, PlanReport(sql, notes=notes),
+                         engine="columnar", elapsed_ms=round(1000 * (time.perf_counter() - started), 3))
+
+async def guarded_stream(sql):
+    session = query_guard.stream_session(table_row_counts())
+    try:
+        async for batch in db.stream(sql, batch_size=STREAM_BATCH_ROWS,
+                                     prepare=session.prepare, cleanup=session.cleanup):
+            yield batch
+    except Exception as e:
+        raise session.translate(e)
+
+async def deliver_results(sql, options, response, table, offset=0):
+    """Execute ``sql`` and attach its rows to ``response`` in the requested shape."""
+    if options.format == "ndjson":
+        return StreamingResponse(ndjson_lines(response, guarded_stream(sql)), media_type="application/x-ndjson")
+
+    try:
+        if options.page_size:
+            with stage("sql"):
+                result, cached = await execute_sql(paginate_sql(sql), (options.page_size + 1, offset))
+            rows = result.rows[:options.page_size]
+            has_more = len(result.rows) > options.page_size
+            response["has_more"] = has_more
+            response["next_cursor"] = cursor_codec.encode(
+                sql, offset + len(rows), registry.generation, table, options.page_size
+            ) if has_more else None
+        else:
+            with stage("sql"):
+                result, cached = await execute_sql(sql, table=table)
+            rows = result.rows
+        if not cached:
+            index_advisor.observe(sql, catalog.get(table))
+    except QueryRejected as e:
+        response.update({
+            "success": False,
+            "error": f"Query rejected: {str(e)}",
+            "guard": e.to_dict(),
+            "results": [],
+            "total_results": 0
+        })
+        return response
+
+    with stage("materialize"):
+        attach_rows(response, result, rows, cached, options.format)
+    tag(sql=sql, engine=result.engine)
+    if options.format == "columnar":
+        stamp_timings(response)
+        with stage("serialize"):
+            return CompactJSONResponse(response)
+    return response
+
+def attach_rows(response, result, rows, cached, fmt):
+    """Add ``rows`` of ``result`` to ``response`` in format ``fmt``, with execution metadata."""
+    response.update(rows_payload(result.columns, rows, fmt))
+    response["total_results"] = len(rows)
+    metadata = response.setdefault("metadata", {})
+    metadata["rows_found"] = len(rows)
+    metadata["result_cached"] = cached
+    metadata["truncated"] = result.truncated
+    metadata["engine"] = result.engine
+    metadata["engine_ms"] = result.elapsed_ms
+    if result.plan.notes:
+        metadata["guard_notes"] = result.plan.notes
+
+def stamp_timings(response):
+    """Record the request's elapsed time and stage breakdown in its metadata."""
+    timer = current_timer()
+    if timer is None:
+        return
+    metadata = response.setdefault("metadata", {})
+    metadata["execution_time"] = f"{timer.elapsed:.3f}s"
+    metadata["timings_ms"] = timer.to_dict()
+
+def finish_query(timer, request, response):
+    """Serialize a query response and publish its timings.
+
+    Serialization happens after the metadata is stamped, so its cost shows up
+    in ``/metrics`` and the slow-query log but not in the response itself. A
+    streamed response is published once its body has been sent.
+    """
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = publish_after_stream(timer, request, response.body_iterator)
+        return response
+    status = "ok"
+    if isinstance(response, dict):
+        status = "ok" if response.get("success") else "error"
+        stamp_timings(response)
+        with timer.span("serialize"):
+            response = JSONResponse(jsonable_encoder(response))
+    publish_timings(timer, request, status)
+    return response
+
+async def publish_after_stream(timer, request, body):
+    try:
+        with timer.span("stream"):
+            async for chunk in body:
+                yield chunk
+    finally:
+        publish_timings(timer, request, "stream")
+
+def publish_timings(timer, request, status):
+    sql_source = timer.tags.get("sql_source", "rules")
+    engine = timer.tags.get("engine", "none")
+    total = observe_request(timer, sql_source, engine, status)
+    slow_query_log.check(timer, total, request.get("query", ""), timer.tags.get("sql"),
+                         sql_source=sql_source, engine=engine)
+
+async def timed_query(endpoint, handler, request):
+    timer = start_request(endpoint)
+    try:
+        response = await handler(request)
+    except Exception:
+        observe_request(timer, timer.tags.get("sql_source", "none"), "none", "error")
+        raise
+    return finish_query(timer, request, response)
+
+async def resume_from_cursor(request, options):
+    """Serve the next page of a previously paginated query without regenerating SQL."""
+    try:
+        state = cursor_codec.decode(options.cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if state["version"] != registry.generation:
+        return {
+            "success": False,
+            "error": "Cursor expired: the data changed since the first page was read. Please re-run the query.",
+            "query": request.get("query", ""),
+            "sql_generated": state["sql"],
+            "results": [],
+            "total_results": 0
+        }
+    options.page_size = options.page_size or state["page_size"]
+    tag(sql_source="cursor")
+    response = {
+        "success": True,
+        "query": request.get("query", ""),
+        "sql_generated": state["sql"],
+        "metadata": {"database": state["table"], "sql_source": "cursor"}
+    }
+    return await deliver_results(state["sql"], options, response, state["table"], offset=state["offset"])
+
+async def rule_based_fallback(request, reason):
+    tag(sql_source="fallback")
+    with stage("fallback"):
+        return await rule_based_query(request, {"source": "rule-based", "fallback_reason": reason})
+
+async def index_maintenance_loop():
+    """Periodically build/drop automatic indexes from the recorded workload.
+
+    Every worker runs the loop to keep its index records current; only the
+    holder of the maintenance lease changes indexes.
+    """
+    while True:
+        await asyncio.sleep(index_advisor.interval_seconds)
+        try:
+            # Queries are timed on readers; the writer is held only for the DDL.
+            for candidate in await db.write(index_advisor.begin_pass, catalog):
+                before = await db.read(index_advisor.time_query, candidate.last_sql)
+                for action in await db.write(index_advisor.build, candidate, catalog):
+                    if action["action"] == "create":
+                        after = await db.read(index_advisor.time_query, candidate.last_sql)
+                        action = index_advisor.record_timing(action["name"], before, after)
+                    logger.info("Index advisor: %s %s", action["action"], action.get("index") or action.get("name"))
+        except Exception as e:
+            logger.warning("Index maintenance failed: %s", e)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await db.write(registry.install)
+    await db.write(ingest_jobs.store.install)
+    await sync_datasets()
+    for job_id in await db.write(ingest_jobs.store.fail_orphans):
+        logger.info("Marked ingestion job %s failed: its server process exited", job_id)
+    # Staging tables of jobs still running in other workers are not leftovers
+    if not await db.read(ingest_jobs.store.active):
+        for name in await db.write(drop_leftover_tables):
+            logger.info("Dropped leftover table %s from an interrupted upload", name)
+    try:
+        logger.info("Loaded %d learned query patterns", pattern_store.load())
+    except Exception as e:
+        logger.warning("Could not load learned query patterns: %s", e)
+    if index_advisor.enabled:
+        background_tasks.append(asyncio.create_task(index_maintenance_loop()))
+
+@app.on_event("shutdown")
+async def close_resources():
+    for task in background_tasks:
+        task.cancel()
+    ingest_jobs.shutdown()
+    await llm_client.aclose()
+    try:
+        pattern_store.save()
+    except Exception as e:
+        logger.warning("Could not save learned query patterns: %s", e)
+    db.close()
 
 @app.get("/")
 async def root():
@@ -32,9 +382,9 @@ async def root():
 
 @app.get("/api/connections")
 async def get_connections():
-    global current_table_name
+    table = await resolve_dataset()
     status = "connected"
-    name = f"Dynamic Database ({current_table_name})" if current_table_name else "Dynamic Database (No Data)"
+    name = f"Dynamic Database ({table})" if table else "Dynamic Database (No Data)"
     
     return {
         "connections": [
@@ -47,11 +397,63 @@ async def get_connections():
         ]
     }
 
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "database": db.stats(),
+        "schema_catalog": catalog.stats(),
+        "cache": query_cache.stats(),
+        "llm": llm_client.stats(),
+        "query_guard": query_guard.stats(),
+        "patterns": pattern_store.stats(),
+        "columnar_engine": columnar_engine.stats(),
+        "sql_repair": sql_repairer.stats(),
+        "schema_linking": schema_linker.stats(),
+        "datasets": registry.stats(),
+        "ingest_jobs": ingest_jobs.stats(),
+        "slow_queries": slow_query_log.stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/indexes")
+async def get_indexes():
+    return await db.read(index_advisor.report)
+
+@app.get("/api/datasets")
+async def list_datasets():
+    await sync_datasets()
+    return {
+        "success": True,
+        "default": registry.default,
+        "generation": registry.generation,
+        "datasets": [info.to_dict() for info in await db.read(registry.datasets)]
+    }
+
+@app.delete("/api/datasets/{name}")
+async def delete_dataset(name: str):
+    def remove(conn):
+        # Unregister first, so no worker picks the dataset while its tables go
+        generation = registry.remove(conn, name)
+        if generation is None:
+            return None
+        conn.commit()
+        conn.execute(f"DROP VIEW IF EXISTS {quote_identifier(name)}")
+        drop_generation(conn, name)
+        return generation
+
+    if await db.write(remove) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset '{name}'")
+    await sync_datasets()
+    return {"success": True, "message": f"Removed dataset {name}", "default": registry.default}
+
 @app.get("/api/schema")
-async def get_schema():
-    global current_table_name
-    
-    if not current_table_name:
+async def get_schema(dataset: str = None):
+    table = await resolve_dataset(dataset)
+
+    if not table:
         return {
             "success": True,
             "database_name": "Dynamic Database (No Data)",
@@ -62,29 +464,17 @@ async def get_schema():
         }
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get table info
-        cursor.execute(f"PRAGMA table_info({current_table_name})")
-        columns_info = cursor.fetchall()
-        
-        # Get row count
-        cursor.execute(f"SELECT COUNT(*) FROM {current_table_name}")
-        row_count = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        columns = [{"name": col[1], "type": col[2]} for col in columns_info]
+        schema = await get_table_schema(table)
         
         return {
             "success": True,
-            "database_name": f"Dynamic Database ({current_table_name})",
-            "table_name": current_table_name,
+            "database_name": f"Dynamic Database ({table})",
+            "table_name": table,
+            "schema_version": registry.generation,
             "tables": [{
-                "name": current_table_name,
-                "row_count": row_count,
-                "columns": columns
+                "name": schema.name,
+                "row_count": schema.row_count,
+                "columns": [col.to_dict() for col in schema.columns]
             }]
         }
     except Exception as e:
@@ -94,43 +484,21 @@ async def get_schema():
             "tables": []
         }
 
-@app.post("/api/upload")
-async def upload_csv_file(file: UploadFile = File(...)):
-    global current_table_name
-    
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Only CSV files are allowed")
-    
-    try:
-        # Read CSV content
-        content = await file.read()
-        df = pd.read_csv(pd.io.common.StringIO(content.decode('utf-8')))
-        
-        # Create table name from filename
-        table_name = file.filename.replace('.csv', '').replace(' ', '_').replace('-', '_').lower()
-        current_table_name = table_name
-        
-        # Save to SQLite database
-        conn = sqlite3.connect(DB_PATH)
-        df.to_sql(table_name, conn, index=False, if_exists='replace')
-        conn.close()
-        
-        return {
-            "success": True,
-            "message": f"Successfully uploaded {file.filename}",
-            "table_name": table_name,
-            "rows_processed": len(df),
-            "columns": list(df.columns)
-        }
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
-
 @app.post("/api/query")
 async def query_data(request: dict):
-    global current_table_name
+    return await timed_query("query", rule_based_query, request)
+
+async def rule_based_query(request, extra=None):
+    """Answer ``request`` with the rule-based engine; ``extra`` is merged into the response."""
+    try:
+        options = ResultOptions.from_request(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    table = await resolve_dataset(requested_dataset(request))
+    if options.cursor:
+        return await resume_from_cursor(request, options)
     
-    if not current_table_name:
+    if not table:
         return {
             "success": False,
             "error": "No CSV file uploaded. Please upload a CSV file first.",
@@ -140,126 +508,32 @@ async def query_data(request: dict):
             "total_results": 0
         }
     
-    query = request.get("query", "").lower()
+    query = request.get("query", "")
     
     # Smart query processing
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get column names
-        cursor.execute(f"PRAGMA table_info({current_table_name})")
-        columns_info = cursor.fetchall()
-        column_names = [col[1] for col in columns_info]
-        
-        # Generate SQL based on query
-        sql = None
-        
-        if "count" in query or "how many" in query:
-            if "species" in query:
-                sql = f"SELECT species, COUNT(*) as count FROM {current_table_name} GROUP BY species"
-            else:
-                sql = f"SELECT COUNT(*) as count FROM {current_table_name}"
-        
-        elif "setosa" in query:
-            sql = f"SELECT * FROM {current_table_name} WHERE species = 'setosa' LIMIT 50"
-        
-        elif "versicolor" in query:
-            sql = f"SELECT * FROM {current_table_name} WHERE species = 'versicolor' LIMIT 50"
-        
-        elif "virginica" in query:
-            sql = f"SELECT * FROM {current_table_name} WHERE species = 'virginica' LIMIT 50"
-        
-        elif "petal" in query and ">" in query:
-            if "1" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE petal_width > 1 LIMIT 50"
-            elif "2" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE petal_length > 2 LIMIT 50"
-            else:
-                sql = f"SELECT * FROM {current_table_name} WHERE petal_width > 1 LIMIT 50"
-        
-        elif "sepal" in query and ">" in query:
-            if "6" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE sepal_length > 6 LIMIT 50"
-            elif "3" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE sepal_width > 3 LIMIT 50"
-            else:
-                sql = f"SELECT * FROM {current_table_name} WHERE sepal_length > 5 LIMIT 50"
-        
-        elif "survived" in query:
-            if "= 1" in query or "= '1'" in query or "is 1" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE survived = 1 LIMIT 50"
-            elif "= 0" in query or "= '0'" in query or "is 0" in query:
-                sql = f"SELECT * FROM {current_table_name} WHERE survived = 0 LIMIT 50"
-            else:
-                sql = f"SELECT survived, COUNT(*) as count FROM {current_table_name} GROUP BY survived"
-        
-        elif "=" in query:
-            # Handle general equality queries
-            import re
-            # Look for pattern "column = value"
-            match = re.search(r'(\w+)\s*=\s*["\']?(\w+)["\']?', query)
-            if match:
-                column, value = match.groups()
-                if value.isdigit():
-                    sql = f"SELECT * FROM {current_table_name} WHERE {column} = {value} LIMIT 50"
-                else:
-                    sql = f"SELECT * FROM {current_table_name} WHERE {column} = '{value}' LIMIT 50"
-            else:
-                sql = f"SELECT * FROM {current_table_name} LIMIT 100"
-            if "petal" in query:
-                sql = f"SELECT AVG(petal_length) as avg_petal_length, AVG(petal_width) as avg_petal_width FROM {current_table_name}"
-            elif "sepal" in query:
-                sql = f"SELECT AVG(sepal_length) as avg_sepal_length, AVG(sepal_width) as avg_sepal_width FROM {current_table_name}"
-            else:
-                sql = f"SELECT AVG(petal_length) as avg_petal_length FROM {current_table_name}"
-        
-        elif "max" in query or "largest" in query:
-            if "petal" in query:
-                sql = f"SELECT MAX(petal_length) as max_petal_length, * FROM {current_table_name} WHERE petal_length = (SELECT MAX(petal_length) FROM {current_table_name})"
-            elif "sepal" in query:
-                sql = f"SELECT MAX(sepal_length) as max_sepal_length, * FROM {current_table_name} WHERE sepal_length = (SELECT MAX(sepal_length) FROM {current_table_name})"
-            else:
-                sql = f"SELECT * FROM {current_table_name} ORDER BY petal_length DESC LIMIT 10"
-        
-        elif "min" in query or "smallest" in query:
-            if "petal" in query:
-                sql = f"SELECT MIN(petal_width) as min_petal_width, * FROM {current_table_name} WHERE petal_width = (SELECT MIN(petal_width) FROM {current_table_name})"
-            else:
-                sql = f"SELECT * FROM {current_table_name} ORDER BY petal_width ASC LIMIT 10"
-        
-        else:
-            # Default: show all data
-            sql = f"SELECT * FROM {current_table_name} LIMIT 100"
+        with stage("schema"):
+            schema = await get_table_schema(table)
+        with stage("rules"):
+            sql, confidence, match = rule_sql(query, schema)
+        timer = current_timer()
+        if timer is not None:
+            timer.tags.setdefault("sql_source", "rules")
+        tag(sql=sql)
         
         # Execute query
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        
-        # Convert to list of dictionaries
-        column_names = [description[0] for description in cursor.description]
-        results = []
-        for row in rows:
-            row_dict = {}
-            for i, value in enumerate(row):
-                row_dict[column_names[i]] = value
-            results.append(row_dict)
-        
-        conn.close()
-        
-        return {
+        response = {
             "success": True,
-            "query": request.get("query", ""),
+            "query": query,
             "sql_generated": sql,
-            "confidence": 0.90,
-            "results": results,
-            "total_results": len(results),
+            "confidence": confidence,
             "metadata": {
-                "execution_time": "0.1s",
-                "database": current_table_name,
-                "rows_found": len(results)
-            }
+                "database": table,
+                "pattern": match.to_dict() if match else None
+            },
+            **(extra or {})
         }
+        return await deliver_results(sql, options, response, table)
         
     except Exception as e:
         return {
@@ -274,24 +548,116 @@ async def query_data(request: dict):
         }
 
 
+def rule_sql(query, schema):
+    """``(sql, confidence, match)`` from the rule engine; shows the data when no rule matches."""
+    match = rule_engine.translate(query, schema)
+    if match:
+        return match.sql, match.confidence, match
+    return f"SELECT * FROM {quote_identifier(schema.name)} LIMIT 100", 0.3, None
+
+
+def build_prompt(table, column_block, query_text):
+    return (
+        "You are an expert SQL generator. Convert the natural language query to a precise SQLite SELECT statement.\n"
+        f"Table: {table}\n"
+        "Columns (use EXACTLY these names; each with its type and example values or range):\n"
+        f"{column_block}\n\n"
+        "CRITICAL RULES:\n"
+        "- Return ONLY the SQL query, nothing else\n"
+        "- Use SELECT statements only\n"
+        "- Add LIMIT 100 unless user requests more\n"
+        "- Use column names EXACTLY as provided above (including backticks if shown)\n"
+        "- For comparisons, use proper SQL operators (>, <, =, >=, <=)\n"
+        "- For text searches, use LIKE with % wildcards\n\n"
+        f"Query: {query_text}\n"
+        "SQL:"
+    )
+
+
+def translate_locally(query_text, schema, cache_key):
+    """SQL for ``query_text`` without an LLM call, or None.
+
+    Returns ``(sql, sql_source, confidence, reused)``: a validated translation
+    cached for the same question and table shape, a confident rule-engine
+    match, or the SQL of a learned paraphrase.
+    """
+    with stage("translation_cache"):
+        sql = query_cache.translations.get(cache_key)
+    if sql is not None:
+        return sql, "cache", 0.9, None
+    # Routine questions the pattern engine understands skip the LLM round trip
+    with stage("rules"):
+        match = rule_engine.translate(query_text, schema)
+    if match and match.confidence >= RULE_MIN_CONFIDENCE:
+        return match.sql, "rules", match.confidence, None
+    # Paraphrases of questions the LLM already answered reuse its SQL
+    with stage("pattern"):
+        reused = pattern_store.lookup(query_text, schema)
+    if reused:
+        return reused.sql, "pattern", reused.similarity, reused
+    return None, None, 0.9, None
+
+
+def describe_for_llm(query_text, schema, table):
+    """The LLM prompt for ``query_text`` and its estimated size before and after schema linking."""
+    # Describe only the columns the question is about, with type/example hints
+    with stage("schema_linking"):
+        linked = schema_linker.link(query_text, schema)
+        prompt = build_prompt(table, linked.column_block(), query_text)
+        after = estimate_tokens(prompt)
+        before = estimate_tokens(build_prompt(table, schema_linker.link_all(schema).column_block(), query_text)) \
+            if linked.pruned else after
+        schema_linker.record_tokens(before, after)
+    return prompt, {"before": before, "after": after, "columns_sent": len(linked.columns),
+                    "columns_total": linked.total_columns}
+
+
+async def translate_with_llm(prompt):
+    """Ask the configured LLM providers for SQL. Returns ``(sql, error, timings)``.
+
+    Runs as a single-flight task shared by every request asking the same
+    question, so provider timings go on a timer of the task's own and each
+    waiting request merges ``timings`` into its stages.
+    """
+    timer = start_request("llm")
+    try:
+        result = await llm_client.generate(prompt)
+        return result.text, None, timer.stages
+    except LLMError as e:
+        return None, str(e), timer.stages
+
+
 @app.post("/api/ai-query")
 async def ai_query(request: dict):
-    """Convert natural-language query to SQL using an LLM (OpenAI) and execute it.
+    """Convert a natural-language query to SQL and execute it.
 
-    Expected request JSON: { "query": "natural language question", "table": "optional_table_name" }
-    Requires environment variable OPENAI_API_KEY to be set. If missing, returns a clear error.
+    Expected request JSON: { "query": "natural language question", "dataset": "optional_dataset_name" }
+    (``table`` is accepted as an alias of ``dataset``). The translation cache, the rule
+    engine and learned patterns answer first; otherwise the question goes to the
+    configured LLM providers (Groq, OpenAI or any OpenAI-compatible endpoint, with
+    failover). When no provider is configured or none answers, or the generated SQL
+    cannot be repaired, the rule-based engine answers instead and the response
+    carries the ``fallback_reason``.
     """
-    global current_table_name
+    return await timed_query("ai-query", answer_ai_query, request)
 
+async def answer_ai_query(request):
     query_text = request.get("query", "").strip()
-    table = request.get("table") or current_table_name
+
+    try:
+        options = ResultOptions.from_request(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    table = await resolve_dataset(requested_dataset(request))
+    if options.cursor:
+        return await resume_from_cursor(request, options)
 
     if not query_text:
         raise HTTPException(status_code=400, detail="Missing 'query' in request body")
     if not table:
         return {
             "success": False,
-            "error": "No table specified and no table uploaded. Please upload a CSV first or include a 'table' in the request." ,
+            "error": "No dataset specified and no CSV uploaded. Please upload a CSV first or include a 'dataset' in the request.",
             "query": query_text,
             "sql_generated": "",
             "results": [],
@@ -300,103 +666,24 @@ async def ai_query(request: dict):
 
     # Get table schema (columns)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(f"PRAGMA table_info({table})")
-        columns_info = cursor.fetchall()
-        column_names = [col[1] for col in columns_info]
-        conn.close()
+        with stage("schema"):
+            schema = await get_table_schema(table)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch table schema: {str(e)}")
 
-    # Build the prompt for the model
-    # Create column list with proper escaping for special characters
-    column_list = []
-    for col in column_names:
-        if '%' in col or ' ' in col or '-' in col:
-            column_list.append(f'`{col}`')  # Use backticks for special chars
-        else:
-            column_list.append(col)
-    
-    prompt = (
-        "You are an expert SQL generator. Convert the natural language query to a precise SQLite SELECT statement.\n"
-        f"Table: {table}\n"
-        f"Available columns (use EXACTLY these names): {', '.join(column_list)}\n\n"
-        "CRITICAL RULES:\n"
-        "- Return ONLY the SQL query, nothing else\n"
-        "- Use SELECT statements only\n"
-        "- Add LIMIT 100 unless user requests more\n"
-        "- Use column names EXACTLY as provided above (including backticks if shown)\n"
-        "- For discount queries, use `Discount%` (with backticks and percent sign)\n"
-        "- For comparisons, use proper SQL operators (>, <, =, >=, <=)\n"
-        "- For text searches, use LIKE with % wildcards\n\n"
-        f"Query: {query_text}\n"
-        "SQL:"
-    )
-
-    # Prefer OpenAI if key is present, otherwise try Hugging Face Inference API if token is present
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
-    HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN") or os.getenv("HF_API_TOKEN")
-
-    sql = None
+    # Reuse a validated translation for the same question and table shape, and
+    # let identical concurrent questions share one in-flight LLM call
+    cache_key = query_cache.translation_key(query_text, schema.fingerprint)
+    sql, sql_source, confidence, reused = translate_locally(query_text, schema, cache_key)
     llm_error = None
-
-    # Try OpenAI-compatible provider first (Groq/OpenAI)
-    if OPENAI_API_KEY:
-        try:
-            print(f"🚀 Calling Groq API at: {OPENAI_API_BASE}")
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-            }
-            data = {
-                "model": "llama-3.1-8b-instant",
-                "messages": [{"role": "system", "content": "You are a SQL generator."},
-                             {"role": "user", "content": prompt}],
-                "temperature": 0.0,
-                "max_tokens": 300,
-            }
-            api_url = f"{OPENAI_API_BASE}/chat/completions"
-            print(f"📡 Sending request to: {api_url}")
-            resp = requests.post(api_url, json=data, headers=headers, timeout=20)
-            print(f"📈 Response status: {resp.status_code}")
-            if resp.status_code == 200:
-                result = resp.json()
-                sql = result.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-                print(f"✅ Groq returned SQL: {sql}")
-            else:
-                llm_error = f"API error: {resp.status_code} - {resp.text}"
-                print(f"❌ Groq API error: {llm_error}")
-        except Exception as e:
-            llm_error = f"LLM request failed: {str(e)}"
-            print(f"💥 Groq exception: {llm_error}")
-
-    # If OpenAI/Groq failed or did not produce SQL, try Hugging Face if configured
-    if not sql and HUGGINGFACE_API_TOKEN:
-        try:
-            hf_headers = {"Authorization": f"Bearer {HUGGINGFACE_API_TOKEN}"}
-            model = os.getenv("HUGGINGFACE_MODEL") or "google/flan-t5-small"
-            hf_payload = {
-                "inputs": prompt,
-                "parameters": {"max_new_tokens": 256, "temperature": 0.0}
-            }
-            hf_url = f"https://api-inference.huggingface.co/models/{model}"
-            resp = requests.post(hf_url, headers=hf_headers, json=hf_payload, timeout=30)
-            if resp.status_code == 200:
-                hf_result = resp.json()
-                if isinstance(hf_result, list) and len(hf_result) > 0 and 'generated_text' in hf_result[0]:
-                    sql = hf_result[0]['generated_text'].strip()
-                elif isinstance(hf_result, dict) and 'generated_text' in hf_result:
-                    sql = hf_result['generated_text'].strip()
-                else:
-                    sql = str(hf_result)
-            else:
-                if not llm_error:
-                    llm_error = f"Hugging Face API error: {resp.status_code} - {resp.text}"
-        except Exception as e:
-            if not llm_error:
-                llm_error = f"Hugging Face request failed: {str(e)}"
+    prompt_tokens = None
+    if sql is None:
+        prompt, prompt_tokens = describe_for_llm(query_text, schema, table)
+        with stage("llm"):
+            sql, llm_error, llm_timings = await query_cache.flights.do(cache_key, lambda: translate_with_llm(prompt))
+        merge(llm_timings)
+        sql_source = "llm"
+    tag(sql=sql, sql_source=sql_source)
 
     # If no LLM produced a SQL string, fallback to rule-based engine
     if not sql:
@@ -404,64 +691,242 @@ async def ai_query(request: dict):
         fallback_reason = llm_error or "No LLM configured"
         # Call the rule-based query_data endpoint to get deterministic results
         try:
-            rb_response = await query_data({"query": query_text})
             # Ensure caller sees that this was a fallback
-            rb_response["source"] = "rule-based"
-            rb_response["fallback_reason"] = fallback_reason
-            return rb_response
+            return await rule_based_fallback(request, fallback_reason)
         except Exception as e:
             return {"success": False, "error": f"LLM failed and rule-based fallback also failed: {str(e)}", "llm_error": fallback_reason}
 
-    # Basic safety checks on generated SQL
-    lowered = sql.lower()
-    forbidden = ["delete", "update", "insert", "drop", "alter", "create"]
-    # Disallow multiple statements by checking semicolons beyond a trailing one
-    if ";" in lowered.strip().rstrip(';'):
-        # Fallback to rule-based if generated SQL contains multiple statements
-        rb_response = await query_data({"query": query_text})
-        rb_response["source"] = "rule-based"
-        rb_response["fallback_reason"] = "Generated SQL contained multiple statements or semicolons"
-        return rb_response
-    if any(tok in lowered for tok in forbidden):
-        rb_response = await query_data({"query": query_text})
-        rb_response["source"] = "rule-based"
-        rb_response["fallback_reason"] = "Generated SQL contained forbidden operations"
-        return rb_response
-
-    # Ensure generated SQL references only known columns or *
-    if "*" not in sql:
-        cols_found = [c for c in column_names if c.lower() in lowered]
-        if not cols_found:
-            if not ("count(" in lowered or "avg(" in lowered or "sum(" in lowered or "group by" in lowered):
-                rb_response = await query_data({"query": query_text})
-                rb_response["source"] = "rule-based"
-                rb_response["fallback_reason"] = "Generated SQL didn't reference known columns"
-                return rb_response
+    # Compile under the read-only authorizer, repairing fences, quoting and
+    # misspelled identifiers locally instead of discarding the answer
+    with stage("validation"):
+        checked = await db.read(sql_repairer.repair, sql, schema)
+    if not checked.ok:
+        return await rule_based_fallback(request, checked.error)
+    sql = checked.sql
+    tag(sql=sql)
 
     # Execute the SQL
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        column_names_out = [description[0] for description in cursor.description] if cursor.description else []
-        results = [dict(zip(column_names_out, row)) for row in rows]
-        conn.close()
-
-        return {
+        response = {
             "success": True,
             "query": query_text,
             "sql_generated": sql,
-            "confidence": 0.9,
-            "results": results,
-            "total_results": len(results),
-            "metadata": {"database": table}
+            "confidence": confidence,
+            "metadata": {"database": table, "sql_source": sql_source}
         }
+        if checked.repairs:
+            response["metadata"]["sql_repairs"] = checked.repairs
+        if prompt_tokens:
+            response["metadata"]["prompt_tokens"] = prompt_tokens
+        if reused:
+            response["metadata"]["pattern"] = {"similarity": reused.similarity, "learned_from": reused.question}
+        delivered = await deliver_results(sql, options, response, table)
+        if isinstance(delivered, dict) and not delivered.get("success"):
+            return delivered
+        query_cache.translations.set(cache_key, sql)
+        if sql_source == "llm":
+            pattern_store.learn(query_text, schema, sql)
+            if pattern_store.needs_save():
+                await asyncio.to_thread(pattern_store.save)
+        return delivered
     except Exception as e:
         return {"success": False, "error": f"Execution failed: {str(e)}", "sql_generated": sql}
 
+@app.post("/api/query/batch")
+async def query_batch(request: dict):
+    """Answer several natural-language questions against one table in one request.
+
+    Expected request JSON: { "queries": ["question", {"query": "question", "id": "tile-2"}, ...],
+    "dataset": "optional_dataset_name", "format": "rows|columnar" } (``table`` is accepted
+    as an alias of ``dataset``). Results come back in
+    request order under ``items``, each shaped like an ``/api/ai-query`` response; an item
+    that fails carries its own error without failing the rest of the batch.
+    """
+    return await timed_query("query-batch", answer_batch, request)
+
+def repair_all(conn, texts, schema):
+    return [sql_repairer.repair(conn, text, schema) for text in texts]
+
+def fall_back(item, schema, reason):
+    item.sql, item.confidence, item.match = rule_sql(item.query, schema)
+    item.sql_source, item.fallback_reason = "fallback", reason
+
+async def execute_batch(items, schema, version):
+    """Run every item's SQL: result cache, then the columnar engine, then one
+    SQLite read transaction shared by all remaining statements."""
+    remaining = []
+    for item in items:
+        cached = query_cache.get_result(item.sql, version)
+        if cached is not None:
+            item.result, item.cached = cached, True
+        else:
+            remaining.append(item)
+    on_sqlite = []
+    for item in remaining:
+        try:
+            item.result = await run_columnar(item.sql, schema.name)
+        except Exception:
+            item.result = None
+        if item.result is None:
+            on_sqlite.append(item)
+        else:
+            query_cache.put_result(item.sql, version, item.result, len(item.result.rows))
+    if not on_sqlite:
+        return
+    outcomes = await db.read(query_guard.run_many, [(item.sql, ()) for item in on_sqlite], table_row_counts())
+    for item, outcome in zip(on_sqlite, outcomes):
+        if isinstance(outcome, QueryRejected):
+            item.error, item.guard = f"Query rejected: {str(outcome)}", outcome.to_dict()
+        elif isinstance(outcome, Exception):
+            item.error = f"Query execution failed: {str(outcome)}"
+        else:
+            item.result = outcome
+            query_cache.put_result(item.sql, version, outcome, len(outcome.rows))
+            index_advisor.observe(item.sql, schema)
+
+def batch_item_response(item, table, fmt):
+    response = {
+        "success": item.ok,
+        "query": item.query,
+        "sql_generated": item.sql or "",
+        "confidence": item.confidence if item.ok else 0.0,
+        "metadata": {"database": table, "sql_source": item.sql_source}
+    }
+    if item.id is not None:
+        response = {"id": item.id, **response}
+    metadata = response["metadata"]
+    if item.sql_source == "fallback":
+        response["source"] = "rule-based"
+        response["fallback_reason"] = item.fallback_reason
+        metadata["pattern"] = item.match.to_dict() if item.match else None
+    if item.repairs:
+        metadata["sql_repairs"] = item.repairs
+    if item.prompt_tokens:
+        metadata["prompt_tokens"] = item.prompt_tokens
+    if item.reused:
+        metadata["pattern"] = {"similarity": item.reused.similarity, "learned_from": item.reused.question}
+    if item.ok:
+        attach_rows(response, item.result, item.result.rows, item.cached, fmt)
+    else:
+        response.update({"error": item.error, "results": [], "total_results": 0})
+        if item.guard:
+            response["guard"] = item.guard
+    return response
+
+async def answer_batch(request):
+    entries = request.get("queries")
+    if not isinstance(entries, list) or not entries:
+        raise HTTPException(status_code=400, detail="Missing 'queries': expected a non-empty list of questions")
+    if len(entries) > batch_config.max_queries:
+        raise HTTPException(status_code=400, detail=f"At most {batch_config.max_queries} queries per batch")
+    try:
+        options = ResultOptions.from_request(request)
+        items = [BatchItem.parse(i, entry) for i, entry in enumerate(entries)]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if options.format == "ndjson" or options.cursor or options.page_size:
+        raise HTTPException(status_code=400, detail="Streaming and pagination are not available for batch queries")
+
+    table = await resolve_dataset(requested_dataset(request))
+    if not table:
+        return {
+            "success": False,
+            "error": "No dataset specified and no CSV uploaded. Please upload a CSV first or include a 'dataset' in the request.",
+            "items": []
+        }
+    tag(sql_source="batch")
+
+    # One schema lookup for the whole batch
+    try:
+        with stage("schema"):
+            schema = await get_table_schema(table)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch table schema: {str(e)}")
+
+    # Cache, rules and learned patterns first; only the rest needs the LLM
+    for item in items:
+        if not item.query:
+            item.error = "Missing 'query'"
+            continue
+        item.cache_key = query_cache.translation_key(item.query, schema.fingerprint)
+        item.sql, item.sql_source, item.confidence, item.reused = translate_locally(item.query, schema, item.cache_key)
+    pending = [item for item in items if item.error is None and item.sql is None]
+    for item in pending:
+        item.prompt, item.prompt_tokens = describe_for_llm(item.query, schema, table)
+    if pending:
+        # Concurrent calls, bounded; repeated questions share one in-flight call
+        with stage("llm"):
+            answers = await gather_limited(
+                [lambda item=item: query_cache.flights.do(item.cache_key, lambda: translate_with_llm(item.prompt))
+                 for item in pending],
+                batch_config.max_concurrent_llm_calls)
+        # A question asked twice in the batch shared one call: count it once
+        for timings in {item.cache_key: timings for item, (_, _, timings) in zip(pending, answers)}.values():
+            merge(timings)
+        for item, (sql, llm_error, _) in zip(pending, answers):
+            item.sql, item.sql_source = sql, "llm"
+            if not sql:
+                fall_back(item, schema, llm_error or "No LLM configured")
+
+    # Validate every generated statement on one read connection
+    to_check = [item for item in items if item.error is None and item.sql_source != "fallback"]
+    if to_check:
+        with stage("validation"):
+            checked = await db.read(repair_all, [item.sql for item in to_check], schema)
+        for item, result in zip(to_check, checked):
+            if result.ok:
+                item.sql, item.repairs = result.sql, result.repairs
+            else:
+                item.repairs = result.repairs
+                fall_back(item, schema, result.error)
+
+    version = registry.generation
+    with stage("sql"):
+        await execute_batch([item for item in items if item.error is None], schema, version)
+
+    for item in items:
+        if not item.ok or item.sql_source == "fallback":
+            continue
+        query_cache.translations.set(item.cache_key, item.sql)
+        if item.sql_source == "llm":
+            pattern_store.learn(item.query, schema, item.sql)
+    if pattern_store.needs_save():
+        await asyncio.to_thread(pattern_store.save)
+
+    with stage("materialize"):
+        results = [batch_item_response(item, table, options.format) for item in items]
+    succeeded = sum(1 for item in items if item.ok)
+    sources = {}
+    for item in items:
+        if item.sql_source:
+            sources[item.sql_source] = sources.get(item.sql_source, 0) + 1
+    return {
+        "success": True,
+        "total": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "items": results,
+        "metadata": {
+            "database": table,
+            "data_version": version,
+            "sent_to_llm": len(pending),
+            "sql_sources": sources
+        }
+    }
+
 if __name__ == "__main__":
-    print("🚀 Starting NLP Query Engine Backend...")
-    print("📊 Server will be available at: http://localhost:8000")
-    print("✅ CORS enabled for frontend at: http://localhost:3000")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="NLP Query Engine backend")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="worker processes sharing the database and dataset registry")
+    args = parser.parse_args()
+    logger.info("Starting NLP Query Engine Backend on http://%s:%d with %d worker(s) (CORS enabled for http://localhost:3000)",
+                args.host, args.port, args.workers)
+    if args.workers > 1:
+        # Each worker imports the app itself; they coordinate through the database
+        uvicorn.run("final_server:app", host=args.host, port=args.port, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,52 @@
+import json
+import urllib.request
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+from benchmarks import datagen, fake_llm
+from benchmarks.run import summarize
+
+
+def test_datagen_is_deterministic(tmp_path):
+    first = datagen.generate(str(tmp_path / "a.csv"), 500, shape="wide", columns=12, seed=7)
+    second = datagen.generate(str(tmp_path / "b.csv"), 500, shape="wide", columns=12, seed=7)
+    assert (first["rows"], first["columns"]) == (500, 12)
+    assert (tmp_path / "a.csv").read_bytes() == (tmp_path / "b.csv").read_bytes()
+    frame = pd.read_csv(tmp_path / "a.csv")
+    assert frame["order_id"].tolist() == list(range(1, 501))
+    with pytest.raises(ValueError):
+        datagen.generate(str(tmp_path / "c.csv"), 10, shape="tall")
+
+
+def test_fake_llm_answers_with_the_prompt_table():
+    prompt = "Table: sales\nColumns:\n- order_id integer\n- `Product Name` text\nCRITICAL RULES:\nQuery: top products\nSQL:"
+    sql = fake_llm.answer(prompt)
+    assert '"sales"' in sql and sql.startswith("SELECT")
+    assert fake_llm.answer(prompt) == sql
+    assert fake_llm.answer("no table here") == "SELECT 1"
+
+
+def test_fake_llm_serves_chat_completions():
+    server = fake_llm.start(latency=0.0)
+    try:
+        body = json.dumps({"model": "fake", "messages": [{"role": "user", "content": "Table: t\nQuery: q"}]})
+        request = urllib.request.Request(server.base_url + "/chat/completions", data=body.encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            reply = json.load(resp)
+        assert reply["choices"][0]["message"]["content"] == 'SELECT * FROM "t" LIMIT 100'
+        assert server.completions == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_summarize_reports_percentiles_and_errors():
+    summary = summarize([i / 1000 for i in range(1, 101)], Counter({"timeout": 2}), 2.0,
+                        Counter(rules=60), Counter(sqlite=100))
+    assert (summary["requests"], summary["errors"]) == (102, 2)
+    assert summary["p50_ms"] == pytest.approx(50.5)
+    assert summary["max_ms"] == 100.0
+    assert summary["throughput_rps"] == 50.0
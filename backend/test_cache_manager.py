@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from api.services import cache_manager
+from api.services.cache_manager import LRUCache, QueryCacheManager, SingleFlight
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_manager.time, "monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set("a", 1)
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.expirations == 1 and len(cache) == 0
+
+
+def test_translation_key_ignores_case_spacing_and_punctuation():
+    key = QueryCacheManager.translation_key
+    assert key("  Top 5 Products?", "f1") == key("top 5   products", "f1")
+    assert key("top 5 products", "f1") != key("top 5 products", "f2")
+
+
+def test_result_cache_skips_large_results_and_new_versions():
+    manager = QueryCacheManager(result_max_rows=10)
+    manager.put_result("SELECT 1", 1, "small", row_count=10)
+    manager.put_result("SELECT 2", 1, "large", row_count=11)
+    assert manager.get_result("SELECT  1", 1) == "small"
+    assert manager.get_result("SELECT 2", 1) is None
+    assert manager.get_result("SELECT 1", 2) is None
+
+
+def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "SELECT 1"
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do("q", fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["SELECT 1"] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {"in_flight": 0, "started": 1, "shared": 4}
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "SELECT 1"
+
+    async def scenario():
+        first = asyncio.ensure_future(flights.do("q", fetch))
+        second = asyncio.ensure_future(flights.do("q", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "SELECT 1"
+    assert flights.started == 1
+
+
+def test_failure_is_shared_and_not_remembered():
+    flights = SingleFlight()
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("provider down")
+        return "SELECT 1"
+
+    async def scenario():
+        failed = await asyncio.gather(flights.do("q", fetch), flights.do("q", fetch), return_exceptions=True)
+        return failed, await flights.do("q", fetch)
+
+    failed, retried = asyncio.run(scenario())
+    assert [str(e) for e in failed] == ["provider down"] * 2
+    assert retried == "SELECT 1"
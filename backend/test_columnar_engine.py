@@ -0,0 +1,190 @@
+import io
+import random
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from api.services import columnar_engine
+from api.services.columnar_engine import ColumnarEngine
+from api.services.document_processor import StreamingCSVLoader, layout_of
+from api.services.schema_discovery import analyze_table
+
+
+@pytest.fixture(scope="module")
+def conn():
+    rng = random.Random(7)
+    lines = ["region,category,price,qty,note"]
+    for i in range(5000):
+        price = "" if i % 97 == 0 else f"{rng.uniform(1, 500):.2f}"
+        note = "" if i % 13 == 0 else f"note {i}"
+        lines.append(f"{rng.choice(['east', 'west', 'north', 'south'])},{rng.choice('abcdef')},"
+                     f"{price},{rng.randint(1, 20)},{note}")
+    conn = sqlite3.connect(":memory:")
+    StreamingCSVLoader(chunk_rows=1000).replace(conn, io.BytesIO("\n".join(lines).encode()), "sales")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def schema(conn):
+    return analyze_table(conn, "sales")
+
+
+def answer(engine, conn, schema, sql):
+    stmt = engine.compile(sql, schema)
+    assert stmt is not None, sql
+    table = engine.view(schema, stmt.columns) or engine.load(conn, schema, stmt.columns)
+    assert table is not None, sql
+    return engine.run(stmt, table)
+
+
+def same_rows(left, right):
+    assert len(left) == len(right)
+    for a, b in zip(left, right):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert x == pytest.approx(y) if isinstance(y, float) else x == y
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT COUNT(*) FROM "sales"',
+    'SELECT SUM("price"), AVG("price"), MIN("price"), MAX("price") FROM "sales"',
+    'SELECT COUNT("price"), TOTAL("qty") FROM "sales" WHERE "region" = \'east\'',
+    'SELECT "region", COUNT(*) AS n FROM "sales" GROUP BY "region" ORDER BY "region"',
+    'SELECT "region", "category", AVG("price") AS a FROM "sales" '
+    'WHERE "qty" BETWEEN 5 AND 15 GROUP BY "region", "category" ORDER BY a DESC LIMIT 5',
+    'SELECT "category", SUM("qty") AS s FROM "sales" '
+    'WHERE "region" IN (\'west\', \'north\') OR "price" > 400 GROUP BY "category" ORDER BY s DESC, "category"',
+    'SELECT COUNT(*) FROM "sales" WHERE "price" IS NULL',
+    'SELECT COUNT(*) FROM "sales" WHERE NOT ("region" = \'south\' AND "qty" < 10)',
+    'SELECT COUNT(DISTINCT "category") FROM "sales" WHERE "price" >= 100',
+    'SELECT "region", MAX("note") AS m FROM "sales" GROUP BY "region" ORDER BY "region"',
+])
+def test_matches_sqlite(conn, schema, sql):
+    engine = ColumnarEngine(min_rows=0)
+    columns, rows = answer(engine, conn, schema, sql)
+    cursor = conn.execute(sql)
+    assert len(columns) == len(cursor.description)
+    same_rows(rows, cursor.fetchall())
+
+
+def test_loads_only_referenced_columns(conn, schema):
+    engine = ColumnarEngine(min_rows=0)
+    answer(engine, conn, schema, 'SELECT "region", SUM("qty") FROM "sales" GROUP BY "region"')
+    assert engine.stats()["tables"]["sales"]["columns"] == 2
+    answer(engine, conn, schema, 'SELECT AVG("price") FROM "sales"')
+    assert engine.stats()["tables"]["sales"]["columns"] == 3
+    assert engine.loads == 2
+
+
+def test_evicts_least_recently_used_columns(conn, schema):
+    engine = ColumnarEngine(min_rows=0, max_bytes=60_000)
+    answer(engine, conn, schema, 'SELECT SUM("qty") FROM "sales"')
+    answer(engine, conn, schema, 'SELECT SUM("price") FROM "sales"')
+    assert engine.evictions == 1
+    assert engine.view(schema, ["qty"]) is None
+    assert engine.view(schema, ["price"]) is not None
+    assert engine.bytes <= engine.max_bytes
+
+
+def test_over_budget_falls_back_to_sqlite(conn, schema):
+    engine = ColumnarEngine(min_rows=0, max_bytes=1000)
+    stmt = engine.compile('SELECT SUM("price") FROM "sales"', schema)
+    assert engine.load(conn, schema, stmt.columns) is None
+    assert engine.over_budget == 1
+    assert engine.bytes == 0
+
+
+def test_unsupported_statements_fall_back(schema):
+    engine = ColumnarEngine(min_rows=0)
+    assert engine.compile('SELECT * FROM "sales"', schema) is None
+    assert engine.compile('SELECT COUNT(*) FROM "sales" WHERE "note" LIKE \'%1%\'', schema) is None
+    assert engine.fallbacks == 2
+
+
+@pytest.fixture
+def db_file(conn, tmp_path):
+    path = str(tmp_path / "sales.db")
+    target = sqlite3.connect(path)
+    conn.backup(target)
+    target.close()
+    return path
+
+
+def load_in_thread(engine, db_file, schema, columns, out):
+    def run():
+        local = sqlite3.connect(db_file)
+        try:
+            out.append(engine.load(local, schema, columns))
+        finally:
+            local.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def slow_columns(monkeypatch):
+    """Make every column read wait for ``gate`` and count the reads."""
+    gate, reads = threading.Event(), []
+    load_column = columnar_engine._load_column
+
+    def slow(*args):
+        reads.append(args[2])
+        assert gate.wait(5)
+        return load_column(*args)
+
+    monkeypatch.setattr(columnar_engine, "_load_column", slow)
+    return gate, reads
+
+
+def test_view_and_invalidate_do_not_wait_for_a_load(db_file, schema, slow_columns):
+    gate, reads = slow_columns
+    engine, out = ColumnarEngine(min_rows=0), []
+    thread = load_in_thread(engine, db_file, schema, ["price"], out)
+    while not reads:
+        time.sleep(0.001)
+    started = time.perf_counter()
+    assert engine.view(schema, ["price"]) is None
+    engine.invalidate("sales")
+    assert time.perf_counter() - started < 0.5
+    gate.set()
+    thread.join()
+    # The load still answers its caller but keeps nothing invalidated meanwhile
+    assert out[0].columns["price"] is not None
+    assert engine.view(schema, ["price"]) is None
+    assert engine.bytes == 0
+
+
+def test_concurrent_loads_of_a_table_read_it_once(db_file, schema, slow_columns):
+    gate, reads = slow_columns
+    engine, out = ColumnarEngine(min_rows=0), []
+    threads = [load_in_thread(engine, db_file, schema, ["price", "qty"], out) for _ in range(3)]
+    while not reads:
+        time.sleep(0.001)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert sorted(reads) == ["price", "qty"]
+    assert len(out) == 3 and all(sorted(v.columns) == ["price", "qty"] for v in out)
+    assert engine.view(schema, ["price", "qty"]) is not None
+
+
+def test_reload_after_invalidation_sees_new_rows(db_file, schema):
+    engine = ColumnarEngine(min_rows=0)
+    stmt = engine.compile('SELECT SUM("qty") FROM "sales"', schema)
+    local = sqlite3.connect(db_file)
+    try:
+        before = engine.run(stmt, engine.load(local, schema, stmt.columns))[1][0][0]
+        storage = layout_of(local, "sales").storage
+        local.execute(f'UPDATE "{storage}" SET "qty" = "qty" + 1')
+        local.commit()
+        # Unchanged cache until the catalog entry changes
+        assert engine.run(stmt, engine.view(schema, stmt.columns))[1] == [(before,)]
+        engine.invalidate("sales")
+        assert engine.view(schema, stmt.columns) is None
+        assert engine.run(stmt, engine.load(local, schema, stmt.columns))[1] == [(before + 5000,)]
+    finally:
+        local.close()
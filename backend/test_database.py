@@ -0,0 +1,80 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from api.services.database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "pool.db"), read_pool_size=2)
+    yield db
+    db.close()
+
+
+def create(conn):
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(100)])
+
+
+def test_reads_share_a_bounded_pool(db):
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_count(conn):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+    async def scenario():
+        await db.write(create)
+        return await asyncio.gather(*(db.read(slow_count) for _ in range(6)))
+
+    assert asyncio.run(scenario()) == [100] * 6
+    assert peak[0] == 2
+    stats = db.stats()
+    assert (stats["reads"], stats["writes"], stats["read_connections_open"]) == (6, 1, 2)
+    assert stats["read_connections_in_use"] == 0
+
+
+def test_readers_cannot_write(db):
+    async def scenario():
+        await db.write(create)
+        await db.read(lambda conn: conn.execute("DELETE FROM t"))
+
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(scenario())
+    assert db.stats()["errors"] == 1
+
+
+def test_failed_write_rolls_back(db):
+    def half_done(conn):
+        conn.execute("DELETE FROM t")
+        raise RuntimeError("boom")
+
+    async def scenario():
+        await db.write(create)
+        with pytest.raises(RuntimeError):
+            await db.write(half_done)
+        return await db.fetch("SELECT COUNT(*) FROM t")
+
+    assert asyncio.run(scenario()) == (["COUNT(*)"], [(100,)])
+
+
+def test_abandoned_stream_returns_its_connection(db):
+    async def scenario():
+        await db.write(create)
+        stream = db.stream("SELECT x FROM t", batch_size=10)
+        columns, rows = await stream.__anext__()
+        await stream.aclose()
+        return columns, rows
+
+    assert asyncio.run(scenario()) == (["x"], [(i,) for i in range(10)])
+    assert db.stats()["read_connections_in_use"] == 0
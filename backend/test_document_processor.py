@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+from api.services.database import connect
+from api.services.document_processor import StreamingCSVLoader, layout_of, table_exists
+from api.services.type_inference import IngestOptions
+
+
+def csv_file(rows, header="id,region,amount") -> io.BytesIO:
+    return io.BytesIO((header + "\n" + "".join(f"{','.join(map(str, row))}\n" for row in rows)).encode())
+
+
+def sales(n, start=0):
+    return [(i, ["east", "west"][i % 2], i * 0.5) for i in range(start, start + n)]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(str(tmp_path / "ingest.db"))
+    yield conn
+    conn.close()
+
+
+def test_loads_in_chunks(conn):
+    result = StreamingCSVLoader(chunk_rows=100).load(conn, csv_file(sales(1050)), "sales")
+    assert (result.rows, result.chunks) == (1050, 11)
+    assert conn.execute("SELECT COUNT(*), SUM(amount) FROM sales").fetchone() == (1050, sum(r[2] for r in sales(1050)))
+
+
+def test_column_is_widened_when_a_later_chunk_does_not_fit(conn):
+    rows = sales(300) + [(300, "east", "unknown")]
+    result = StreamingCSVLoader(chunk_rows=100).load(conn, csv_file(rows), "sales")
+    assert result.rows == 301
+    assert result.types["amount"] == "text"
+    assert result.types["id"] == "integer"
+    assert conn.execute("SELECT amount FROM sales WHERE id = 300").fetchone() == ("unknown",)
+
+
+def test_low_cardinality_text_is_dictionary_encoded(conn):
+    # Planned from the first chunk, which must reach dictionary_min_rows
+    options = IngestOptions(dictionary_min_rows=500)
+    result = StreamingCSVLoader(chunk_rows=500, options=options).replace(conn, csv_file(sales(2000)), "sales")
+    assert list(result.layout.dictionaries) == ["region"]
+    assert layout_of(conn, "sales").encoded
+    assert conn.execute("SELECT region, COUNT(*) FROM sales GROUP BY region").fetchall() == [("east", 1000), ("west", 1000)]
+    assert {type(v) for (v,) in conn.execute('SELECT region FROM "sales__data"')} == {int}
+
+
+def test_replace_swaps_while_readers_keep_the_old_rows(conn, tmp_path):
+    loader = StreamingCSVLoader(chunk_rows=100)
+    loader.replace(conn, csv_file(sales(300)), "sales")
+    reader = connect(str(tmp_path / "ingest.db"), readonly=True)
+    try:
+        reader.execute("BEGIN")
+        assert reader.execute("SELECT COUNT(*) FROM sales").fetchone() == (300,)
+        loader.replace(conn, csv_file(sales(500)), "sales")
+        # The open read transaction still sees the version it started on
+        assert reader.execute("SELECT COUNT(*) FROM sales").fetchone() == (300,)
+        reader.execute("COMMIT")
+        assert reader.execute("SELECT COUNT(*) FROM sales").fetchone() == (500,)
+    finally:
+        reader.close()
+    leftovers = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '\\_%' ESCAPE '\\'").fetchall()
+    assert leftovers == []
+
+
+def test_failed_replace_leaves_the_live_table(conn):
+    loader = StreamingCSVLoader(chunk_rows=100)
+    loader.replace(conn, csv_file(sales(300)), "sales")
+
+    def fail(conn, layout):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        loader.replace(conn, csv_file(sales(50)), "sales", prepare=fail)
+    assert conn.execute("SELECT COUNT(*) FROM sales").fetchone() == (300,)
+    assert not any(table_exists(conn, name) for (name,) in
+                   conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%staging%'"))
+
+
+@pytest.mark.parametrize("upsert, amounts", [(False, (0.0, 0.5)), (True, (100.0, 0.5))])
+def test_keyed_append_and_upsert(conn, upsert, amounts):
+    loader = StreamingCSVLoader(chunk_rows=100)
+    loader.replace(conn, csv_file(sales(200)), "sales")
+    # id 0 exists, 999 is new and appears twice in the delta: its last row wins
+    delta = [(0, "east", 100.0), (999, "west", 1.0), (999, "west", 2.0)]
+    result = loader.append(conn, csv_file(delta), "sales", key="id", upsert=upsert)
+    assert (result.inserted, result.updated) == (1, 1 if upsert else 0)
+    assert result.skipped == (1 if upsert else 2)
+    assert conn.execute("SELECT COUNT(*) FROM sales").fetchone() == (201,)
+    assert conn.execute("SELECT amount FROM sales WHERE id IN (0, 1) ORDER BY id").fetchall() == [(a,) for a in amounts]
+    assert conn.execute("SELECT amount FROM sales WHERE id = 999").fetchone() == (2.0,)
+
+
+def test_upsert_requires_a_key(conn):
+    loader = StreamingCSVLoader()
+    loader.replace(conn, csv_file(sales(10)), "sales")
+    with pytest.raises(ValueError, match="key"):
+        loader.append(conn, csv_file(sales(1)), "sales", upsert=True)
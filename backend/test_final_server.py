@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.services.llm_client import LLMClient, Provider
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config_enhanced.json")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """The app, run from a scratch directory with thread ingestion and no LLM."""
+    workdir = tmp_path_factory.mktemp("server")
+    with open(CONFIG_PATH) as fh:
+        config = json.load(fh)
+    config["ingest_jobs"] = dict(config.get("ingest_jobs", {}), executor="thread")
+    config["index_advisor"] = dict(config.get("index_advisor", {}), enabled=False)
+    with open(workdir / "config.json", "w") as fh:
+        json.dump(config, fh)
+
+    patch = pytest.MonkeyPatch()
+    patch.chdir(workdir)
+    patch.setenv("NLP_ENGINE_CONFIG", str(workdir / "config.json"))
+    for name in ("OPENAI_API_KEY", "HUGGINGFACE_API_TOKEN", "HF_API_TOKEN"):
+        patch.delenv(name, raising=False)
+    import final_server
+    try:
+        with TestClient(final_server.app) as client:
+            yield final_server, client
+    finally:
+        patch.undo()
+
+
+def upload(client, dataset, rows, mode="replace"):
+    body = "id,region,amount\n" + "".join(f"{i},{['east', 'west'][i % 2]},{i}\n" for i in range(rows))
+    resp = client.post("/api/upload", files={"file": (f"{dataset}.csv", body.encode(), "text/csv")},
+                       data={"dataset": dataset, "mode": mode})
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def test_stale_sync_does_not_overwrite_newer_schema(server, monkeypatch):
+    fs, client = server
+    upload(client, "synced", 10)
+    stale = fs.catalog.get("synced")
+    stale_version = fs.applied_versions["synced"]
+    upload(client, "synced", 25)
+    assert fs.catalog.get("synced").row_count == 25
+
+    # A sync that read the registry before the second upload finishes last
+    async def read(fn, *args):
+        return [("synced", stale, stale_version)]
+
+    monkeypatch.setattr(fs.db, "read", read)
+    asyncio.run(fs.sync_datasets())
+    assert fs.catalog.get("synced").row_count == 25
+
+
+def test_sync_applies_other_workers_changes(server):
+    fs, client = server
+    upload(client, "elsewhere", 10)
+    version = fs.applied_versions["elsewhere"]
+    # Another worker removes the dataset: only the shared registry changes
+    conn = fs.db._connect(readonly=False)
+    try:
+        fs.registry.remove(conn, "elsewhere")
+        conn.commit()
+    finally:
+        conn.close()
+    client.get("/api/datasets")
+    assert fs.catalog.get("elsewhere") is None
+    assert fs.applied_versions["elsewhere"] > version
+
+
+@pytest.fixture
+def published(server, monkeypatch):
+    """The timers of requests as they are published to ``/metrics``."""
+    fs, _ = server
+    timers = []
+    observe = fs.observe_request
+
+    def capture(timer, *args):
+        timers.append(timer)
+        return observe(timer, *args)
+
+    monkeypatch.setattr(fs, "observe_request", capture)
+    return timers
+
+
+def test_database_calls_record_on_the_calling_request(server):
+    fs, _ = server
+
+    async def scenario():
+        timer = fs.start_request("query")
+        await fs.db.read(lambda conn: fs.merge({"read": 1.0}))
+        await fs.db.write(lambda conn: fs.merge({"write": 2.0}))
+        return timer
+
+    assert asyncio.run(scenario()).stages == {"read": 1.0, "write": 2.0}
+
+
+def test_ndjson_is_published_after_the_stream(server, published):
+    fs, client = server
+    upload(client, "streamed", 30)
+    with client.stream("POST", "/api/query", json={"query": "show all", "dataset": "streamed",
+                                                   "format": "ndjson"}) as resp:
+        assert resp.status_code == 200
+        lines = [json.loads(line) for line in resp.iter_lines() if line]
+    assert lines[-1] == {"done": True, "total_results": 30}
+    # Published once the body was sent, with the time spent sending it
+    [timer] = published
+    assert "stream" in timer.stages
+
+
+def test_single_flight_joiners_get_provider_timings(server, published, monkeypatch):
+    fs, client = server
+    upload(client, "asked", 10)
+
+    class SlowProvider(Provider):
+        name = "slow"
+
+        async def complete(self, prompt):
+            await asyncio.sleep(0.05)
+            return 'SELECT region FROM "asked"'
+
+    provider = SlowProvider(timeout=1.0)
+    monkeypatch.setattr(fs, "llm_client", LLMClient([provider]))
+    request = {"query": "zorblax quuxity of the frobnicated widgets", "dataset": "asked"}
+
+    async def scenario():
+        return await asyncio.gather(*(fs.timed_query("ai-query", fs.answer_ai_query, dict(request))
+                                      for _ in range(2)))
+
+    asyncio.run(scenario())
+    assert provider.calls == 1
+    assert len(published) == 2
+    assert all(timer.stages.get("llm:slow", 0) >= 0.05 for timer in published)
+
+
+def test_cursor_pages_through_and_expires_on_new_data(server):
+    _, client = server
+    upload(client, "paged", 25)
+    body = {"query": "show all", "dataset": "paged", "page_size": 10}
+    seen, pages = [], 0
+    while True:
+        page = client.post("/api/query", json=body).json()
+        assert page["success"], page
+        seen += [row["id"] for row in page["results"]]
+        pages += 1
+        if not page["has_more"]:
+            break
+        body = {"dataset": "paged", "cursor": page["next_cursor"]}
+    assert (pages, sorted(seen)) == (3, list(range(25)))
+
+    first = client.post("/api/query", json={"query": "show all", "dataset": "paged", "page_size": 10}).json()
+    upload(client, "paged", 5)
+    stale = client.post("/api/query", json={"dataset": "paged", "cursor": first["next_cursor"]}).json()
+    assert not stale["success"] and "expired" in stale["error"]
+    resp = client.post("/api/query", json={"dataset": "paged", "cursor": first["next_cursor"][:-4] + "AAAA"})
+    assert resp.status_code == 400
+
+
+def test_batch_reports_failures_per_item(server, monkeypatch):
+    fs, client = server
+    upload(client, "batched", 10)
+
+    class OverflowingProvider(Provider):
+        name = "overflowing"
+
+        async def complete(self, prompt):
+            # Compiles, then fails while running
+            return 'SELECT abs(-9223372036854775808) FROM "batched"'
+
+    monkeypatch.setattr(fs, "llm_client", LLMClient([OverflowingProvider(timeout=1.0)]))
+    resp = client.post("/api/query/batch", json={"dataset": "batched", "queries": [
+        "average amount", {"id": "blank", "query": ""}, {"id": "llm", "query": "blorptastic gizmo quotient"},
+    ]})
+    assert resp.status_code == 200
+    batch = resp.json()
+    assert (batch["total"], batch["succeeded"], batch["failed"]) == (3, 1, 2)
+    ok, blank, failed = batch["items"]
+    assert ok["success"] and ok["metadata"]["sql_source"] == "rules"
+    assert ok["results"] == [{"avg_amount": 4.5}]
+    assert (blank["id"], blank["success"], blank["error"]) == ("blank", False, "Missing 'query'")
+    assert failed["id"] == "llm" and not failed["success"]
+    assert failed["error"].startswith("Query execution failed") and "overflow" in failed["error"]
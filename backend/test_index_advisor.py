@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+from api.services.dataset_registry import DatasetRegistry
+from api.services.index_advisor import IndexAdvisor, parse_index_key
+from api.services.schema_discovery import SchemaCatalog, analyze_table
+
+REGION_QUERY = "SELECT * FROM sales WHERE region = 'r1'"
+PRICE_QUERY = "SELECT * FROM sales WHERE price > 5"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "advisor.db")
+    conn = sqlite3.connect(path)
+    DatasetRegistry().install(conn)
+    conn.execute("CREATE TABLE sales (region TEXT, price REAL)")
+    conn.executemany("INSERT INTO sales VALUES (?, ?)", [(f"r{i % 50}", i) for i in range(20000)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def catalog(db_path):
+    catalog = SchemaCatalog()
+    conn = sqlite3.connect(db_path)
+    catalog.put(analyze_table(conn, "sales"))
+    conn.close()
+    return catalog
+
+
+def worker(db_path, catalog, *queries, **options):
+    """An advisor and writer connection standing in for one server process."""
+    advisor = IndexAdvisor(**options)
+    for sql, times in queries:
+        for _ in range(times):
+            advisor.observe(sql, catalog.get("sales"))
+    return advisor, sqlite3.connect(db_path)
+
+
+def auto_indexes(conn):
+    return sorted(r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'auto_idx_%'"))
+
+
+def expire_lease(conn):
+    conn.execute("UPDATE _nlq_state SET value = json_set(value, '$.expires', 0) WHERE key = 'index_maintenance'")
+    conn.commit()
+
+
+def test_only_the_lease_holder_builds(db_path, catalog):
+    first, conn1 = worker(db_path, catalog, (REGION_QUERY, 3))
+    second, conn2 = worker(db_path, catalog, (REGION_QUERY, 3), (PRICE_QUERY, 3))
+    assert [a["action"] for a in first.maintain(conn1, catalog)] == ["create"]
+    assert second.maintain(conn2, catalog) == []
+    assert not second.holds_lease
+    assert len(auto_indexes(conn1)) == 1
+    # The first worker keeps the lease on its next pass
+    first.maintain(conn1, catalog)
+    assert first.holds_lease
+
+
+def test_indexes_from_other_workers_count_toward_the_cap(db_path, catalog):
+    first, conn1 = worker(db_path, catalog, (REGION_QUERY, 3), max_indexes_per_table=1)
+    second, conn2 = worker(db_path, catalog, (PRICE_QUERY, 5), max_indexes_per_table=1)
+    first.maintain(conn1, catalog)
+    built = auto_indexes(conn1)
+
+    second.maintain(conn2, catalog)
+    assert [r.key for r in second._indexes.values()] == [("region",)]
+    assert second.report()["storage_used_bytes"] > 0
+
+    expire_lease(conn1)
+    actions = second.maintain(conn2, catalog)
+    assert [(a["action"], a.get("index")) for a in actions][0] == ("drop", built[0])
+    assert actions[1]["key"] == ["price"]
+    assert len(auto_indexes(conn2)) == 1
+
+    # The first worker forgets the index dropped elsewhere and adopts the new one
+    first.maintain(conn1, catalog)
+    assert [r.key for r in first._indexes.values()] == [("price",)]
+    assert not first.holds_lease
+
+
+def test_parse_index_key():
+    sql = 'CREATE INDEX "auto_idx_t" ON "t""x" ("a", LOWER("b c"), "d""e")'
+    assert parse_index_key(sql) == ("a", "lower(b c)", 'd"e')
+    assert parse_index_key(None) is None
+
+
+def test_pass_builds_at_most_the_cap(db_path, catalog):
+    queries = [(f"SELECT * FROM sales WHERE {q}", 3) for q in
+               ("region = 'r1'", "price > 5", "LOWER(region) = 'r2'", "region = 'r3' AND price < 9")]
+    advisor, conn = worker(db_path, catalog, *queries, max_builds_per_pass=2)
+    assert len(advisor.begin_pass(conn, catalog)) == 2
+    assert len([a for a in advisor.maintain(conn, catalog) if a["action"] == "create"]) == 2
+    assert len([a for a in advisor.maintain(conn, catalog) if a["action"] == "create"]) == 2
+    assert len(auto_indexes(conn)) == 4
+
+
+def test_steps_time_on_a_reader_and_build_on_the_writer(db_path, catalog):
+    advisor, writer = worker(db_path, catalog, (REGION_QUERY, 3))
+    reader = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    [candidate] = advisor.begin_pass(writer, catalog)
+    before = advisor.time_query(reader, candidate.last_sql)
+    [action] = advisor.build(writer, candidate, catalog)
+    assert not writer.in_transaction
+    action = advisor.record_timing(action["name"], before, advisor.time_query(reader, candidate.last_sql))
+    assert action["action"] == "create" and action["key"] == ["region"]
+    assert action["before_ms"] is not None and action["after_ms"] is not None
+    assert advisor.report()["indexes"][0]["speedup"] == action["speedup"]
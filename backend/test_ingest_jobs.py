@@ -0,0 +1,123 @@
+import os
+import uuid
+
+import pytest
+
+from api.services.database import connect
+from api.services.dataset_registry import DatasetRegistry
+from api.services.ingest_jobs import IngestJob, IngestTask, JobStore, run_job
+
+CHUNK_ROWS = 100
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = connect(path)
+    DatasetRegistry().install(conn)
+    JobStore().install(conn)
+    conn.close()
+    return path
+
+
+def write_csv(tmp_path, rows: int, start: int = 0) -> str:
+    path = str(tmp_path / f"upload_{uuid.uuid4().hex}.csv")
+    with open(path, "w") as fh:
+        fh.write("id,region,amount\n")
+        for i in range(start, start + rows):
+            fh.write(f"{i},{['east', 'west'][i % 2]},{i * 0.5}\n")
+    return path
+
+
+def submit(db_path, spool_path, mode="replace", key=None) -> IngestTask:
+    job = IngestJob(id=uuid.uuid4().hex, dataset="sales", filename="sales.csv", mode=mode,
+                    total_bytes=os.path.getsize(spool_path))
+    conn = connect(db_path)
+    try:
+        JobStore().insert(conn, job)
+    finally:
+        conn.close()
+    return IngestTask(job_id=job.id, db_path=db_path, spool_path=spool_path, dataset="sales",
+                      filename="sales.csv", mode=mode, key=key, chunk_rows=CHUNK_ROWS, busy_timeout=5.0)
+
+
+def tables(conn):
+    return sorted(r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+
+def snapshot(db_path):
+    conn = connect(db_path, readonly=True)
+    try:
+        return {
+            "rows": conn.execute('SELECT COUNT(*), SUM(amount) FROM "sales"').fetchone(),
+            "generation": conn.execute("SELECT value FROM _nlq_state WHERE key = 'generation'").fetchone()[0],
+            "registered": conn.execute("SELECT row_count FROM _nlq_datasets WHERE name = 'sales'").fetchone(),
+            "tables": tables(conn),
+        }
+    finally:
+        conn.close()
+
+
+def cancel_after(monkeypatch, chunks: int):
+    """Set the job's cancel flag while chunk ``chunks + 1`` is being written."""
+    progress = JobStore.progress
+
+    def flagging(self, conn, job_id, rows, bytes_read):
+        if rows > chunks * CHUNK_ROWS:
+            conn.execute("UPDATE _nlq_jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return progress(self, conn, job_id, rows, bytes_read)
+
+    monkeypatch.setattr(JobStore, "progress", flagging)
+
+
+def test_job_loads_and_publishes(tmp_path, db_path):
+    job = run_job(submit(db_path, write_csv(tmp_path, 1000)))
+    assert job["state"] == "succeeded", job["error"]
+    assert job["result"]["ingestion"]["rows"] == 1000
+    state = snapshot(db_path)
+    assert state["rows"][0] == 1000
+    assert state["registered"] == (1000,)
+    assert state["generation"] == job["result"]["generation"]
+
+
+@pytest.mark.parametrize("mode, key", [("replace", None), ("append", None), ("upsert", "id")])
+def test_cancel_mid_chunk_leaves_dataset_unchanged(tmp_path, db_path, monkeypatch, mode, key):
+    assert run_job(submit(db_path, write_csv(tmp_path, 1000)))["state"] == "succeeded"
+    before = snapshot(db_path)
+
+    cancel_after(monkeypatch, chunks=3)
+    spool = write_csv(tmp_path, 2000, start=500)
+    job = run_job(submit(db_path, spool, mode, key))
+
+    assert job["state"] == "cancelled"
+    assert job["rows_processed"] == 3 * CHUNK_ROWS  # the chunk in flight was rolled back
+    assert job["result"] is None
+    assert snapshot(db_path) == before
+    assert not os.path.exists(spool)
+
+
+def test_cancelled_before_start_never_runs(tmp_path, db_path):
+    task = submit(db_path, write_csv(tmp_path, 1000))
+    conn = connect(db_path)
+    try:
+        assert JobStore().request_cancel(conn, task.job_id)
+        job = run_job(task)
+        assert job["state"] == "cancelled"
+        assert job["started_at"] is None
+        assert "sales" not in tables(conn)
+    finally:
+        conn.close()
+
+
+def test_invalid_upload_fails_cleanly(tmp_path, db_path):
+    spool = str(tmp_path / "empty.csv")
+    open(spool, "w").close()
+    job = run_job(submit(db_path, spool))
+    assert job["state"] == "failed"
+    assert job["error_kind"] == "invalid"
+    conn = connect(db_path, readonly=True)
+    try:
+        assert tables(conn) == ["_nlq_datasets", "_nlq_jobs", "_nlq_state"]
+    finally:
+        conn.close()
+
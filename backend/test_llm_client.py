@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from api.services.llm_client import CircuitBreaker, LLMClient, LLMError, Provider
+
+
+class FakeProvider(Provider):
+    def __init__(self, name, delay=0.0, text="SELECT 1", error=None, breaker=None):
+        super().__init__(timeout=1.0, breaker=breaker)
+        self.name = name
+        self.delay = delay
+        self.text = text
+        self.error = error
+        self.started = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.started += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise LLMError(self.error)
+        return self.text
+
+
+def half_open(breaker: CircuitBreaker) -> CircuitBreaker:
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+    return breaker
+
+
+def test_breaker_opens_then_allows_one_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    half_open(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_fails_over_to_next_provider():
+    primary = FakeProvider("primary", error="boom")
+    client = LLMClient([primary, FakeProvider("backup", text="SELECT 2")])
+    result = asyncio.run(client.generate("q"))
+    assert (result.text, result.provider, result.hedged) == ("SELECT 2", "backup", False)
+    assert result.errors == ["primary: boom"]
+    assert primary.breaker.failures == 1
+
+
+def test_open_circuit_is_skipped():
+    broken = FakeProvider("broken", breaker=CircuitBreaker(failure_threshold=1))
+    broken.breaker.record_failure()
+    client = LLMClient([broken, FakeProvider("backup")])
+    result = asyncio.run(client.generate("q"))
+    assert result.provider == "backup"
+    assert broken.started == 0
+    assert result.errors == ["broken: circuit open"]
+
+
+def test_all_circuits_open():
+    broken = FakeProvider("broken", breaker=CircuitBreaker(failure_threshold=1))
+    broken.breaker.record_failure()
+    with pytest.raises(LLMError, match="circuit open"):
+        asyncio.run(LLMClient([broken]).generate("q"))
+
+
+def test_hedge_wins_over_slow_primary():
+    slow, fast = FakeProvider("slow", delay=1.0), FakeProvider("fast", text="SELECT 2")
+    client = LLMClient([slow, fast], hedge_after=0.02)
+    started = time.perf_counter()
+    result = asyncio.run(client.generate("q"))
+    assert time.perf_counter() - started < 0.5
+    assert (result.provider, result.hedged) == ("fast", True)
+    assert (client.hedges_fired, client.hedge_wins) == (1, 1)
+    # The losing call was cancelled, not counted as a failure
+    assert slow.failures == 0 and slow.breaker.state == "closed"
+
+
+def test_cancelled_probe_waiting_on_semaphore_is_released():
+    primary = FakeProvider("primary", delay=0.1)
+    probe = FakeProvider("probe", breaker=half_open(CircuitBreaker()))
+    client = LLMClient([primary, probe], max_concurrency=2, hedge_after=0.05)
+
+    async def scenario():
+        # Another request holds one slot; once the primary has the other, a
+        # second request queues for it, ahead of the hedge
+        await client.semaphore.acquire()
+        request = asyncio.ensure_future(client.generate("q"))
+        await asyncio.sleep(0.01)
+        queued = asyncio.ensure_future(client.semaphore.acquire())
+        result = await asyncio.wait_for(request, 2)
+        queued.cancel()
+        return result
+
+    result = asyncio.run(scenario())
+    assert (result.provider, result.hedged) == ("primary", True)
+    assert probe.started == 0  # cancelled while waiting for a slot
+    assert probe.breaker.state == "half_open"
+    assert probe.breaker.allow()
+
+
+def test_cancelled_probe_in_flight_is_released():
+    primary = FakeProvider("primary", delay=0.05)
+    probe = FakeProvider("probe", delay=1.0, breaker=half_open(CircuitBreaker()))
+    client = LLMClient([primary, probe], hedge_after=0.01)
+    assert asyncio.run(client.generate("q")).provider == "primary"
+    assert probe.started == 1
+    assert probe.breaker.allow()
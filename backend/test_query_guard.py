@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from api.services.query_guard import GuardConfig, QueryGuard, QueryRejected
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE orders (id INTEGER, customer TEXT, amount REAL)")
+    conn.execute("CREATE TABLE customers (id INTEGER, name TEXT)")
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", [(i, f"c{i % 10}", i * 1.5) for i in range(200)])
+    conn.executemany("INSERT INTO customers VALUES (?, ?)", [(i, f"c{i}") for i in range(10)])
+    yield conn
+    conn.close()
+
+
+def test_rejects_cartesian_join_of_large_tables(conn):
+    guard = QueryGuard(GuardConfig(max_join_rows=1_000_000))
+    with pytest.raises(QueryRejected) as err:
+        guard.run(conn, "SELECT * FROM orders, customers",
+                  row_counts={"orders": 200_000, "customers": 50_000})
+    assert err.value.reason == "cartesian_product"
+    assert err.value.details["estimated_rows"] == 200_000 * 50_000
+    assert guard.rejections == {"cartesian_product": 1}
+
+
+def test_allows_the_same_join_on_small_tables(conn):
+    guard = QueryGuard(GuardConfig(max_join_rows=1_000_000))
+    result = guard.run(conn, "SELECT COUNT(*) FROM orders, customers",
+                       row_counts={"orders": 200, "customers": 10})
+    assert result.rows == [(2000,)]
+
+
+def test_aborts_statement_past_the_deadline(conn):
+    guard = QueryGuard(GuardConfig(timeout_seconds=0.05))
+    endless = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+               "SELECT COUNT(*) FROM n")
+    with pytest.raises(QueryRejected) as err:
+        guard.run(conn, endless)
+    assert err.value.reason == "deadline_exceeded"
+    assert err.value.details["limit_seconds"] == 0.05
+    # The deadline is removed afterwards: the connection runs normally again.
+    assert conn.execute("SELECT COUNT(*) FROM orders").fetchone() == (200,)
+
+
+def test_vm_step_budget(conn):
+    guard = QueryGuard(GuardConfig(max_vm_steps=5000))
+    with pytest.raises(QueryRejected) as err:
+        guard.run(conn, "SELECT SUM(a.amount) FROM orders a, orders b")
+    assert err.value.reason == "vm_step_limit"
+
+
+def test_rejects_writes(conn):
+    guard = QueryGuard()
+    with pytest.raises(QueryRejected) as err:
+        guard.run(conn, "DELETE FROM orders")
+    assert err.value.reason == "not_read_only"
+    assert conn.execute("SELECT COUNT(*) FROM orders").fetchone() == (200,)
+
+
+def test_caps_unbounded_scan_of_large_table(conn):
+    guard = QueryGuard(GuardConfig(max_rows=50, large_table_rows=100))
+    result = guard.run(conn, "SELECT id FROM orders", row_counts={"orders": 200})
+    assert result.plan.rewritten
+    assert result.truncated
+    assert len(result.rows) == 50
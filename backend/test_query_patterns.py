@@ -0,0 +1,138 @@
+import sqlite3
+
+import pytest
+
+from api.services.query_patterns import PatternStore, RuleBasedEngine
+from api.services.schema_discovery import analyze_table
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE sales (region TEXT, price REAL, category TEXT, qty INTEGER)")
+    conn.executemany("INSERT INTO sales VALUES (?, ?, ?, ?)", [
+        ("east", 10, "a", 1), ("west", 60, "b", 2), ("north", 40, "a", 3), ("east", 50, "b", 4),
+    ])
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def translate(conn):
+    engine, schema = RuleBasedEngine(), analyze_table(conn, "sales")
+    return lambda question: engine.translate(question, schema)
+
+
+@pytest.mark.parametrize("question, condition", [
+    ("price greater than 50", '"price" > 50'),
+    ("price is not greater than 50", '"price" <= 50'),
+    ("price not less than 50", '"price" >= 50'),
+    ("price isn't above 20", '"price" <= 20'),
+    ("price never over 40", '"price" <= 40'),
+])
+def test_negated_comparators(translate, question, condition):
+    match = translate(question)
+    assert match is not None
+    assert f"WHERE {condition}" in match.sql
+
+
+def test_negated_filter_returns_the_complement(conn, translate):
+    prices = [row[1] for row in conn.execute(translate("price is not greater than 50").sql)]
+    assert sorted(prices) == [10, 40, 50]
+
+
+@pytest.mark.parametrize("question, column", [
+    ("total price per categories", "category"),
+    ("average price by regions", "region"),
+    ("count by categories", "category"),
+])
+def test_plural_mentions_link_to_columns(translate, question, column):
+    match = translate(question)
+    assert match is not None
+    assert f'GROUP BY "{column}"' in match.sql
+
+
+def test_distinct_count_of_plural_column(conn, translate):
+    match = translate("number of distinct regions")
+    assert 'COUNT(DISTINCT "region")' in match.sql
+    assert conn.execute(match.sql).fetchone() == (3,)
+
+
+def test_distinct_cue_without_a_column_is_not_answered(translate):
+    assert translate("number of distinct things") is None
+
+
+def test_unattached_cues_lower_confidence(translate):
+    assert translate("count by region").confidence > translate("average by region").confidence
+    assert translate("how many regions").confidence < 0.7
+
+
+LEARNED_QUESTION = "which sales in the east region had price over 30"
+LEARNED_SQL = """SELECT * FROM "sales" WHERE "region" = 'east' AND "price" > 30"""
+
+
+@pytest.fixture
+def learned(conn):
+    schema = analyze_table(conn, "sales")
+    store = PatternStore()
+    store.learn(LEARNED_QUESTION, schema, LEARNED_SQL)
+    return store, schema
+
+
+def test_paraphrase_reuses_sql_with_new_literals(learned):
+    store, schema = learned
+    reused = store.lookup("sales in west region with price above 45", schema)
+    assert reused.sql == """SELECT * FROM "sales" WHERE "region" = 'west' AND "price" > 45"""
+    assert store.threshold <= reused.similarity < 1.0
+    assert reused.question == LEARNED_QUESTION
+
+
+@pytest.mark.parametrize("question", [
+    "which sales in the west region had average price over 45",  # different aggregate
+    "what is the total qty by category",  # unrelated
+])
+def test_different_intent_is_not_reused(learned, question):
+    store, schema = learned
+    assert store.lookup(question, schema) is None
+
+
+def test_patterns_are_scoped_to_the_table_shape(conn, learned):
+    store, _ = learned
+    conn.execute("CREATE TABLE wider AS SELECT *, 0 AS extra FROM sales")
+    try:
+        assert store.lookup(LEARNED_QUESTION, analyze_table(conn, "wider")) is None
+    finally:
+        conn.execute("DROP TABLE wider")
+
+
+def test_least_recently_used_pattern_is_evicted(conn):
+    schema = analyze_table(conn, "sales")
+    store = PatternStore(max_patterns=1)
+    store.learn(LEARNED_QUESTION, schema, LEARNED_SQL)
+    store.learn("total qty by category", schema, 'SELECT "category", SUM("qty") FROM "sales" GROUP BY "category"')
+    assert (len(store), store.evictions) == (1, 1)
+    assert store.lookup(LEARNED_QUESTION, schema) is None
+
+
+def test_workers_saving_to_one_file_keep_each_others_patterns(conn, tmp_path):
+    schema = analyze_table(conn, "sales")
+    path = str(tmp_path / "patterns.json")
+    first, second = PatternStore(path), PatternStore(path)
+    first.learn("average price by region", schema,
+                'SELECT "region", AVG("price") FROM "sales" GROUP BY "region"')
+    second.learn("total quantity by category", schema,
+                 'SELECT "category", SUM("qty") FROM "sales" GROUP BY "category"')
+    first.save()
+    second.save()
+    assert len(second) == 2  # adopted what the first worker saved
+
+    restarted = PatternStore(path)
+    assert restarted.load() == 2
+    assert restarted.lookup("average price by region", schema) is not None
+    assert restarted.lookup("total quantity by category", schema) is not None
+
+    # A later save by the first worker must not drop the second worker's pattern
+    first.learn("maximum price by category", schema,
+                'SELECT "category", MAX("price") FROM "sales" GROUP BY "category"')
+    first.save()
+    assert PatternStore(path).load() == 3
@@ -0,0 +1,67 @@
+import asyncio
+import base64
+import json
+import sqlite3
+
+import pytest
+
+from api.services.result_pager import CursorCodec, CursorError, ResultOptions, ndjson_lines, paginate_sql
+
+
+def test_cursor_round_trip():
+    codec = CursorCodec(secret=b"k")
+    token = codec.encode("SELECT * FROM sales", 50, 3, "sales", 25)
+    assert codec.decode(token) == {"sql": "SELECT * FROM sales", "offset": 50, "version": 3,
+                                   "table": "sales", "page_size": 25}
+
+
+def test_tampered_cursor_is_rejected():
+    codec = CursorCodec(secret=b"k")
+    body, signature = base64.urlsafe_b64decode(codec.encode("SELECT * FROM sales", 50, 3, "sales", 25)).rsplit(b".", 1)
+    forged = body.replace(b"SELECT * FROM sales", b"SELECT * FROM users")
+    with pytest.raises(CursorError, match="signature"):
+        codec.decode(base64.urlsafe_b64encode(forged + b"." + signature).decode())
+
+
+def test_cursor_from_another_secret_is_rejected():
+    token = CursorCodec(secret=b"other").encode("SELECT 1", 0, 1, None, 10)
+    with pytest.raises(CursorError, match="signature"):
+        CursorCodec(secret=b"k").decode(token)
+
+
+@pytest.mark.parametrize("token", ["not base64!", base64.urlsafe_b64encode(b"no signature").decode()])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(CursorError):
+        CursorCodec(secret=b"k").decode(token)
+
+
+@pytest.mark.parametrize("request_body, error", [
+    ({"format": "xml"}, "Unknown format"),
+    ({"page_size": 0}, "page_size"),
+])
+def test_invalid_result_options(request_body, error):
+    with pytest.raises(ValueError, match=error):
+        ResultOptions.from_request(request_body)
+
+
+def test_paginate_sql_applies_on_top_of_the_query():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+    sql = paginate_sql("SELECT x FROM t ORDER BY x DESC LIMIT 5;")
+    assert conn.execute(sql, (3, 3)).fetchall() == [(6,), (5,)]
+
+
+def test_ndjson_reports_a_failure_after_the_header():
+    async def batches():
+        yield ["x"], [(1,), (2,)]
+        raise RuntimeError("deadline exceeded")
+
+    async def collect():
+        return [json.loads(line) async for chunk in ndjson_lines({"success": True}, batches())
+                for line in chunk.decode().splitlines()]
+
+    lines = asyncio.run(collect())
+    assert lines[0] == {"success": True, "columns": ["x"]}
+    assert lines[1:3] == [[1], [2]]
+    assert lines[-1] == {"done": False, "error": "deadline exceeded", "total_results": 2}
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from api.services.schema_discovery import SchemaCatalog, TableSchema, analyze_table
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE sales (region TEXT, amount REAL)")
+    conn.executemany("INSERT INTO sales VALUES (?, ?)", [("east", 1.5), ("west", 4.0), ("east", None)])
+    yield conn
+    conn.close()
+
+
+def test_analyze_collects_stats_in_one_pass(conn):
+    schema = analyze_table(conn, "sales")
+    assert schema.row_count == 3
+    region, amount = schema.columns
+    assert (region.inferred_type, region.distinct_count, sorted(region.values)) == ("text", 2, ["east", "west"])
+    assert (amount.inferred_type, amount.null_count, amount.min_value, amount.max_value) == ("real", 1, 1.5, 4.0)
+    assert schema.value_dictionary()["west"] == [("region", "west")]
+
+
+def test_missing_table(conn):
+    with pytest.raises(LookupError):
+        analyze_table(conn, "nope")
+
+
+def test_catalog_versions_every_change(conn):
+    catalog = SchemaCatalog()
+    first = catalog.refresh(conn, "sales")
+    conn.execute("INSERT INTO sales VALUES ('north', 9.0)")
+    second = catalog.refresh(conn, "sales")
+    assert (first.version, second.version, catalog.version) == (1, 2, 2)
+    assert catalog.get("sales").row_count == 4
+    # New rows keep the shape, so cached translations stay valid
+    assert first.fingerprint == second.fingerprint
+    catalog.drop("sales")
+    catalog.drop("sales")
+    assert catalog.get("sales") is None and catalog.version == 3
+
+
+def test_fingerprint_changes_with_the_shape(conn):
+    before = analyze_table(conn, "sales").fingerprint
+    conn.execute("ALTER TABLE sales ADD COLUMN qty INTEGER")
+    assert analyze_table(conn, "sales").fingerprint != before
+
+
+def test_json_round_trip(conn):
+    schema = analyze_table(conn, "sales")
+    assert TableSchema.from_json(schema.to_json()) == schema
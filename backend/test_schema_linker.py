@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from api.services.schema_discovery import analyze_table
+from api.services.schema_linker import MIN_COLUMNS, SchemaLinker
+
+METRICS = [f"metric_{i}" for i in range(1, 25)]
+
+
+@pytest.fixture(scope="module")
+def schema():
+    conn = sqlite3.connect(":memory:")
+    columns = ["city TEXT", "customer_name TEXT", "order_date TEXT", "price REAL"] + [f"{m} REAL" for m in METRICS]
+    conn.execute(f"CREATE TABLE wide ({', '.join(columns)})")
+    conn.executemany(f"INSERT INTO wide VALUES ({', '.join('?' * len(columns))})", [
+        (city, f"c{i}", f"2024-01-{i + 1:02d}", 10.0 * i, *(float(i + j) for j in range(len(METRICS))))
+        for i, city in enumerate(["mumbai", "delhi", "pune", "mumbai"])
+    ])
+    schema = analyze_table(conn, "wide")
+    conn.close()
+    return schema
+
+
+def linked_names(linked):
+    return [col.name for col in linked.columns]
+
+
+def test_named_columns_are_linked_in_table_order(schema):
+    linked = SchemaLinker(max_columns=10).link("price by customer name in mumbai", schema)
+    # "mumbai" is a value of city; the rest are backfilled up to MIN_COLUMNS
+    assert linked_names(linked)[:4] == ["city", "customer_name", "order_date", "price"]
+    assert len(linked.columns) == MIN_COLUMNS
+    assert set(n for n, score in linked.scores.items() if score >= 0.3) == {"city", "customer_name", "price"}
+
+
+@pytest.mark.parametrize("threshold, relevant", [
+    (0.3, ["customer_name", "metric_3", "metric_7"]),
+    (0.6, ["metric_3", "metric_7"]),
+])
+def test_threshold(schema, threshold, relevant):
+    linked = SchemaLinker(max_columns=10, threshold=threshold).link("metric_3 and metric_7 for each customer", schema)
+    assert sorted(n for n, score in linked.scores.items() if score >= threshold) == relevant
+    # Name words shared by many columns ("metric") count for little on their own
+    assert linked.scores.get("metric_1", 0) < 0.3
+
+
+def test_cap_keeps_the_best_scoring(schema):
+    linked = SchemaLinker(max_columns=2).link("metric_3 and metric_7 for each customer", schema)
+    assert list(linked.scores)[:2] == ["metric_3", "metric_7"]
+    assert len(linked.columns) == MIN_COLUMNS
+
+
+def test_small_tables_are_sent_whole(schema):
+    linked = SchemaLinker(max_columns=50).link("price", schema)
+    assert not linked.pruned
+    assert len(linked.columns) == len(schema.columns)
+
+
+def test_text_bounds_on_numeric_column_are_ignored(schema):
+    price = next(col for col in schema.columns if col.name == "price")
+    bounds = price.min_value, price.max_value
+    price.min_value, price.max_value = "n/a", "unknown"
+    try:
+        assert "price" not in SchemaLinker().score("orders over 25", schema)
+    finally:
+        price.min_value, price.max_value = bounds
+    assert SchemaLinker().score("orders over 25", schema)["price"] == pytest.approx(0.15)
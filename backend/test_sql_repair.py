@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from api.services.schema_discovery import analyze_table
+from api.services.sql_repair import SQLRepairer, split_statements, strip_fences
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute('CREATE TABLE sales ("Product Name" TEXT, "Discount%" REAL, region TEXT, amount REAL)')
+    conn.executemany("INSERT INTO sales VALUES (?, ?, ?, ?)", [
+        ("Widget", 5.0, "east", 100.0), ("Gadget", 10.0, "west", 250.0), ("Widget", 0.0, "west", 75.0),
+    ])
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def schema(conn):
+    return analyze_table(conn, "sales")
+
+
+def test_repair_round_trip(conn, schema):
+    repairer = SQLRepairer()
+    text = ("Here is the query:\n```sql\n"
+            "SELECT Product Name, SUM(amout) AS total FROM sale WHERE Discount% > 1 GROUP BY Product Name;\n"
+            "```\nThis sums the amounts per product.")
+    result = repairer.repair(conn, text, schema)
+    assert result.ok, result.error
+    assert "column amout -> amount" in result.repairs
+    assert "table sale -> sales" in result.repairs
+    assert conn.execute(result.sql).fetchall() == [("Gadget", 250.0), ("Widget", 100.0)]
+    assert repairer.stats()["repaired"] == 1
+
+
+def test_valid_sql_is_left_alone(conn, schema):
+    sql = "SELECT region, COUNT(*) FROM sales WHERE region = 'a;b' GROUP BY region"
+    result = SQLRepairer().repair(conn, sql, schema)
+    assert result.ok
+    assert result.sql == sql
+    assert result.repairs == []
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO sales VALUES ('x', 0, 'north', 1)",
+    "DELETE FROM sales",
+    "DROP TABLE sales",
+    "PRAGMA writable_schema = 1",
+    "ATTACH DATABASE ':memory:' AS other",
+    "WITH doomed AS (SELECT 1) UPDATE sales SET amount = 0",
+])
+def test_authorizer_rejects_writes(conn, schema, sql):
+    repairer = SQLRepairer()
+    result = repairer.repair(conn, sql, schema)
+    assert not result.ok
+    assert repairer.rejected == {"not_read_only": 1}
+    assert conn.execute("SELECT COUNT(*) FROM sales").fetchone() == (3,)
+
+
+def test_rejects_smuggled_second_statement(conn, schema):
+    result = SQLRepairer().repair(conn, "SELECT * FROM sales; DROP TABLE sales", schema)
+    assert not result.ok
+    assert "multiple statements" in result.error
+
+
+def test_unrepairable_name_is_rejected(conn, schema):
+    repairer = SQLRepairer()
+    result = repairer.repair(conn, "SELECT shipping_cost FROM sales", schema)
+    assert not result.ok
+    assert repairer.rejected == {"invalid": 1}
+
+
+def test_split_statements_skips_literals_and_comments():
+    assert split_statements("SELECT ';' AS a -- ; here\n; SELECT \"x;y\" FROM t /* ; */") == [
+        "SELECT ';' AS a -- ; here", "SELECT \"x;y\" FROM t /* ; */",
+    ]
+
+
+@pytest.mark.parametrize("text, sql", [
+    ("Here is the query: SELECT region FROM sales", "SELECT region FROM sales"),
+    ("Sure, with pleasure: select * from sales limit 5", "select * from sales limit 5"),
+    ("Using a CTE: WITH t AS (SELECT 1) SELECT * FROM t", "WITH t AS (SELECT 1) SELECT * FROM t"),
+    ("SQL: SELECT 1\n\nThis returns one.", "SELECT 1"),
+])
+def test_strip_fences_finds_the_query_after_prose(text, sql):
+    assert strip_fences(text) == sql
+
+
+def test_repairs_one_line_answer(conn, schema):
+    result = SQLRepairer().repair(conn, "Here is the query: SELECT COUNT(*) FROM sales WHERE region = 'west'", schema)
+    assert result.ok, result.error
+    assert conn.execute(result.sql).fetchone() == (2,)